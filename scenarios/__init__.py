@@ -0,0 +1,122 @@
+"""Golden-output scenarios shared by the tests of every stage.
+
+A scenario is a JSON file in this directory listing the steps of a session
+with the banking program. Each step sends an input and lists what the output
+of that input is expected to contain:
+
+    {"input": "{number}\\n{pin}",
+     "expect": [{"contains": "successfully", "message": "..."}]}
+
+An expectation is one of
+  - {"regex": ...}: a line of the output matches the regex; its named groups
+    become variables that later inputs can use, e.g. {number};
+  - {"contains": ...}: a line contains the text, ignoring case;
+  - either of the above with "absent": true: no line matches;
+  - {"distinct": [a, b, ...]}: the variables a, b, ... all differ.
+
+A step may also "generate" random variables before its input is sent:
+{"wrong_pin": {"digits": 4, "differs_from": "pin"}} is four random digits
+other than the PIN, and "prefix" puts fixed digits in front.
+
+Inputs are formatted with the variables, so a scenario that depends on the
+menu of a stage takes the option as a variable, e.g. {logout}.
+
+Scenarios are compiled once per test run and cached, and the expectations of
+a step are checked in a single pass over its output.
+"""
+
+import functools
+import json
+import os
+import random
+import re
+from collections import namedtuple
+
+SCENARIO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# error is None if the session went as the scenario expects; variables holds
+# everything captured or generated along the way.
+Result = namedtuple('Result', 'error variables')
+
+
+class Expectation:
+    def __init__(self, spec):
+        self.message = spec['message']
+        self.absent = spec.get('absent', False)
+        self.regex = re.compile(spec['regex']) if 'regex' in spec else None
+        self.text = spec['contains'].lower() if 'contains' in spec else None
+        self.distinct = spec.get('distinct')
+
+    # Returns the variables captured from the line, or None if it doesn't match.
+    def search(self, line, lowered):
+        if self.regex is None:
+            return {} if self.text in lowered else None
+        match = self.regex.search(line)
+        return match.groupdict() if match else None
+
+
+class Step:
+    def __init__(self, spec):
+        self.input = spec['input']
+        self.generate = spec.get('generate', {})
+        expectations = [Expectation(e) for e in spec.get('expect', ())]
+        self.required = [e for e in expectations if e.distinct is None and not e.absent]
+        self.forbidden = [e for e in expectations if e.distinct is None and e.absent]
+        self.distinct = [e for e in expectations if e.distinct is not None]
+
+    def generate_variables(self, variables):
+        for name, spec in self.generate.items():
+            value = variables.get(spec.get('differs_from'))
+            while value == variables.get(spec.get('differs_from')):
+                value = spec.get('prefix', '') + f"{random.randrange(10 ** spec['digits']):0{spec['digits']}d}"
+            variables[name] = value
+
+    # Returns the message of the first unmet expectation, or None.
+    def check(self, output, variables):
+        pending = self.required
+        for line in output.splitlines():
+            if not pending and not self.forbidden:
+                break
+            lowered = line.lower()
+            for expectation in self.forbidden:
+                if expectation.search(line, lowered) is not None:
+                    return expectation.message
+            unmet = []
+            for expectation in pending:
+                captured = expectation.search(line, lowered)
+                if captured is None:
+                    unmet.append(expectation)
+                else:
+                    variables.update(captured)
+            pending = unmet
+        if pending:
+            return pending[0].message
+
+        for expectation in self.distinct:
+            values = [variables[name] for name in expectation.distinct]
+            if len(set(values)) != len(values):
+                return expectation.message
+        return None
+
+
+class Scenario:
+    def __init__(self, name, spec):
+        self.name = name
+        self.steps = [Step(step) for step in spec['steps']]
+
+    # Plays the scenario on a program with an execute(input) -> output method,
+    # such as TestedProgram, starting from the given variables.
+    def run(self, program, **variables):
+        for step in self.steps:
+            step.generate_variables(variables)
+            output = program.execute(step.input.format_map(variables))
+            error = step.check(output, variables)
+            if error is not None:
+                return Result(error, variables)
+        return Result(None, variables)
+
+
+@functools.lru_cache(maxsize=None)
+def load(name):
+    with open(os.path.join(SCENARIO_DIR, name + '.json')) as file:
+        return Scenario(name, json.load(file))
@@ -1,10 +1,27 @@
 package main
 
 import (
+	"bufio"
+	"encoding/binary"
+	"errors"
+	"flag"
 	"fmt"
+	"io"
+	"log"
 	"math/rand"
+	"os"
 )
 
+// IIN is the issuer identification number every card number starts with
+const IIN = 400000
+
+// SnapshotMagic identifies account snapshot files
+const SnapshotMagic = "BANKSNP1"
+
+// snapshotRecordSize is the size of one account in a snapshot: number (uint64),
+// PIN (uint16) and balance (int64), little-endian and unpadded
+const snapshotRecordSize = 8 + 2 + 8
+
 // Main menu options
 const (
 	MainMenuCreateAccount = "1. Create an account"
@@ -31,23 +48,162 @@ const (
 	LoggedOutMsg        = "You have successfully logged out!"
 	GoodbyeMsg          = "Bye!"
 	CardCreatedMsg      = "Your card has been created"
-	CardNumberMsg       = "Your card number:\n%s\n"
-	CardPINMsg          = "Your card PIN:\n%s\n\n"
+	CardNumberMsg       = "Your card number:\n%016d\n"
+	CardPINMsg          = "Your card PIN:\n%04d\n\n"
 	BalanceMsg          = "Balance: %d"
 )
 
+// parseDigits packs a string of exactly n decimal digits into an integer.
+func parseDigits(s string, n int) (uint64, bool) {
+	if len(s) != n {
+		return 0, false
+	}
+
+	var value uint64
+	for i := 0; i < len(s); i++ {
+		if s[i] < '0' || s[i] > '9' {
+			return 0, false
+		}
+		value = value*10 + uint64(s[i]-'0')
+	}
+
+	return value, true
+}
+
+// Card is an account record. The 16-digit card number and the 4-digit PIN are
+// stored packed, so a card costs no string allocations.
 type Card struct {
-	Number string
-	PIN    string
+	Number  uint64
+	PIN     uint16
+	Balance int64
+}
+
+// AccountEngine keeps the cards in one array-backed slice and indexes them
+// by card number in a hash map, so a lookup costs the same no matter how many
+// accounts exist.
+type AccountEngine struct {
+	cards []Card
+	index map[uint64]uint32
+}
+
+func NewAccountEngine(capacity int) *AccountEngine {
+	return &AccountEngine{
+		cards: make([]Card, 0, capacity),
+		index: make(map[uint64]uint32, capacity),
+	}
+}
+
+// Add stores card and reports whether its number was still free.
+func (e *AccountEngine) Add(card Card) bool {
+	if _, ok := e.index[card.Number]; ok {
+		return false
+	}
+
+	e.index[card.Number] = uint32(len(e.cards))
+	e.cards = append(e.cards, card)
+	return true
+}
+
+// Find returns the card with the given number.
+func (e *AccountEngine) Find(number uint64) (*Card, bool) {
+	i, ok := e.index[number]
+	if !ok {
+		return nil, false
+	}
+	return &e.cards[i], true
+}
+
+func (e *AccountEngine) Len() int {
+	return len(e.cards)
+}
+
+// SaveSnapshot writes every card to path. The file is replaced atomically, so
+// a crash never leaves a truncated snapshot behind.
+func (e *AccountEngine) SaveSnapshot(path string) error {
+	tmp := path + ".tmp"
+	file, err := os.Create(tmp)
+	if err != nil {
+		return err
+	}
+
+	w := bufio.NewWriter(file)
+	var record [snapshotRecordSize]byte
+
+	w.WriteString(SnapshotMagic)
+	binary.LittleEndian.PutUint64(record[:8], uint64(len(e.cards)))
+	w.Write(record[:8])
+
+	for _, card := range e.cards {
+		binary.LittleEndian.PutUint64(record[0:8], card.Number)
+		binary.LittleEndian.PutUint16(record[8:10], card.PIN)
+		binary.LittleEndian.PutUint64(record[10:18], uint64(card.Balance))
+		w.Write(record[:])
+	}
+
+	if err := w.Flush(); err != nil {
+		file.Close()
+		return err
+	}
+	if err := file.Close(); err != nil {
+		return err
+	}
+	return os.Rename(tmp, path)
+}
+
+// LoadSnapshot reads the cards saved by SaveSnapshot.
+func LoadSnapshot(path string) (*AccountEngine, error) {
+	file, err := os.Open(path)
+	if err != nil {
+		return nil, err
+	}
+	defer file.Close()
+
+	info, err := file.Stat()
+	if err != nil {
+		return nil, err
+	}
+
+	r := bufio.NewReader(file)
+	var header [len(SnapshotMagic) + 8]byte
+	if _, err := io.ReadFull(r, header[:]); err != nil {
+		return nil, fmt.Errorf("failed to read the snapshot header: %w", err)
+	}
+	if string(header[:len(SnapshotMagic)]) != SnapshotMagic {
+		return nil, fmt.Errorf("%s is not an account snapshot", path)
+	}
+
+	count := binary.LittleEndian.Uint64(header[len(SnapshotMagic):])
+	// Check the count against the file size before sizing the engine from it,
+	// so a truncated or corrupt header can't trigger a huge allocation.
+	remaining := uint64(info.Size() - int64(len(header)))
+	if count > remaining/snapshotRecordSize || count*snapshotRecordSize != remaining {
+		return nil, fmt.Errorf("%s is corrupt: header claims %d accounts but %d bytes of records follow",
+			path, count, remaining)
+	}
+	engine := NewAccountEngine(int(count))
+
+	var record [snapshotRecordSize]byte
+	for i := uint64(0); i < count; i++ {
+		if _, err := io.ReadFull(r, record[:]); err != nil {
+			return nil, fmt.Errorf("failed to read account %d of the snapshot: %w", i, err)
+		}
+		engine.Add(Card{
+			Number:  binary.LittleEndian.Uint64(record[0:8]),
+			PIN:     binary.LittleEndian.Uint16(record[8:10]),
+			Balance: int64(binary.LittleEndian.Uint64(record[10:18])),
+		})
+	}
+
+	return engine, nil
 }
 
 type BankingSystem struct {
-	Cards []Card
+	Accounts *AccountEngine
 }
 
 func NewBankingSystem() *BankingSystem {
 	return &BankingSystem{
-		Cards: make([]Card, 0),
+		Accounts: NewAccountEngine(0),
 	}
 }
 
@@ -76,16 +232,18 @@ func (bs *BankingSystem) MainMenu() {
 
 func (bs *BankingSystem) CreateAccount() {
 	cardNumber, pin := bs.GenerateCardAndPIN()
-	bs.Cards = append(bs.Cards, Card{cardNumber, pin})
+	for !bs.Accounts.Add(Card{Number: cardNumber, PIN: pin}) {
+		cardNumber, pin = bs.GenerateCardAndPIN()
+	}
 
 	fmt.Println("\n" + CardCreatedMsg)
 	fmt.Printf(CardNumberMsg, cardNumber)
 	fmt.Printf(CardPINMsg, pin)
 }
 
-func (bs *BankingSystem) GenerateCardAndPIN() (string, string) {
-	cardNumber := "400000" + fmt.Sprintf("%010d", rand.Intn(10000000000))
-	pin := fmt.Sprintf("%04d", rand.Intn(10000))
+func (bs *BankingSystem) GenerateCardAndPIN() (uint64, uint16) {
+	cardNumber := IIN*10000000000 + uint64(rand.Int63n(10000000000))
+	pin := uint16(rand.Intn(10000))
 	return cardNumber, pin
 }
 
@@ -98,8 +256,10 @@ func (bs *BankingSystem) Login() {
 	var pin string
 	fmt.Scanln(&pin)
 
-	for _, c := range bs.Cards {
-		if c.Number == cardNumber && c.PIN == pin {
+	number, validNumber := parseDigits(cardNumber, 16)
+	code, validPIN := parseDigits(pin, 4)
+	if validNumber && validPIN {
+		if card, ok := bs.Accounts.Find(number); ok && uint64(card.PIN) == code {
 			fmt.Println("\n" + LoggedInMsg)
 			bs.AccountOperationsMenu()
 			return
@@ -133,6 +293,25 @@ func (bs *BankingSystem) AccountOperationsMenu() {
 }
 
 func main() {
+	snapshot := flag.String("snapshot", "", "load the accounts from this file at startup and save them back on exit")
+	flag.Parse()
+
 	bs := NewBankingSystem()
+	if *snapshot != "" {
+		engine, err := LoadSnapshot(*snapshot)
+		switch {
+		case err == nil:
+			bs.Accounts = engine
+		case !errors.Is(err, os.ErrNotExist):
+			log.Fatalf("failed to load %s: %v", *snapshot, err)
+		}
+	}
+
 	bs.MainMenu()
+
+	if *snapshot != "" {
+		if err := bs.Accounts.SaveSnapshot(*snapshot); err != nil {
+			log.Fatalf("failed to save %s: %v", *snapshot, err)
+		}
+	}
 }
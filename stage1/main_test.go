@@ -0,0 +1,41 @@
+package main
+
+import (
+	"encoding/binary"
+	"os"
+	"path/filepath"
+	"testing"
+)
+
+func TestLoadSnapshotRejectsCorruptFiles(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "accounts.snap")
+	engine := NewAccountEngine(0)
+	engine.Add(Card{Number: 4000000000000002, PIN: 1234, Balance: 100})
+	engine.Add(Card{Number: 4000000000000010, PIN: 4321, Balance: -5})
+	if err := engine.SaveSnapshot(path); err != nil {
+		t.Fatal(err)
+	}
+	loaded, err := LoadSnapshot(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if card, ok := loaded.Find(4000000000000010); loaded.Len() != 2 || !ok || card.Balance != -5 {
+		t.Fatalf("loaded %d cards, want the 2 saved", loaded.Len())
+	}
+
+	saved, err := os.ReadFile(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	truncated := saved[:len(saved)-3]
+	huge := append([]byte(nil), saved...)
+	binary.LittleEndian.PutUint64(huge[len(SnapshotMagic):], 1<<62)
+	for name, contents := range map[string][]byte{"truncated": truncated, "corrupt": huge} {
+		if err := os.WriteFile(path, contents, 0o644); err != nil {
+			t.Fatal(err)
+		}
+		if _, err := LoadSnapshot(path); err == nil {
+			t.Errorf("LoadSnapshot accepted a %s snapshot", name)
+		}
+	}
+}
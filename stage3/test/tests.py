@@ -1,16 +1,98 @@
+import atexit
 import os
-import random
+import queue
 import re
 import shutil
 import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
 
 from hstest import dynamic_test, StageTest, CheckResult, TestedProgram
 
+# The golden-output scenarios at the root of the course are shared by every stage.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import scenarios  # noqa: E402
+
+
+class WarmSession:
+    """A banking program kept running across dynamic tests.
+
+    hstest stops every TestedProgram at the end of its test, so tests that
+    don't check how the program starts or exits share this subprocess instead
+    and skip a build, a start and a migration each. execute() mirrors
+    TestedProgram.execute(): it sends the input and returns the output up to
+    the point where the program waits for input again. Tests isolate their
+    state by creating fresh cards rather than by deleting rows.
+    """
+
+    # Lines the program prints right before it reads input.
+    prompts = ('0. Exit', 'Enter your card number:', 'Enter your PIN:')
+
+    def __init__(self, command, logout_option, timeout=10):
+        self.logout_option = logout_option
+        self.timeout = timeout
+        self.last_prompt = None
+        self.in_account_menu = False
+        self.lines = queue.Queue()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, text=True, bufsize=1)
+        threading.Thread(target=self.read_output, daemon=True).start()
+        self.read_until_prompts(1)
+
+    def read_output(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def read_until_prompts(self, count):
+        output = []
+        previous = ''
+        while count > 0:
+            try:
+                line = self.lines.get(timeout=self.timeout)
+            except queue.Empty:
+                raise Exception(f"The program didn't ask for input within {self.timeout}s:\n" + ''.join(output))
+            if line is None:
+                raise Exception("The program exited in the middle of a shared session:\n" + ''.join(output))
+            output.append(line)
+            stripped = line.strip()
+            if stripped in self.prompts:
+                count -= 1
+                self.last_prompt = stripped
+                self.in_account_menu = stripped == '0. Exit' and 'log out' in previous.lower()
+            previous = stripped
+        return ''.join(output)
+
+    def execute(self, text):
+        self.process.stdin.write(text + '\n')
+        self.process.stdin.flush()
+        return self.read_until_prompts(text.count('\n') + 1)
+
+    # Brings the program back to the main menu, logging out or answering an
+    # open prompt with an empty line.
+    def reset(self):
+        while self.in_account_menu or self.last_prompt != '0. Exit':
+            self.execute(self.logout_option if self.in_account_menu else '')
+
+    def close(self):
+        if self.process.poll() is not None:
+            return
+        try:
+            self.reset()
+            self.process.stdin.write('0\n')
+            self.process.stdin.close()
+            self.process.wait(timeout=self.timeout)
+        except Exception:
+            self.process.kill()
+
 
 class SimpleBankSystemTest(StageTest):
     database_file_name = 'card.s3db'
     temp_database_file_name = 'tempDatabase.s3db'
     args = ['-fileName', database_file_name]
+    logout_option = '2'
     table_name = 'cards'
     correct_data = {}
 
@@ -18,6 +100,7 @@ class SimpleBankSystemTest(StageTest):
     pin_pattern = re.compile(r'^\d{4}$', re.MULTILINE)
 
     connection = None
+    session = None
 
     @dynamic_test(time_limit=60000)
     def test1_check_database_file(self):
@@ -178,129 +261,54 @@ class SimpleBankSystemTest(StageTest):
 
     @dynamic_test(time_limit=60000)
     def test6_check_log_in(self):
-        program = TestedProgram()
-        program.start(*self.args)
-
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-
-        if not card_number_matcher:
-            return CheckResult.wrong("You are printing the card number " +
-                                     "incorrectly. The card number should look like in the example:" +
-                                     " 400000DDDDDDDDDD, where D is a digit.")
-
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not pin_matcher:
-            return CheckResult.wrong("You are printing the card PIN " +
-                                     "incorrectly. The PIN should look like in the example: DDDD, where D is a digit.")
-
-        correct_pin = pin_matcher.group().strip()
-        correct_card_number = card_number_matcher.group()
-
-        program.execute("2")
-        output = program.execute(correct_card_number + "\n" + correct_pin)
-
-        if "successfully" not in output.lower():
-            return CheckResult.wrong("The user should be signed in after" +
-                                     " entering the correct card information.")
+        program = self.warm_session()
 
-        self.stop_and_check_if_user_program_was_stopped(program)
+        result = scenarios.load('log_in_and_log_out').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
         return CheckResult.correct()
 
     @dynamic_test(time_limit=60000)
     def test7_check_log_in_with_wrong_pin(self):
-        program = TestedProgram()
-        program.start(*self.args)
+        program = self.warm_session()
 
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not card_number_matcher or not pin_matcher:
-            return CheckResult.wrong("You should output card number and PIN like in example")
+        result = scenarios.load('log_in_with_wrong_pin').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
-        correct_card_number = card_number_matcher.group()
-        correct_pin = pin_matcher.group()
-
-        incorrect_pin = correct_pin
-
-        while correct_pin == incorrect_pin:
-            incorrect_pin = str(1000 + random.randint(0, 8999))
-
-        program.execute("2")
-        output = program.execute(correct_card_number + "\n" + incorrect_pin)
-
-        if "successfully" in output.lower():
-            return CheckResult.wrong("The user should not be signed in" +
-                                     " after entering incorrect card information.")
-
-        self.stop_and_check_if_user_program_was_stopped(program)
         return CheckResult.correct()
 
     @dynamic_test(time_limit=60000)
     def test8_check_log_in_to_not_existing_account(self):
-        program = TestedProgram()
-        program.start(*self.args)
-
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not card_number_matcher or not pin_matcher:
-            return CheckResult.wrong("You should output card number and PIN like in example")
+        program = self.warm_session()
 
-        correct_card_number = card_number_matcher.group()
+        result = scenarios.load('log_in_to_not_existing_account').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
-        random.seed()
-
-        correct_pin = pin_matcher.group().strip()
-        incorrect_card_number = correct_card_number
-
-        while correct_card_number == incorrect_card_number:
-            incorrect_card_number = '400000' + str(100000000 + random.randint(0, 800000000))
-
-        program.execute("2")
-        output = program.execute(incorrect_card_number + "\n" + correct_pin)
-
-        if "successfully" in output.lower():
-            return CheckResult.wrong("The user should not be signed in" +
-                                     " after entering incorrect card information.")
-
-        self.stop_and_check_if_user_program_was_stopped(program)
         return CheckResult.correct()
 
     @dynamic_test(time_limit=60000)
     def test9_check_balance(self):
-        program = TestedProgram()
-        program.start(*self.args)
-
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not card_number_matcher or not pin_matcher:
-            return CheckResult.wrong("You should output card number and PIN like in example")
+        program = self.warm_session()
 
-        correct_pin = pin_matcher.group().strip()
-        correct_card_number = card_number_matcher.group()
+        result = scenarios.load('balance').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
-        program.execute("2")
-        program.execute(correct_card_number + "\n" + correct_pin)
-
-        output = program.execute("1")
-
-        if "0" not in output:
-            return CheckResult.wrong("Expected balance: 0")
-
-        self.stop_and_check_if_user_program_was_stopped(program)
         return CheckResult.correct()
 
+    # Returns the shared program, back at the main menu.
+    def warm_session(self):
+        if SimpleBankSystemTest.session is None:
+            binary = os.path.join(tempfile.mkdtemp(), 'banking_system')
+            subprocess.run(['go', 'build', '-o', binary, '.'], check=True)
+            SimpleBankSystemTest.session = WarmSession([binary, *self.args], logout_option='2')
+            atexit.register(SimpleBankSystemTest.session.close)
+        SimpleBankSystemTest.session.reset()
+        return SimpleBankSystemTest.session
+
     @staticmethod
     def get_connection():
         if SimpleBankSystemTest.connection is None:
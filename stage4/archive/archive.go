@@ -0,0 +1,449 @@
+// Package archive moves closed accounts out of the card table. Closing an
+// account marks its card closed in the card_closing table, durably, and
+// hides it; a background archiver later moves the marked cards to the
+// card_archive table in batches and returns the freed pages to the file
+// system with incremental vacuums. The hot card table stays small and the
+// records of closed accounts are kept.
+package archive
+
+import (
+	"database/sql"
+	"errors"
+	"fmt"
+	"log"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"gorm.io/gorm"
+
+	"stage4/journal"
+	"stage4/store"
+	"stage4/transfer"
+)
+
+// moveBatchSize is the number of cards moved per pair of statements by Move.
+const moveBatchSize = 500
+
+// Options configures the archiver.
+type Options struct {
+	// Interval is how often hidden cards are moved to the archive.
+	Interval time.Duration
+	// BatchSize is the number of cards moved per transaction. Once that many
+	// cards are hidden, they are moved without waiting for the interval.
+	BatchSize int
+	// VacuumPages is the number of free pages returned to the file system
+	// after each archiving round.
+	VacuumPages int
+}
+
+// DefaultOptions moves closed cards once a second and returns up to 4 MiB
+// of free pages each time.
+var DefaultOptions = Options{
+	Interval:    time.Second,
+	BatchSize:   256,
+	VacuumPages: 1024,
+}
+
+// Card is a closed account.
+type Card struct {
+	ID       uint   `gorm:"primaryKey"`
+	Number   string `gorm:"index;not null"`
+	PIN      string
+	Balance  int
+	ClosedAt time.Time `gorm:"not null"`
+}
+
+func (Card) TableName() string {
+	return "card_archive"
+}
+
+// Closing marks a card closed until it is archived.
+type Closing struct {
+	Number   string    `gorm:"primaryKey"`
+	ClosedAt time.Time `gorm:"not null"`
+}
+
+func (Closing) TableName() string {
+	return "card_closing"
+}
+
+// Migrate creates the archive and closing tables if they don't exist yet.
+func Migrate(db *gorm.DB) error {
+	if err := db.AutoMigrate(&Card{}, &Closing{}); err != nil {
+		return fmt.Errorf("failed to migrate the archive table: %w", err)
+	}
+	return nil
+}
+
+// MarkClosed marks the card with the given number closed at closedAt and
+// journals its balance out in one transaction, failing with
+// store.ErrNotFound if there is no such card or it is marked already.
+func MarkClosed(db *gorm.DB, number string, closedAt time.Time) error {
+	return db.Transaction(func(tx *gorm.DB) error {
+		result := tx.Exec("INSERT INTO card_closing (number, closed_at) SELECT number, ? FROM card "+
+			"WHERE number = ? AND number NOT IN (SELECT number FROM card_closing)", closedAt, number)
+		if result.Error != nil {
+			return result.Error
+		}
+		if result.RowsAffected == 0 {
+			return store.ErrNotFound
+		}
+		return tx.Exec("INSERT INTO transactions (number, amount, kind, reference, created_at) "+
+			"SELECT number, -balance, ?, '', ? FROM card WHERE number = ? AND balance != 0",
+			journal.KindClose, closedAt, number).Error
+	})
+}
+
+// Marked returns the numbers of the cards marked closed.
+func Marked(db *gorm.DB) ([]string, error) {
+	var numbers []string
+	err := db.Model(&Closing{}).Pluck("number", &numbers).Error
+	return numbers, err
+}
+
+// Move copies the cards with the given numbers to the archive and deletes
+// them from the card table, using tx, which should be a transaction. A card
+// marked closed is archived with the time of its mark, and unmarked;
+// closedAt is the time of the others.
+func Move(tx *gorm.DB, numbers []string, closedAt time.Time) error {
+	for start := 0; start < len(numbers); start += moveBatchSize {
+		batch := numbers[start:min(start+moveBatchSize, len(numbers))]
+		err := tx.Exec("INSERT INTO card_archive (number, pin, balance, closed_at) "+
+			"SELECT card.number, pin, balance, COALESCE(card_closing.closed_at, ?) FROM card "+
+			"LEFT JOIN card_closing ON card_closing.number = card.number WHERE card.number IN ?",
+			closedAt, batch).Error
+		if err != nil {
+			return err
+		}
+		if err := tx.Where("number IN ?", batch).Delete(&store.Card{}).Error; err != nil {
+			return err
+		}
+		if err := tx.Where("number IN ?", batch).Delete(&Closing{}).Error; err != nil {
+			return err
+		}
+	}
+	return nil
+}
+
+// Insert adds cards kept outside the database to the archive and deletes
+// the rows with their numbers from the card table, using tx, which should be
+// a transaction.
+func Insert(tx *gorm.DB, cards []store.Card, closedAt time.Time) error {
+	if len(cards) == 0 {
+		return nil
+	}
+
+	archived := make([]Card, len(cards))
+	numbers := make([]string, len(cards))
+	for i, card := range cards {
+		archived[i] = Card{Number: card.Number, PIN: card.PIN, Balance: card.Balance, ClosedAt: closedAt}
+		numbers[i] = card.Number
+	}
+	if err := tx.CreateInBatches(archived, moveBatchSize).Error; err != nil {
+		return err
+	}
+	for start := 0; start < len(numbers); start += moveBatchSize {
+		batch := numbers[start:min(start+moveBatchSize, len(numbers))]
+		if err := tx.Where("number IN ?", batch).Delete(&store.Card{}).Error; err != nil {
+			return err
+		}
+	}
+	return nil
+}
+
+// PrepareIncrementalVacuum asks for incremental auto-vacuum, which only
+// takes effect on a database without tables yet, so it costs nothing. It is
+// meant to run before the first migration.
+func PrepareIncrementalVacuum(db *sql.DB) error {
+	_, err := db.Exec("PRAGMA auto_vacuum = INCREMENTAL")
+	return err
+}
+
+// EnableIncrementalVacuum switches the database to incremental auto-vacuum.
+// An existing database has to be rebuilt once for the setting to apply, which
+// rewrites the whole file, so it is a maintenance step rather than part of
+// startup. Until then the incremental vacuums of the archiver do nothing.
+func EnableIncrementalVacuum(db *sql.DB) error {
+	var mode int
+	if err := db.QueryRow("PRAGMA auto_vacuum").Scan(&mode); err != nil {
+		return err
+	}
+	const incremental = 2
+	if mode == incremental {
+		return nil
+	}
+	if _, err := db.Exec("PRAGMA auto_vacuum = INCREMENTAL"); err != nil {
+		return err
+	}
+	_, err := db.Exec("VACUUM")
+	return err
+}
+
+// Vacuum returns up to pages free pages of the database to the file system.
+func Vacuum(db *sql.DB, pages int) error {
+	// The pragma frees one page per step, so its rows are drained rather
+	// than run with Exec, which may stop after the first step.
+	rows, err := db.Query(fmt.Sprintf("PRAGMA incremental_vacuum(%d)", pages))
+	if err != nil {
+		return err
+	}
+	defer rows.Close()
+	for rows.Next() {
+	}
+	return rows.Err()
+}
+
+// Backend is a store that can move closed cards to the archive.
+type Backend interface {
+	store.Store
+	// MarkClosed durably marks the card with the given number closed,
+	// failing with store.ErrNotFound if there is no such card or it is
+	// marked already.
+	MarkClosed(number string, closedAt time.Time) error
+	// Marked returns the numbers of the cards marked closed but not
+	// archived yet.
+	Marked() ([]string, error)
+	// Archive moves the cards with the given numbers to the archive in one
+	// transaction.
+	Archive(numbers []string, closedAt time.Time) error
+}
+
+// Store is a store.Store whose Delete marks a card closed and hides it at
+// once, and leaves moving it to the archive to a background archiver.
+type Store struct {
+	Backend
+	db      *sql.DB
+	options Options
+
+	mu     sync.RWMutex
+	closed map[string]struct{}
+	// hiddenCards is len(closed), so cards can be looked up without locking
+	// while no card is hidden.
+	hiddenCards atomic.Int64
+
+	// archiveMu serializes archiving rounds.
+	archiveMu sync.Mutex
+
+	kick    chan struct{}
+	done    chan struct{}
+	stopped chan struct{}
+}
+
+// New returns a Store archiving the cards of backend and vacuuming db, the
+// database backend keeps its cards in, and starts its archiver. The cards
+// left marked closed by an earlier run are hidden and archived first.
+// Options that aren't positive take their DefaultOptions value.
+func New(backend Backend, db *sql.DB, options Options) (*Store, error) {
+	if options.Interval <= 0 {
+		options.Interval = DefaultOptions.Interval
+	}
+	if options.BatchSize <= 0 {
+		options.BatchSize = DefaultOptions.BatchSize
+	}
+	if options.VacuumPages <= 0 {
+		options.VacuumPages = DefaultOptions.VacuumPages
+	}
+
+	s := &Store{
+		Backend: backend,
+		db:      db,
+		options: options,
+		closed:  make(map[string]struct{}),
+		kick:    make(chan struct{}, 1),
+		done:    make(chan struct{}),
+		stopped: make(chan struct{}),
+	}
+	marked, err := backend.Marked()
+	if err != nil {
+		return nil, fmt.Errorf("failed to load the closed accounts: %w", err)
+	}
+	s.hide(marked...)
+	go s.run()
+	if len(marked) > 0 {
+		s.archiveSoon()
+	}
+	return s, nil
+}
+
+func (s *Store) hidden(number string) bool {
+	if s.hiddenCards.Load() == 0 {
+		return false
+	}
+	s.mu.RLock()
+	defer s.mu.RUnlock()
+	_, ok := s.closed[number]
+	return ok
+}
+
+func (s *Store) Create(card store.Card) error {
+	if s.hidden(card.Number) {
+		return store.ErrExists
+	}
+	return s.Backend.Create(card)
+}
+
+func (s *Store) Get(number string) (store.Card, error) {
+	if s.hidden(number) {
+		return store.Card{}, store.ErrNotFound
+	}
+	return s.Backend.Get(number)
+}
+
+func (s *Store) Authenticate(number string, verify func(storedPIN string) bool) (store.Card, error) {
+	if s.hidden(number) {
+		return store.Card{}, store.ErrNotFound
+	}
+	return s.Backend.Authenticate(number, verify)
+}
+
+func (s *Store) Credit(number string, amount int) (store.Card, error) {
+	if s.hidden(number) {
+		return store.Card{}, store.ErrNotFound
+	}
+	return s.Backend.Credit(number, amount)
+}
+
+func (s *Store) Transfer(from, to string, amount int) (store.Card, store.Card, error) {
+	switch {
+	case s.hidden(from):
+		return store.Card{}, store.Card{}, transfer.ErrInsufficientFunds
+	case s.hidden(to):
+		return store.Card{}, store.Card{}, transfer.ErrUnknownCard
+	}
+	return s.Backend.Transfer(from, to, amount)
+}
+
+// Balance returns the balance of a card from a backend that reads balances
+// without locking, and from Get otherwise.
+func (s *Store) Balance(number string) (int, error) {
+	if s.hidden(number) {
+		return 0, store.ErrNotFound
+	}
+	if reader, ok := s.Backend.(store.BalanceReader); ok {
+		return reader.Balance(number)
+	}
+	card, err := s.Backend.Get(number)
+	return card.Balance, err
+}
+
+// Delete marks the card with the given number closed and hides it until it
+// is archived. The mark is durable when Delete returns, so a crash before
+// the card is archived doesn't reopen the account. It fails with
+// store.ErrNotFound if there is no such open card.
+func (s *Store) Delete(number string) error {
+	if s.hidden(number) {
+		return store.ErrNotFound
+	}
+	if err := s.Backend.MarkClosed(number, time.Now()); err != nil {
+		return err
+	}
+	s.hide(number)
+	return nil
+}
+
+// hide hides the cards with the given numbers, and wakes the archiver once
+// a batch is full.
+func (s *Store) hide(numbers ...string) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	for _, number := range numbers {
+		s.closed[number] = struct{}{}
+	}
+	s.hiddenCards.Store(int64(len(s.closed)))
+	if len(s.closed) >= s.options.BatchSize {
+		s.archiveSoon()
+	}
+}
+
+// archiveSoon wakes the archiver without waiting for it.
+func (s *Store) archiveSoon() {
+	select {
+	case s.kick <- struct{}{}:
+	default:
+	}
+}
+
+// Flush archives every hidden card and then flushes the backend, if it
+// buffers writes.
+func (s *Store) Flush() error {
+	if _, err := s.archive(); err != nil {
+		return err
+	}
+	if flusher, ok := s.Backend.(store.Flusher); ok {
+		return flusher.Flush()
+	}
+	return nil
+}
+
+// Close stops the archiver, archives every hidden card and closes the
+// backend.
+func (s *Store) Close() error {
+	close(s.done)
+	<-s.stopped
+	_, err := s.archive()
+	return errors.Join(err, s.Backend.Close())
+}
+
+// run archives hidden cards every Interval, and early when a batch is full.
+// A round that archived cards is followed by an incremental vacuum; by then
+// a backend writing behind has usually deleted the cards of the round
+// before.
+func (s *Store) run() {
+	defer close(s.stopped)
+
+	ticker := time.NewTicker(s.options.Interval)
+	defer ticker.Stop()
+	vacuum := false
+	for {
+		select {
+		case <-ticker.C:
+		case <-s.kick:
+		case <-s.done:
+			return
+		}
+
+		if vacuum {
+			if err := Vacuum(s.db, s.options.VacuumPages); err != nil {
+				log.Printf("failed to vacuum the database: %v", err)
+			}
+		}
+		n, err := s.archive()
+		if err != nil {
+			log.Printf("failed to archive closed accounts: %v", err)
+		}
+		vacuum = n > 0
+	}
+}
+
+// archive moves the hidden cards to the archive in batches and returns how
+// many were moved. Cards stay hidden until their batch is committed.
+func (s *Store) archive() (int, error) {
+	s.archiveMu.Lock()
+	defer s.archiveMu.Unlock()
+
+	s.mu.RLock()
+	numbers := make([]string, 0, len(s.closed))
+	for number := range s.closed {
+		numbers = append(numbers, number)
+	}
+	s.mu.RUnlock()
+
+	moved := 0
+	for start := 0; start < len(numbers); start += s.options.BatchSize {
+		batch := numbers[start:min(start+s.options.BatchSize, len(numbers))]
+		if err := s.Backend.Archive(batch, time.Now()); err != nil {
+			return moved, err
+		}
+
+		s.mu.Lock()
+		for _, number := range batch {
+			delete(s.closed, number)
+		}
+		s.hiddenCards.Store(int64(len(s.closed)))
+		s.mu.Unlock()
+		moved += len(batch)
+	}
+	return moved, nil
+}
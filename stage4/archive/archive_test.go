@@ -0,0 +1,185 @@
+package archive
+
+import (
+	"errors"
+	"sync"
+	"testing"
+	"time"
+
+	"stage4/store"
+	"stage4/transfer"
+)
+
+// fakeBackend keeps cards in a map and records every Archive call.
+type fakeBackend struct {
+	store.Store
+
+	mu       sync.Mutex
+	cards    map[string]store.Card
+	marked   map[string]time.Time
+	batches  [][]string
+	archived chan struct{}
+}
+
+func newFakeBackend(numbers ...string) *fakeBackend {
+	b := &fakeBackend{
+		cards:    make(map[string]store.Card),
+		marked:   make(map[string]time.Time),
+		archived: make(chan struct{}, 16),
+	}
+	for _, number := range numbers {
+		b.cards[number] = store.Card{Number: number, Balance: 100}
+	}
+	return b
+}
+
+func (b *fakeBackend) Get(number string) (store.Card, error) {
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	card, ok := b.cards[number]
+	if !ok {
+		return store.Card{}, store.ErrNotFound
+	}
+	return card, nil
+}
+
+func (b *fakeBackend) MarkClosed(number string, closedAt time.Time) error {
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	if _, ok := b.cards[number]; !ok {
+		return store.ErrNotFound
+	}
+	if _, ok := b.marked[number]; ok {
+		return store.ErrNotFound
+	}
+	b.marked[number] = closedAt
+	return nil
+}
+
+func (b *fakeBackend) Marked() ([]string, error) {
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	var numbers []string
+	for number := range b.marked {
+		numbers = append(numbers, number)
+	}
+	return numbers, nil
+}
+
+func (b *fakeBackend) Archive(numbers []string, closedAt time.Time) error {
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	for _, number := range numbers {
+		delete(b.cards, number)
+		delete(b.marked, number)
+	}
+	b.batches = append(b.batches, numbers)
+	b.archived <- struct{}{}
+	return nil
+}
+
+func (b *fakeBackend) Close() error {
+	return nil
+}
+
+func newStore(t *testing.T, backend Backend, options Options) *Store {
+	t.Helper()
+	s, err := New(backend, nil, options)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return s
+}
+
+func TestDeleteHidesCardUntilArchived(t *testing.T) {
+	backend := newFakeBackend("4000000000000001", "4000000000000002")
+	s := newStore(t, backend, Options{Interval: time.Hour})
+
+	if err := s.Delete("4000000000000001"); err != nil {
+		t.Fatal(err)
+	}
+	if _, ok := backend.marked["4000000000000001"]; !ok {
+		t.Error("Delete returned before the card was marked closed")
+	}
+	if err := s.Delete("4000000000000001"); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("deleting a closed card returned %v, want ErrNotFound", err)
+	}
+	if err := s.Delete("4000000000000009"); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("deleting an unknown card returned %v, want ErrNotFound", err)
+	}
+	if _, err := s.Get("4000000000000001"); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("Get of a closed card returned %v, want ErrNotFound", err)
+	}
+	if _, err := s.Balance("4000000000000001"); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("Balance of a closed card returned %v, want ErrNotFound", err)
+	}
+	if balance, err := s.Balance("4000000000000002"); err != nil || balance != 100 {
+		t.Errorf("Balance of an open card = %d, %v, want 100", balance, err)
+	}
+	if _, _, err := s.Transfer("4000000000000002", "4000000000000001", 10); !errors.Is(err, transfer.ErrUnknownCard) {
+		t.Errorf("a transfer to a closed card returned %v, want ErrUnknownCard", err)
+	}
+	if _, err := backend.Get("4000000000000001"); err != nil {
+		t.Errorf("the card was archived before the archiver ran: %v", err)
+	}
+
+	if err := s.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := backend.Get("4000000000000001"); !errors.Is(err, store.ErrNotFound) {
+		t.Error("Close didn't archive the closed card")
+	}
+	if _, err := s.Get("4000000000000002"); err != nil {
+		t.Errorf("Get of an open card returned %v", err)
+	}
+}
+
+func TestFullBatchIsArchivedEarly(t *testing.T) {
+	numbers := []string{"4000000000000001", "4000000000000002", "4000000000000003"}
+	backend := newFakeBackend(numbers...)
+	s := newStore(t, backend, Options{Interval: time.Hour, BatchSize: 2})
+
+	for _, number := range numbers[:2] {
+		if err := s.Delete(number); err != nil {
+			t.Fatal(err)
+		}
+	}
+	select {
+	case <-backend.archived:
+	case <-time.After(5 * time.Second):
+		t.Fatal("a full batch of closed cards wasn't archived before the interval")
+	}
+
+	if err := s.Delete(numbers[2]); err != nil {
+		t.Fatal(err)
+	}
+	if err := s.Close(); err != nil {
+		t.Fatal(err)
+	}
+	backend.mu.Lock()
+	defer backend.mu.Unlock()
+	if len(backend.cards) != 0 {
+		t.Errorf("cards left unarchived: %v", backend.cards)
+	}
+	for _, batch := range backend.batches {
+		if len(batch) > 2 {
+			t.Errorf("archived a batch of %d cards, want at most 2", len(batch))
+		}
+	}
+}
+
+func TestMarkedCardsArchivedAtStartup(t *testing.T) {
+	backend := newFakeBackend("4000000000000001", "4000000000000002")
+	backend.marked["4000000000000001"] = time.Now()
+	s := newStore(t, backend, Options{Interval: time.Hour})
+	defer s.Close()
+
+	if _, err := s.Get("4000000000000001"); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("Get of a card marked closed by an earlier run returned %v, want ErrNotFound", err)
+	}
+	select {
+	case <-backend.archived:
+	case <-time.After(5 * time.Second):
+		t.Fatal("a card marked closed by an earlier run wasn't archived at startup")
+	}
+}
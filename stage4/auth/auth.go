@@ -0,0 +1,162 @@
+// Package auth verifies card PINs against their stored form, which is either
+// a salted PBKDF2-HMAC-SHA256 hash or, for databases created without
+// hashing, the plaintext PIN.
+package auth
+
+import (
+	"crypto/hmac"
+	"crypto/rand"
+	"crypto/sha256"
+	"crypto/subtle"
+	"encoding/base64"
+	"encoding/binary"
+	"fmt"
+	"strconv"
+	"strings"
+	"time"
+)
+
+// hashPrefix tags PINs stored as PBKDF2 hashes.
+const hashPrefix = "pbkdf2-sha256"
+
+const (
+	saltSize = 16
+	keySize  = sha256.Size
+)
+
+// Hasher turns PINs into their stored form. Iterations is the PBKDF2 cost;
+// zero stores PINs in plaintext.
+type Hasher struct {
+	Iterations int
+}
+
+// Hash returns the stored form of pin.
+func (h Hasher) Hash(pin string) (string, error) {
+	if h.Iterations <= 0 {
+		return pin, nil
+	}
+
+	salt := make([]byte, saltSize)
+	if _, err := rand.Read(salt); err != nil {
+		return "", fmt.Errorf("failed to generate a salt: %w", err)
+	}
+
+	key := pbkdf2([]byte(pin), salt, h.Iterations)
+	return strings.Join([]string{
+		hashPrefix,
+		strconv.Itoa(h.Iterations),
+		base64.RawStdEncoding.EncodeToString(salt),
+		base64.RawStdEncoding.EncodeToString(key),
+	}, "$"), nil
+}
+
+// Verify reports whether pin matches stored. The comparison takes the same
+// time whether or not the PIN is correct.
+func Verify(pin, stored string) bool {
+	if !isHashed(stored) {
+		return subtle.ConstantTimeCompare([]byte(pin), []byte(stored)) == 1
+	}
+
+	parts := strings.Split(stored, "$")
+	if len(parts) != 4 {
+		return false
+	}
+	iterations, err := strconv.Atoi(parts[1])
+	if err != nil || iterations <= 0 {
+		return false
+	}
+	salt, err := base64.RawStdEncoding.DecodeString(parts[2])
+	if err != nil {
+		return false
+	}
+	want, err := base64.RawStdEncoding.DecodeString(parts[3])
+	if err != nil {
+		return false
+	}
+
+	return subtle.ConstantTimeCompare(pbkdf2([]byte(pin), salt, iterations), want) == 1
+}
+
+func isHashed(stored string) bool {
+	return strings.HasPrefix(stored, hashPrefix+"$")
+}
+
+// pbkdf2 derives a keySize key from password as specified by RFC 8018,
+// using HMAC-SHA256 as the pseudorandom function. A single block is enough
+// since the key is exactly one SHA-256 digest long.
+func pbkdf2(password, salt []byte, iterations int) []byte {
+	prf := hmac.New(sha256.New, password)
+
+	var index [4]byte
+	binary.BigEndian.PutUint32(index[:], 1)
+	prf.Write(salt)
+	prf.Write(index[:])
+	u := prf.Sum(nil)
+
+	key := make([]byte, keySize)
+	copy(key, u)
+	for i := 1; i < iterations; i++ {
+		prf.Reset()
+		prf.Write(u)
+		u = prf.Sum(u[:0])
+		for j := range key {
+			key[j] ^= u[j]
+		}
+	}
+	return key
+}
+
+// Authenticator verifies PINs and remembers successful verifications for a
+// short time, so repeated logins to the same card skip the expensive hash.
+type Authenticator struct {
+	hasher Hasher
+	cache  *Cache
+	dummy  string
+}
+
+// NewAuthenticator returns an Authenticator that hashes new PINs with hasher
+// and caches verified logins for ttl. A zero ttl disables the cache.
+func NewAuthenticator(hasher Hasher, ttl time.Duration) (*Authenticator, error) {
+	dummy, err := hasher.Hash("0000")
+	if err != nil {
+		return nil, err
+	}
+	cache, err := NewCache(ttl)
+	if err != nil {
+		return nil, err
+	}
+	return &Authenticator{hasher: hasher, cache: cache, dummy: dummy}, nil
+}
+
+// Hash returns the stored form of a new PIN.
+func (a *Authenticator) Hash(pin string) (string, error) {
+	return a.hasher.Hash(pin)
+}
+
+// Verify reports whether pin is the PIN of card number, whose stored PIN is
+// stored. Plaintext PINs are cheap to compare and bypass the cache.
+func (a *Authenticator) Verify(number, pin, stored string) bool {
+	if !isHashed(stored) {
+		return Verify(pin, stored)
+	}
+	if a.cache.Contains(number, pin, stored) {
+		return true
+	}
+	if !Verify(pin, stored) {
+		return false
+	}
+	a.cache.Add(number, pin, stored)
+	return true
+}
+
+// Reject spends the same time as a failed Verify. It is used for unknown
+// card numbers, so response times don't reveal which numbers exist.
+func (a *Authenticator) Reject(pin string) {
+	Verify(pin, a.dummy)
+}
+
+// Forget drops the cached verification of card number, e.g. once the account
+// has been closed.
+func (a *Authenticator) Forget(number string) {
+	a.cache.Remove(number)
+}
@@ -0,0 +1,97 @@
+package auth
+
+import (
+	"encoding/hex"
+	"fmt"
+	"testing"
+	"time"
+)
+
+func TestPBKDF2(t *testing.T) {
+	// Test vectors from RFC 7914, section 11, truncated to one block.
+	tests := []struct {
+		password, salt string
+		iterations     int
+		want           string
+	}{
+		{"passwd", "salt", 1, "55ac046e56e3089fec1691c22544b605f94185216dde0465e68b9d57c20dacbc"},
+		{"Password", "NaCl", 80000, "4ddcd8f60b98be21830cee5ef22701f9641a4418d04c0414aeff08876b34ab56"},
+	}
+	for _, tt := range tests {
+		got := hex.EncodeToString(pbkdf2([]byte(tt.password), []byte(tt.salt), tt.iterations))
+		if got != tt.want {
+			t.Errorf("pbkdf2(%q, %q, %d) = %s, want %s", tt.password, tt.salt, tt.iterations, got, tt.want)
+		}
+	}
+}
+
+func TestVerify(t *testing.T) {
+	for _, iterations := range []int{0, 1000} {
+		stored, err := Hasher{Iterations: iterations}.Hash("1234")
+		if err != nil {
+			t.Fatal(err)
+		}
+		if iterations > 0 && stored == "1234" {
+			t.Errorf("Hash stored the PIN in plaintext with %d iterations", iterations)
+		}
+		if !Verify("1234", stored) {
+			t.Errorf("Verify rejected the correct PIN with %d iterations", iterations)
+		}
+		if Verify("4321", stored) {
+			t.Errorf("Verify accepted a wrong PIN with %d iterations", iterations)
+		}
+	}
+}
+
+func TestAuthenticatorCache(t *testing.T) {
+	a, err := NewAuthenticator(Hasher{Iterations: 1000}, time.Minute)
+	if err != nil {
+		t.Fatal(err)
+	}
+	stored, _ := a.Hash("1234")
+
+	if !a.Verify("4000001234567899", "1234", stored) {
+		t.Fatal("Verify rejected the correct PIN")
+	}
+	if !a.cache.Contains("4000001234567899", "1234", stored) {
+		t.Fatal("a verified login wasn't cached")
+	}
+	if a.Verify("4000001234567899", "4321", stored) {
+		t.Fatal("Verify accepted a wrong PIN of a cached card")
+	}
+
+	other, _ := a.Hash("1234")
+	if a.cache.Contains("4000001234567899", "1234", other) {
+		t.Fatal("the cache survived a change of the stored PIN")
+	}
+
+	a.Forget("4000001234567899")
+	if a.cache.Contains("4000001234567899", "1234", stored) {
+		t.Fatal("Forget didn't drop the cached login")
+	}
+}
+
+// BenchmarkLogin shows the login throughput at each PBKDF2 cost, with and
+// without the verified-session cache.
+func BenchmarkLogin(b *testing.B) {
+	for _, iterations := range []int{0, 1000, 10000, 100000, 600000} {
+		for _, ttl := range []time.Duration{0, time.Minute} {
+			name := fmt.Sprintf("iterations=%d/cache=%v", iterations, ttl > 0)
+			b.Run(name, func(b *testing.B) {
+				a, err := NewAuthenticator(Hasher{Iterations: iterations}, ttl)
+				if err != nil {
+					b.Fatal(err)
+				}
+				stored, _ := a.Hash("1234")
+
+				b.ResetTimer()
+				for i := 0; i < b.N; i++ {
+					if !a.Verify("4000001234567899", "1234", stored) {
+						b.Fatal("Verify rejected the correct PIN")
+					}
+				}
+				b.ReportMetric(float64(b.N)/b.Elapsed().Seconds(), "logins/s")
+			})
+		}
+	}
+}
@@ -0,0 +1,100 @@
+package auth
+
+import (
+	"crypto/hmac"
+	"crypto/rand"
+	"crypto/sha256"
+	"fmt"
+	"sync"
+	"time"
+)
+
+// maxCacheEntries bounds the memory of a Cache; expired entries are dropped
+// once it is reached.
+const maxCacheEntries = 1 << 16
+
+type cacheEntry struct {
+	digest  [sha256.Size]byte
+	expires time.Time
+}
+
+// Cache remembers verified (card number, PIN) pairs for a fixed time. It only
+// keeps a keyed digest of the PIN and its stored form, so a changed PIN
+// invalidates the entry and the cache never holds PINs in the clear.
+type Cache struct {
+	mu      sync.Mutex
+	ttl     time.Duration
+	key     []byte
+	entries map[string]cacheEntry
+}
+
+// NewCache returns a Cache whose entries live for ttl. A zero ttl returns a
+// Cache that never remembers anything.
+func NewCache(ttl time.Duration) (*Cache, error) {
+	key := make([]byte, sha256.Size)
+	if _, err := rand.Read(key); err != nil {
+		return nil, fmt.Errorf("failed to generate the cache key: %w", err)
+	}
+	return &Cache{ttl: ttl, key: key, entries: make(map[string]cacheEntry)}, nil
+}
+
+func (c *Cache) digest(pin, stored string) [sha256.Size]byte {
+	mac := hmac.New(sha256.New, c.key)
+	mac.Write([]byte(stored))
+	mac.Write([]byte{0})
+	mac.Write([]byte(pin))
+
+	var digest [sha256.Size]byte
+	mac.Sum(digest[:0])
+	return digest
+}
+
+// Contains reports whether pin was verified against stored for number less
+// than ttl ago.
+func (c *Cache) Contains(number, pin, stored string) bool {
+	if c.ttl <= 0 {
+		return false
+	}
+
+	c.mu.Lock()
+	entry, ok := c.entries[number]
+	c.mu.Unlock()
+	if !ok || time.Now().After(entry.expires) {
+		return false
+	}
+
+	digest := c.digest(pin, stored)
+	return hmac.Equal(digest[:], entry.digest[:])
+}
+
+// Add remembers that pin was verified against stored for number.
+func (c *Cache) Add(number, pin, stored string) {
+	if c.ttl <= 0 {
+		return
+	}
+
+	entry := cacheEntry{digest: c.digest(pin, stored), expires: time.Now().Add(c.ttl)}
+
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if len(c.entries) >= maxCacheEntries {
+		now := time.Now()
+		for n, e := range c.entries {
+			if now.After(e.expires) {
+				delete(c.entries, n)
+			}
+		}
+		if len(c.entries) >= maxCacheEntries {
+			return
+		}
+	}
+	c.entries[number] = entry
+}
+
+// Remove forgets number.
+func (c *Cache) Remove(number string) {
+	c.mu.Lock()
+	delete(c.entries, number)
+	c.mu.Unlock()
+}
@@ -0,0 +1,109 @@
+// Package cardnumber validates and generates card numbers without
+// allocating: numbers are handled as fixed-size digit arrays and the Luhn
+// checksum is computed in a single table-driven pass.
+package cardnumber
+
+// Length is the number of digits of a card number.
+const Length = 16
+
+// Number is a card number stored as ASCII digits.
+type Number [Length]byte
+
+// doubled maps a digit to the Luhn value of the digit doubled.
+var doubled = [10]int{0, 2, 4, 6, 8, 1, 3, 5, 7, 9}
+
+// luhnSum returns the Luhn sum of digits, doubling every second digit counted
+// from the right, starting with the rightmost one if doubleFirst is set. ok is
+// false when digits contains anything but decimal digits.
+func luhnSum[T string | []byte](digits T, doubleFirst bool) (sum int, ok bool) {
+	double := doubleFirst
+	for i := len(digits) - 1; i >= 0; i-- {
+		d := digits[i] - '0'
+		if d > 9 {
+			return 0, false
+		}
+		if double {
+			sum += doubled[d]
+		} else {
+			sum += int(d)
+		}
+		double = !double
+	}
+	return sum, true
+}
+
+// Valid reports whether number is a non-empty string of digits that passes
+// the Luhn algorithm.
+func Valid(number string) bool {
+	if len(number) == 0 {
+		return false
+	}
+	sum, ok := luhnSum(number, false)
+	return ok && sum%10 == 0
+}
+
+// Valid reports whether n passes the Luhn algorithm.
+func (n *Number) Valid() bool {
+	sum, ok := luhnSum(n[:], false)
+	return ok && sum%10 == 0
+}
+
+// CheckDigit returns the digit that makes base followed by it pass the Luhn
+// algorithm. base must consist of decimal digits only.
+func CheckDigit[T string | []byte](base T) byte {
+	sum, _ := luhnSum(base, true)
+	return byte('0' + (10-sum%10)%10)
+}
+
+// Generate returns the card number made of the 6-digit issuer identification
+// number iin, the 9-digit account identifier account and the check digit.
+func Generate(iin, account uint64) Number {
+	var n Number
+	putDigits(n[:6], iin)
+	putDigits(n[6:Length-1], account)
+	n[Length-1] = CheckDigit(n[:Length-1])
+	return n
+}
+
+// putDigits writes the len(dst) lowest decimal digits of v into dst.
+func putDigits(dst []byte, v uint64) {
+	for i := len(dst) - 1; i >= 0; i-- {
+		dst[i] = byte('0' + v%10)
+		v /= 10
+	}
+}
+
+// Parse converts a 16-digit string into a Number. ok is false if s has the
+// wrong length or contains anything but decimal digits.
+func Parse(s string) (n Number, ok bool) {
+	if len(s) != Length {
+		return n, false
+	}
+	for i := 0; i < Length; i++ {
+		if s[i] < '0' || s[i] > '9' {
+			return n, false
+		}
+		n[i] = s[i]
+	}
+	return n, true
+}
+
+// Uint64 returns n packed into an integer.
+func (n *Number) Uint64() uint64 {
+	var v uint64
+	for _, d := range n {
+		v = v*10 + uint64(d-'0')
+	}
+	return v
+}
+
+// FromUint64 unpacks a number packed by Uint64.
+func FromUint64(v uint64) Number {
+	var n Number
+	putDigits(n[:], v)
+	return n
+}
+
+func (n Number) String() string {
+	return string(n[:])
+}
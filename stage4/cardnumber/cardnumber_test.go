@@ -0,0 +1,163 @@
+package cardnumber
+
+import (
+	"fmt"
+	"math/rand"
+	"testing"
+)
+
+// pythonCheckLuhn is a literal port of check_luhn_algorithm from
+// test/tests.py, which the stage checker uses to validate card numbers. It
+// doubles the digits at even indexes from the left, which matches the Luhn
+// algorithm for numbers of even length.
+func pythonCheckLuhn(cardNumber string) bool {
+	result := 0
+	for i := 0; i < len(cardNumber); i++ {
+		digit := int(cardNumber[i] - '0')
+		if i%2 == 0 {
+			doubleDigit := digit * 2
+			if doubleDigit > 9 {
+				doubleDigit -= 9
+			}
+			result += doubleDigit
+			continue
+		}
+		result += digit
+	}
+	return result%10 == 0
+}
+
+func TestValid(t *testing.T) {
+	tests := []struct {
+		number string
+		want   bool
+	}{
+		{"4000008449433403", true},
+		{"2000007269641768", true},
+		{"2000007269641764", false},
+		{"4000008449433404", false},
+		{"", false},
+		{"40000084494334O3", false},
+		{"0", true},
+	}
+	for _, tt := range tests {
+		if got := Valid(tt.number); got != tt.want {
+			t.Errorf("Valid(%q) = %v, want %v", tt.number, got, tt.want)
+		}
+	}
+}
+
+func TestGenerate(t *testing.T) {
+	n := Generate(400000, 844943340)
+	if got := n.String(); got != "4000008449433403" {
+		t.Fatalf("Generate(400000, 844943340) = %s, want 4000008449433403", got)
+	}
+	if !n.Valid() {
+		t.Fatal("a generated number doesn't pass the Luhn algorithm")
+	}
+	if packed := n.Uint64(); FromUint64(packed) != n {
+		t.Fatalf("FromUint64(%d) doesn't round-trip %s", packed, n)
+	}
+	if parsed, ok := Parse(n.String()); !ok || parsed != n {
+		t.Fatalf("Parse(%q) = %s, %v", n.String(), parsed, ok)
+	}
+}
+
+func TestZeroAllocations(t *testing.T) {
+	allocs := testing.AllocsPerRun(100, func() {
+		n := Generate(400000, 123456789)
+		if !n.Valid() || !Valid("4000008449433403") {
+			t.Fatal("Luhn check failed")
+		}
+	})
+	if allocs != 0 {
+		t.Fatalf("Generate and Valid allocated %v times per run, want 0", allocs)
+	}
+}
+
+func FuzzValid(f *testing.F) {
+	f.Add("4000008449433403")
+	f.Add("2000007269641764")
+	f.Add("0000000000000000")
+	f.Fuzz(func(t *testing.T, number string) {
+		if _, ok := Parse(number); !ok {
+			t.Skip()
+		}
+		if got, want := Valid(number), pythonCheckLuhn(number); got != want {
+			t.Fatalf("Valid(%q) = %v, the checker says %v", number, got, want)
+		}
+	})
+}
+
+func FuzzGenerate(f *testing.F) {
+	f.Add(uint64(400000), uint64(0))
+	f.Add(uint64(400000), uint64(999999999))
+	f.Fuzz(func(t *testing.T, iin, account uint64) {
+		n := Generate(iin%1000000, account%1000000000)
+		if !pythonCheckLuhn(n.String()) {
+			t.Fatalf("the checker rejects the generated number %s", n)
+		}
+	})
+}
+
+var sink bool
+
+func BenchmarkValid(b *testing.B) {
+	b.ReportAllocs()
+	for i := 0; i < b.N; i++ {
+		sink = Valid("4000008449433403")
+	}
+}
+
+func BenchmarkGenerate(b *testing.B) {
+	b.ReportAllocs()
+	for i := 0; i < b.N; i++ {
+		n := Generate(400000, uint64(i)%1000000000)
+		sink = n[Length-1] == '0'
+	}
+}
+
+// legacyGenerate is how main.go built card numbers before this package, kept
+// as the baseline of the benchmarks.
+func legacyGenerate(account int) string {
+	luhn := func(number string) bool {
+		sum := 0
+		for i, char := range number {
+			digit := int(char - '0')
+			if (len(number)-i)%2 == 0 {
+				digit *= 2
+				if digit > 9 {
+					digit -= 9
+				}
+			}
+			sum += digit
+		}
+		return sum%10 == 0
+	}
+
+	cardBase := "400000" + fmt.Sprintf("%09d", account)
+	checksum := 0
+	for i := 0; i <= 9; i++ {
+		if luhn(cardBase + fmt.Sprintf("%d", i)) {
+			checksum = i
+			break
+		}
+	}
+	return cardBase + fmt.Sprintf("%d", checksum)
+}
+
+func BenchmarkLegacyGenerate(b *testing.B) {
+	b.ReportAllocs()
+	for i := 0; i < b.N; i++ {
+		sink = legacyGenerate(i%1000000000) == ""
+	}
+}
+
+func TestMatchesLegacyGenerate(t *testing.T) {
+	for i := 0; i < 10000; i++ {
+		account := rand.Intn(1000000000)
+		if got, want := Generate(400000, uint64(account)).String(), legacyGenerate(account); got != want {
+			t.Fatalf("Generate(400000, %d) = %s, the previous implementation gave %s", account, got, want)
+		}
+	}
+}
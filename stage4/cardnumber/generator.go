@@ -0,0 +1,146 @@
+package cardnumber
+
+import (
+	crand "crypto/rand"
+	"encoding/binary"
+	"fmt"
+	"math/rand"
+	"runtime"
+	"slices"
+	"sync"
+)
+
+// AccountSpace is the number of account identifiers of one issuer.
+const AccountSpace = 1_000_000_000
+
+// MaxBatch is the largest batch a Generator issues. Beyond half the account
+// space, drawing distinct identifiers at random stops converging quickly.
+const MaxBatch = AccountSpace / 2
+
+// Card is an issued card number and its PIN.
+type Card struct {
+	Number Number
+	PIN    [4]byte
+}
+
+// Generator issues batches of distinct card numbers for one issuer. The
+// account space is split into one shard per worker, and every worker draws
+// from its own shard with its own PRNG, so the workers share no lock and
+// never issue the same number. PINs come from crypto/rand, unless a seed is
+// given.
+type Generator struct {
+	IIN uint64
+	// Workers is the number of goroutines; 0 means GOMAXPROCS.
+	Workers int
+	// Seed makes the card numbers and PINs reproducible for a given number of
+	// workers, the PINs then being drawn from the worker PRNGs; 0 picks a
+	// random seed.
+	Seed int64
+}
+
+// Generate returns n distinct card numbers, sorted, with their PINs.
+// Sorted numbers keep the inserts of a batch at the end of the index.
+func (g Generator) Generate(n int) ([]Card, error) {
+	if n < 0 || n > MaxBatch {
+		return nil, fmt.Errorf("cannot issue %d cards at once, the limit is %d", n, MaxBatch)
+	}
+	workers := g.Workers
+	if workers <= 0 {
+		workers = runtime.GOMAXPROCS(0)
+	}
+	workers = max(1, min(workers, n))
+
+	seed := g.Seed
+	if seed == 0 {
+		var b [8]byte
+		if _, err := crand.Read(b[:]); err != nil {
+			return nil, err
+		}
+		seed = int64(binary.LittleEndian.Uint64(b[:]))
+	}
+
+	cards := make([]Card, n)
+	errs := make([]error, workers)
+	var wg sync.WaitGroup
+	for w := 0; w < workers; w++ {
+		wg.Add(1)
+		go func(w int) {
+			defer wg.Done()
+			lo, hi := int64(AccountSpace)*int64(w)/int64(workers), int64(AccountSpace)*int64(w+1)/int64(workers)
+			shard := shard{base: uint64(lo), size: hi - lo, rng: rand.New(rand.NewSource(seed + int64(w))),
+				seeded: g.Seed != 0}
+			errs[w] = g.fill(cards[n*w/workers:n*(w+1)/workers], shard)
+		}(w)
+	}
+	wg.Wait()
+
+	for _, err := range errs {
+		if err != nil {
+			return nil, err
+		}
+	}
+	return cards, nil
+}
+
+// shard is the part of the account space one worker draws from.
+type shard struct {
+	base uint64
+	size int64
+	rng  *rand.Rand
+	// seeded draws the PINs from rng too.
+	seeded bool
+}
+
+// fill issues len(dst) distinct cards from shard into dst.
+func (g Generator) fill(dst []Card, shard shard) error {
+	accounts := make([]int64, 0, len(dst))
+	for len(accounts) < len(dst) {
+		for len(accounts) < len(dst) {
+			accounts = append(accounts, shard.rng.Int63n(shard.size))
+		}
+		slices.Sort(accounts)
+		accounts = slices.Compact(accounts)
+	}
+
+	var pins pinSource
+	if shard.seeded {
+		pins.rng = shard.rng
+	}
+	for i, account := range accounts {
+		pin, err := pins.next()
+		if err != nil {
+			return err
+		}
+		dst[i].Number = Generate(g.IIN, shard.base+uint64(account))
+		putDigits(dst[i].PIN[:], uint64(pin))
+	}
+	return nil
+}
+
+// pinSource draws uniform PINs from rng, or from crypto/rand if rng is nil,
+// reading in blocks to keep the number of system calls low.
+type pinSource struct {
+	rng *rand.Rand
+	buf [4096]byte
+	pos int
+}
+
+func (p *pinSource) next() (int, error) {
+	// 60000 is the largest multiple of 10000 below 2^16; rejecting the values
+	// above it keeps every PIN equally likely.
+	for {
+		if p.pos == 0 || p.pos == len(p.buf) {
+			if p.rng != nil {
+				p.rng.Read(p.buf[:])
+			} else if _, err := crand.Read(p.buf[:]); err != nil {
+				return 0, err
+			}
+			p.pos = 0
+		}
+		v := int(binary.LittleEndian.Uint16(p.buf[p.pos:]))
+		p.pos += 2
+		if v < 60000 {
+			return v % 10000, nil
+		}
+	}
+}
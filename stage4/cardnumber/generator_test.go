@@ -0,0 +1,125 @@
+package cardnumber
+
+import (
+	"bytes"
+	"fmt"
+	"math/rand"
+	"runtime"
+	"slices"
+	"strings"
+	"sync"
+	"testing"
+)
+
+func compareNumbers(a, b Card) int {
+	return bytes.Compare(a.Number[:], b.Number[:])
+}
+
+func TestGeneratorIssuesDistinctValidCards(t *testing.T) {
+	const n = 100000
+
+	cards, err := Generator{IIN: 400000, Workers: 4}.Generate(n)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if len(cards) != n {
+		t.Fatalf("Generate(%d) returned %d cards", n, len(cards))
+	}
+	seen := make(map[Number]bool, n)
+	for _, card := range cards {
+		if seen[card.Number] {
+			t.Fatalf("card number %s was issued twice", card.Number)
+		}
+		seen[card.Number] = true
+		if !card.Number.Valid() || !strings.HasPrefix(card.Number.String(), "400000") {
+			t.Fatalf("issued an invalid card number %s", card.Number)
+		}
+		for _, d := range card.PIN {
+			if d < '0' || d > '9' {
+				t.Fatalf("issued a malformed PIN %q", card.PIN[:])
+			}
+		}
+	}
+	if !slices.IsSortedFunc(cards, compareNumbers) {
+		t.Error("the issued cards aren't sorted by number")
+	}
+}
+
+func TestGeneratorSeedIsReproducible(t *testing.T) {
+	g := Generator{IIN: 400000, Workers: 3, Seed: 42}
+	first, err := g.Generate(1000)
+	if err != nil {
+		t.Fatal(err)
+	}
+	second, err := g.Generate(1000)
+	if err != nil {
+		t.Fatal(err)
+	}
+	for i := range first {
+		if first[i] != second[i] {
+			t.Fatalf("card %d is %s with PIN %s with seed 42 once and %s with PIN %s the next time",
+				i, first[i].Number, first[i].PIN[:], second[i].Number, second[i].PIN[:])
+		}
+	}
+}
+
+func TestGeneratorLimits(t *testing.T) {
+	if _, err := (Generator{IIN: 400000}).Generate(MaxBatch + 1); err == nil {
+		t.Error("Generate accepted a batch above MaxBatch")
+	}
+	cards, err := Generator{IIN: 400000, Workers: 8}.Generate(3)
+	if err != nil || len(cards) != 3 {
+		t.Errorf("Generate(3) with 8 workers = %d cards, %v", len(cards), err)
+	}
+}
+
+// BenchmarkGenerator issues batches of 100000 cards with 1 to GOMAXPROCS
+// workers, to show how issuing scales across cores.
+func BenchmarkGenerator(b *testing.B) {
+	const batch = 100000
+
+	for workers := 1; workers <= runtime.GOMAXPROCS(0); workers *= 2 {
+		b.Run(fmt.Sprintf("workers=%d", workers), func(b *testing.B) {
+			g := Generator{IIN: 400000, Workers: workers, Seed: 1}
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				if _, err := g.Generate(batch); err != nil {
+					b.Fatal(err)
+				}
+			}
+			b.ReportMetric(float64(b.Elapsed().Nanoseconds())/float64(b.N*batch), "ns/card")
+		})
+	}
+}
+
+// BenchmarkGlobalRand issues the same batches from goroutines drawing from
+// the global math/rand source, the way main.go draws single cards. It is the
+// baseline BenchmarkGenerator is compared with: the goroutines contend for
+// the lock of the global source, and the batch has to be sorted after to
+// find duplicates.
+func BenchmarkGlobalRand(b *testing.B) {
+	const batch = 100000
+
+	for workers := 1; workers <= runtime.GOMAXPROCS(0); workers *= 2 {
+		b.Run(fmt.Sprintf("workers=%d", workers), func(b *testing.B) {
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				cards := make([]Card, batch)
+				var wg sync.WaitGroup
+				for w := 0; w < workers; w++ {
+					wg.Add(1)
+					go func(dst []Card) {
+						defer wg.Done()
+						for j := range dst {
+							dst[j].Number = Generate(400000, uint64(rand.Intn(AccountSpace)))
+							putDigits(dst[j].PIN[:], uint64(rand.Intn(10000)))
+						}
+					}(cards[batch*w/workers : batch*(w+1)/workers])
+				}
+				wg.Wait()
+				slices.SortFunc(cards, compareNumbers)
+			}
+			b.ReportMetric(float64(b.Elapsed().Nanoseconds())/float64(b.N*batch), "ns/card")
+		})
+	}
+}
@@ -0,0 +1,243 @@
+// Package history keeps the balance history of every card as buckets of one
+// minute, one hour and one day. Balance changes are folded into the buckets
+// as they happen, so reading a series costs one row per bucket instead of a
+// scan of the journal.
+package history
+
+import (
+	"fmt"
+	"log"
+	"sync"
+	"time"
+
+	"gorm.io/gorm"
+	"gorm.io/gorm/clause"
+)
+
+// saveBatchSize is the number of buckets written per statement by Flush.
+const saveBatchSize = 500
+
+// Resolution is the width of the buckets of a series.
+type Resolution string
+
+const (
+	Minute Resolution = "minute"
+	Hour   Resolution = "hour"
+	Day    Resolution = "day"
+)
+
+// Resolutions lists every resolution a balance change is recorded at.
+var Resolutions = []Resolution{Minute, Hour, Day}
+
+// ParseResolution returns the resolution named s.
+func ParseResolution(s string) (Resolution, error) {
+	for _, r := range Resolutions {
+		if string(r) == s {
+			return r, nil
+		}
+	}
+	return "", fmt.Errorf("unknown resolution %q, expected %s, %s or %s", s, Minute, Hour, Day)
+}
+
+// seconds returns the width of a bucket in seconds.
+func (r Resolution) seconds() int64 {
+	switch r {
+	case Minute:
+		return 60
+	case Hour:
+		return 60 * 60
+	}
+	return 24 * 60 * 60
+}
+
+// Bucket summarizes the balance changes of one card within one bucket. Start
+// is the Unix time the bucket starts at; days start at midnight UTC.
+type Bucket struct {
+	Number     string     `gorm:"primaryKey"`
+	Resolution Resolution `gorm:"primaryKey"`
+	Start      int64      `gorm:"primaryKey;autoIncrement:false"`
+	// Open is the balance before the first change in the bucket and Close
+	// the balance after the last one.
+	Open   int `gorm:"not null"`
+	High   int `gorm:"not null"`
+	Low    int `gorm:"not null"`
+	Close  int `gorm:"not null"`
+	Events int `gorm:"not null"`
+}
+
+func (Bucket) TableName() string {
+	return "balance_history"
+}
+
+// merge folds later, the same bucket recorded after b, into b.
+func (b *Bucket) merge(later Bucket) {
+	b.High = max(b.High, later.High)
+	b.Low = min(b.Low, later.Low)
+	b.Close = later.Close
+	b.Events += later.Events
+}
+
+// Migrate creates the history table if it doesn't exist yet.
+func Migrate(db *gorm.DB) error {
+	if err := db.AutoMigrate(&Bucket{}); err != nil {
+		return fmt.Errorf("failed to migrate the history table: %w", err)
+	}
+	return nil
+}
+
+// Series returns the buckets of a card at the given resolution starting at
+// or after since, oldest first. Changes still buffered by a Recorder are
+// not included.
+func Series(db *gorm.DB, number string, resolution Resolution, since time.Time) ([]Bucket, error) {
+	var buckets []Bucket
+	err := db.Where("number = ? AND resolution = ? AND start >= ?", number, resolution, since.Unix()).
+		Order("start").Find(&buckets).Error
+	return buckets, err
+}
+
+// Options configures a Recorder.
+type Options struct {
+	// FlushInterval is how often buffered buckets are written.
+	FlushInterval time.Duration
+}
+
+// DefaultOptions writes the buffered buckets once a second.
+var DefaultOptions = Options{FlushInterval: time.Second}
+
+type key struct {
+	number     string
+	resolution Resolution
+	start      int64
+}
+
+// Recorder folds balance changes into buckets in memory and writes them
+// behind in the background, so all the changes of a card within one bucket
+// cost one row write per flush.
+type Recorder struct {
+	db *gorm.DB
+
+	mu      sync.Mutex
+	pending map[key]*Bucket
+
+	// flushMu serializes flushes.
+	flushMu sync.Mutex
+
+	done    chan struct{}
+	stopped chan struct{}
+}
+
+// NewRecorder returns a Recorder writing to db and starts its flusher.
+// Options that aren't positive take their DefaultOptions value.
+func NewRecorder(db *gorm.DB, options Options) *Recorder {
+	if options.FlushInterval <= 0 {
+		options.FlushInterval = DefaultOptions.FlushInterval
+	}
+
+	r := &Recorder{
+		db:      db,
+		pending: make(map[key]*Bucket),
+		done:    make(chan struct{}),
+		stopped: make(chan struct{}),
+	}
+	go r.run(options.FlushInterval)
+	return r
+}
+
+// Record notes that the balance of a card changed from before to after at
+// the given time.
+func (r *Recorder) Record(number string, at time.Time, before, after int) {
+	change := Bucket{
+		Number: number,
+		Open:   before,
+		High:   max(before, after),
+		Low:    min(before, after),
+		Close:  after,
+		Events: 1,
+	}
+
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	for _, resolution := range Resolutions {
+		width := resolution.seconds()
+		k := key{number: number, resolution: resolution, start: at.Unix() - at.Unix()%width}
+		if b, ok := r.pending[k]; ok {
+			b.merge(change)
+			continue
+		}
+		b := change
+		b.Resolution, b.Start = k.resolution, k.start
+		r.pending[k] = &b
+	}
+}
+
+// Flush writes the buffered buckets, merging them into the stored ones.
+func (r *Recorder) Flush() error {
+	r.flushMu.Lock()
+	defer r.flushMu.Unlock()
+
+	r.mu.Lock()
+	pending := r.pending
+	r.pending = make(map[key]*Bucket)
+	r.mu.Unlock()
+	if len(pending) == 0 {
+		return nil
+	}
+
+	buckets := make([]Bucket, 0, len(pending))
+	for _, b := range pending {
+		buckets = append(buckets, *b)
+	}
+	err := r.db.Clauses(clause.OnConflict{
+		Columns: []clause.Column{{Name: "number"}, {Name: "resolution"}, {Name: "start"}},
+		DoUpdates: clause.Assignments(map[string]any{
+			"high":   gorm.Expr("MAX(high, excluded.high)"),
+			"low":    gorm.Expr("MIN(low, excluded.low)"),
+			"close":  gorm.Expr("excluded.close"),
+			"events": gorm.Expr("events + excluded.events"),
+		}),
+	}).CreateInBatches(buckets, saveBatchSize).Error
+	if err != nil {
+		r.requeue(pending)
+		return err
+	}
+	return nil
+}
+
+// requeue puts the buckets of a failed flush back in front of the changes
+// recorded since.
+func (r *Recorder) requeue(pending map[key]*Bucket) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	for k, b := range pending {
+		if later, ok := r.pending[k]; ok {
+			b.merge(*later)
+		}
+		r.pending[k] = b
+	}
+}
+
+// Close stops the flusher and writes the remaining buckets.
+func (r *Recorder) Close() error {
+	close(r.done)
+	<-r.stopped
+	return r.Flush()
+}
+
+func (r *Recorder) run(interval time.Duration) {
+	defer close(r.stopped)
+
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+	for {
+		select {
+		case <-ticker.C:
+		case <-r.done:
+			return
+		}
+		if err := r.Flush(); err != nil {
+			log.Printf("failed to write the balance history: %v", err)
+		}
+	}
+}
@@ -0,0 +1,68 @@
+package history
+
+import (
+	"testing"
+	"time"
+)
+
+func TestRecordFoldsChangesIntoBuckets(t *testing.T) {
+	r := &Recorder{pending: make(map[key]*Bucket)}
+	start := time.Date(2024, 3, 1, 10, 59, 30, 0, time.UTC)
+
+	r.Record("4000000000000001", start, 0, 100)
+	r.Record("4000000000000001", start.Add(10*time.Second), 100, 40)
+	r.Record("4000000000000001", start.Add(40*time.Second), 40, 70)
+
+	tests := []struct {
+		resolution Resolution
+		start      time.Time
+		want       Bucket
+	}{
+		{Minute, time.Date(2024, 3, 1, 10, 59, 0, 0, time.UTC), Bucket{Open: 0, High: 100, Low: 0, Close: 40, Events: 2}},
+		{Minute, time.Date(2024, 3, 1, 11, 0, 0, 0, time.UTC), Bucket{Open: 40, High: 70, Low: 40, Close: 70, Events: 1}},
+		{Hour, time.Date(2024, 3, 1, 10, 0, 0, 0, time.UTC), Bucket{Open: 0, High: 100, Low: 0, Close: 40, Events: 2}},
+		{Hour, time.Date(2024, 3, 1, 11, 0, 0, 0, time.UTC), Bucket{Open: 40, High: 70, Low: 40, Close: 70, Events: 1}},
+		{Day, time.Date(2024, 3, 1, 0, 0, 0, 0, time.UTC), Bucket{Open: 0, High: 100, Low: 0, Close: 70, Events: 3}},
+	}
+	if len(r.pending) != len(tests) {
+		t.Errorf("recorded %d buckets, want %d", len(r.pending), len(tests))
+	}
+	for _, tt := range tests {
+		got, ok := r.pending[key{number: "4000000000000001", resolution: tt.resolution, start: tt.start.Unix()}]
+		if !ok {
+			t.Errorf("no %s bucket starting at %v", tt.resolution, tt.start)
+			continue
+		}
+		tt.want.Number, tt.want.Resolution, tt.want.Start = "4000000000000001", tt.resolution, tt.start.Unix()
+		if *got != tt.want {
+			t.Errorf("%s bucket at %v = %+v, want %+v", tt.resolution, tt.start, *got, tt.want)
+		}
+	}
+}
+
+func TestRequeueKeepsOrder(t *testing.T) {
+	r := &Recorder{pending: make(map[key]*Bucket)}
+	at := time.Date(2024, 3, 1, 10, 0, 0, 0, time.UTC)
+
+	r.Record("4000000000000001", at, 0, 10)
+	failed := r.pending
+	r.pending = make(map[key]*Bucket)
+	r.Record("4000000000000001", at.Add(time.Second), 10, 5)
+	r.requeue(failed)
+
+	got := r.pending[key{number: "4000000000000001", resolution: Minute, start: at.Unix()}]
+	if got.Open != 0 || got.Close != 5 || got.High != 10 || got.Low != 0 || got.Events != 2 {
+		t.Errorf("bucket after requeueing a failed flush = %+v, want open 0, close 5, high 10, low 0, 2 events", *got)
+	}
+}
+
+func TestParseResolution(t *testing.T) {
+	for _, r := range Resolutions {
+		if got, err := ParseResolution(string(r)); err != nil || got != r {
+			t.Errorf("ParseResolution(%q) = %q, %v", r, got, err)
+		}
+	}
+	if _, err := ParseResolution("week"); err == nil {
+		t.Error("ParseResolution accepted an unknown resolution")
+	}
+}
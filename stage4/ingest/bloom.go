@@ -0,0 +1,59 @@
+package ingest
+
+// Sizing of the Bloom filter: 10 bits and 7 hashes per key give a false
+// positive rate of about 1%.
+const (
+	bloomBitsPerKey = 10
+	bloomHashes     = 7
+)
+
+// bloomFilter is a set of card numbers packed into integers that answers
+// whether a number may have been added. It has no false negatives, and false
+// positives at a rate that grows once it holds more keys than it was sized
+// for.
+type bloomFilter struct {
+	bits []uint64
+}
+
+// newBloomFilter returns an empty filter sized for keys keys.
+func newBloomFilter(keys int) *bloomFilter {
+	return &bloomFilter{bits: make([]uint64, max(1, (keys*bloomBitsPerKey+63)/64))}
+}
+
+func (f *bloomFilter) add(key uint64) {
+	h1, h2 := bloomHash(key)
+	size := uint64(len(f.bits)) * 64
+	for i := uint64(0); i < bloomHashes; i++ {
+		bit := (h1 + i*h2) % size
+		f.bits[bit/64] |= 1 << (bit % 64)
+	}
+}
+
+func (f *bloomFilter) mayContain(key uint64) bool {
+	h1, h2 := bloomHash(key)
+	size := uint64(len(f.bits)) * 64
+	for i := uint64(0); i < bloomHashes; i++ {
+		bit := (h1 + i*h2) % size
+		if f.bits[bit/64]&(1<<(bit%64)) == 0 {
+			return false
+		}
+	}
+	return true
+}
+
+// bloomHash returns the two hashes of key that the bit positions are
+// derived from by double hashing. The second one is odd, so its multiples
+// don't repeat early.
+func bloomHash(key uint64) (uint64, uint64) {
+	h1 := splitmix64(key)
+	return h1, splitmix64(h1) | 1
+}
+
+// splitmix64 is the output function of the SplitMix64 generator, which maps
+// close integers, like consecutive card numbers, to unrelated ones.
+func splitmix64(x uint64) uint64 {
+	x += 0x9e3779b97f4a7c15
+	x = (x ^ x>>30) * 0xbf58476d1ce4e5b9
+	x = (x ^ x>>27) * 0x94d049bb133111eb
+	return x ^ x>>31
+}
@@ -0,0 +1,164 @@
+package ingest
+
+import (
+	"bufio"
+	"bytes"
+	"encoding/csv"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"strconv"
+	"strings"
+)
+
+// Formats of an imported portfolio.
+const (
+	CSV   = "csv"
+	JSONL = "jsonl"
+)
+
+// maxLineLength bounds a line of JSON, and with it the memory a single
+// record can take.
+const maxLineLength = 1 << 20
+
+// Record is one card of an imported portfolio.
+type Record struct {
+	// Line is the line of the input the record starts on.
+	Line    int
+	Number  string
+	PIN     string
+	Balance int64
+}
+
+// RecordError is a record that couldn't be decoded. Decoding can go on with
+// the next record.
+type RecordError struct {
+	Line int
+	Err  error
+}
+
+func (e *RecordError) Error() string {
+	return fmt.Sprintf("line %d: %v", e.Line, e.Err)
+}
+
+func (e *RecordError) Unwrap() error {
+	return e.Err
+}
+
+// Decoder reads the records of a portfolio one at a time. Decode returns a
+// *RecordError for a malformed record and io.EOF after the last record.
+type Decoder interface {
+	Decode(record *Record) error
+}
+
+// NewDecoder returns a Decoder of the records read from r in the given
+// format. CSV has the columns number, pin and balance, and may start with a
+// header line naming them; JSON lines are objects with the keys number, pin
+// and balance. An empty format is detected from the first character of the
+// input: JSON lines start with {, anything else is taken for CSV.
+func NewDecoder(r io.Reader, format string) (Decoder, error) {
+	buffered := bufio.NewReaderSize(r, 64*1024)
+	if format == "" {
+		format = detectFormat(buffered)
+	}
+	switch format {
+	case CSV:
+		reader := csv.NewReader(buffered)
+		reader.FieldsPerRecord = -1
+		reader.ReuseRecord = true
+		reader.TrimLeadingSpace = true
+		return &csvDecoder{reader: reader}, nil
+	case JSONL:
+		scanner := bufio.NewScanner(buffered)
+		scanner.Buffer(make([]byte, 0, 64*1024), maxLineLength)
+		return &jsonlDecoder{scanner: scanner}, nil
+	}
+	return nil, fmt.Errorf("unknown format %q, expected %s or %s", format, CSV, JSONL)
+}
+
+// detectFormat peeks at the first character of r that isn't white space.
+func detectFormat(r *bufio.Reader) string {
+	for n := 1; n <= r.Size(); n++ {
+		peeked, err := r.Peek(n)
+		if err != nil {
+			break
+		}
+		switch peeked[n-1] {
+		case ' ', '\t', '\r', '\n':
+			continue
+		case '{':
+			return JSONL
+		default:
+			return CSV
+		}
+	}
+	return CSV
+}
+
+type csvDecoder struct {
+	reader  *csv.Reader
+	started bool
+}
+
+func (d *csvDecoder) Decode(record *Record) error {
+	for {
+		fields, err := d.reader.Read()
+		var parseErr *csv.ParseError
+		if errors.As(err, &parseErr) {
+			d.started = true
+			return &RecordError{Line: parseErr.StartLine, Err: parseErr.Err}
+		}
+		if err != nil {
+			return err
+		}
+		line, _ := d.reader.FieldPos(0)
+
+		header := !d.started && strings.EqualFold(fields[0], "number")
+		d.started = true
+		if header {
+			continue
+		}
+		if len(fields) != 3 {
+			return &RecordError{Line: line, Err: fmt.Errorf("expected 3 fields, number, pin and balance, got %d",
+				len(fields))}
+		}
+		balance, err := strconv.ParseInt(fields[2], 10, 64)
+		if err != nil {
+			return &RecordError{Line: line, Err: fmt.Errorf("invalid balance %q", fields[2])}
+		}
+		*record = Record{Line: line, Number: fields[0], PIN: fields[1], Balance: balance}
+		return nil
+	}
+}
+
+type jsonlDecoder struct {
+	scanner *bufio.Scanner
+	line    int
+}
+
+type jsonRecord struct {
+	Number  string `json:"number"`
+	PIN     string `json:"pin"`
+	Balance int64  `json:"balance"`
+}
+
+func (d *jsonlDecoder) Decode(record *Record) error {
+	for d.scanner.Scan() {
+		d.line++
+		text := bytes.TrimSpace(d.scanner.Bytes())
+		if len(text) == 0 {
+			continue
+		}
+		var decoded jsonRecord
+		if err := json.Unmarshal(text, &decoded); err != nil {
+			return &RecordError{Line: d.line, Err: err}
+		}
+		*record = Record{Line: d.line, Number: decoded.Number, PIN: decoded.PIN, Balance: decoded.Balance}
+		return nil
+	}
+	if err := d.scanner.Err(); err != nil {
+		return fmt.Errorf("line %d: %w", d.line+1, err)
+	}
+	return io.EOF
+}
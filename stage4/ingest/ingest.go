@@ -0,0 +1,382 @@
+// Package ingest imports the card portfolios of other processors: existing
+// cards with their numbers, PINs and balances, streamed as CSV or JSON
+// lines. Records are handled in batches of a fixed size, so memory use
+// doesn't depend on the size of the portfolio. The records of a batch are
+// validated and sorted together, then deduplicated with a Bloom filter of
+// the numbers already stored, open or archived, whose hits are confirmed by
+// a merge with the matching rows, and inserted in large transactions
+// together with the journal entries of their opening balances.
+package ingest
+
+import (
+	"cmp"
+	"context"
+	"database/sql"
+	"errors"
+	"io"
+	"slices"
+	"strings"
+	"time"
+
+	"stage4/cardnumber"
+	"stage4/journal"
+)
+
+// Reasons a record is skipped.
+var (
+	ErrInvalidNumber   = errors.New("the card number isn't 16 digits passing the Luhn check")
+	ErrInvalidPIN      = errors.New("the PIN isn't 4 digits")
+	ErrNegativeBalance = errors.New("the balance is negative")
+	ErrDuplicate       = errors.New("the card number already exists")
+)
+
+// lookupBatchSize is the number of numbers looked up per statement when the
+// hits of the Bloom filter are confirmed.
+const lookupBatchSize = 500
+
+// Options configures an import.
+type Options struct {
+	// BatchSize is the number of records validated and deduplicated
+	// together, which bounds the records held in memory.
+	BatchSize int
+	// TransactionSize is the number of cards inserted per transaction.
+	TransactionSize int
+	// ExpectedRecords is the number of records the Bloom filter is sized
+	// for on top of the cards already stored. Larger imports stay correct
+	// but look up more numbers in the database.
+	ExpectedRecords int
+	// HashPIN returns the form a PIN is stored in; nil stores PINs as they
+	// are.
+	HashPIN func(pin string) (string, error)
+	// Progress, if set, is called after every committed transaction.
+	Progress func(Stats)
+	// Reject, if set, is called with every skipped record.
+	Reject func(line int, err error)
+}
+
+// DefaultOptions holds 10 000 records in memory and commits every 100 000
+// cards.
+var DefaultOptions = Options{
+	BatchSize:       10000,
+	TransactionSize: 100000,
+	ExpectedRecords: 1 << 20,
+}
+
+// Stats counts the records of an import.
+type Stats struct {
+	Read       int
+	Imported   int
+	Invalid    int
+	Duplicates int
+	// Journaled is the number of journal entries written, one per imported
+	// card with a balance.
+	Journaled int
+	Elapsed   time.Duration
+}
+
+// candidate is a well-formed record and its number packed into an integer.
+type candidate struct {
+	key    uint64
+	record Record
+}
+
+type importer struct {
+	db      *sql.DB
+	options Options
+	filter  *bloomFilter
+	stats   Stats
+	start   time.Time
+
+	tx          *sql.Tx
+	insertCard  *sql.Stmt
+	insertEntry *sql.Stmt
+	// pending and pendingEntries count the cards and journal entries of
+	// the open transaction.
+	pending        int
+	pendingEntries int
+}
+
+// Import reads every record of decoder and inserts the valid cards whose
+// numbers aren't stored yet, in the card or the card_archive table, into the
+// card table of db, which should be the writer of the banking system. Only
+// the rows in db are checked, so stores buffering writes or deferring the
+// archiving of closed cards must be flushed first. The returned Stats count
+// the cards of the transactions committed before an error.
+func Import(ctx context.Context, db *sql.DB, decoder Decoder, options Options) (Stats, error) {
+	if options.BatchSize <= 0 {
+		options.BatchSize = DefaultOptions.BatchSize
+	}
+	if options.TransactionSize <= 0 {
+		options.TransactionSize = DefaultOptions.TransactionSize
+	}
+	if options.ExpectedRecords <= 0 {
+		options.ExpectedRecords = DefaultOptions.ExpectedRecords
+	}
+
+	im := &importer{db: db, options: options, start: time.Now()}
+	defer im.rollback()
+	err := im.run(ctx, decoder)
+	im.stats.Elapsed = time.Since(im.start)
+	return im.stats, err
+}
+
+func (im *importer) run(ctx context.Context, decoder Decoder) error {
+	if err := im.loadFilter(ctx); err != nil {
+		return err
+	}
+
+	batch := make([]candidate, 0, im.options.BatchSize)
+	for done := false; !done; {
+		batch = batch[:0]
+		for len(batch) < cap(batch) {
+			var record Record
+			err := decoder.Decode(&record)
+			if err == io.EOF {
+				done = true
+				break
+			}
+			var recordErr *RecordError
+			if errors.As(err, &recordErr) {
+				im.stats.Read++
+				im.stats.Invalid++
+				im.skip(recordErr.Line, recordErr.Err)
+				continue
+			}
+			if err != nil {
+				return err
+			}
+			im.stats.Read++
+			batch = append(batch, candidate{record: record})
+		}
+		if err := im.importBatch(ctx, batch); err != nil {
+			return err
+		}
+	}
+	return im.commit()
+}
+
+// loadFilter adds the numbers of the stored and archived cards to a new Bloom
+// filter.
+func (im *importer) loadFilter(ctx context.Context) error {
+	var stored int
+	if err := im.db.QueryRowContext(ctx,
+		"SELECT (SELECT COUNT(*) FROM card) + (SELECT COUNT(*) FROM card_archive)").Scan(&stored); err != nil {
+		return err
+	}
+	im.filter = newBloomFilter(stored + im.options.ExpectedRecords)
+
+	rows, err := im.db.QueryContext(ctx, "SELECT number FROM card UNION ALL SELECT number FROM card_archive")
+	if err != nil {
+		return err
+	}
+	defer rows.Close()
+	for rows.Next() {
+		var number string
+		if err := rows.Scan(&number); err != nil {
+			return err
+		}
+		if n, ok := cardnumber.Parse(number); ok {
+			im.filter.add(n.Uint64())
+		}
+	}
+	return rows.Err()
+}
+
+func (im *importer) importBatch(ctx context.Context, batch []candidate) error {
+	batch = im.validate(batch)
+	if len(batch) == 0 {
+		return nil
+	}
+	// A stable sort keeps the first of the records with the same number.
+	slices.SortStableFunc(batch, func(a, b candidate) int {
+		return cmp.Compare(a.key, b.key)
+	})
+
+	if err := im.begin(ctx); err != nil {
+		return err
+	}
+	batch, err := im.dropDuplicates(ctx, batch)
+	if err != nil {
+		return err
+	}
+	for _, c := range batch {
+		if err := im.insert(ctx, c); err != nil {
+			return err
+		}
+	}
+	return nil
+}
+
+// validate drops the malformed records of a batch and packs the numbers of
+// the others, checking the Luhn sums of the whole batch in one pass.
+func (im *importer) validate(batch []candidate) []candidate {
+	valid := batch[:0]
+	for _, c := range batch {
+		number, ok := cardnumber.Parse(c.record.Number)
+		switch {
+		case !ok || !number.Valid():
+			im.skip(c.record.Line, ErrInvalidNumber)
+		case len(c.record.PIN) != 4 || strings.Trim(c.record.PIN, "0123456789") != "":
+			im.skip(c.record.Line, ErrInvalidPIN)
+		case c.record.Balance < 0:
+			im.skip(c.record.Line, ErrNegativeBalance)
+		default:
+			c.key = number.Uint64()
+			valid = append(valid, c)
+			continue
+		}
+		im.stats.Invalid++
+	}
+	return valid
+}
+
+// dropDuplicates drops the records of a sorted batch whose numbers are
+// repeated in the batch, were imported from an earlier batch or are stored,
+// open or archived.
+// Only the numbers the Bloom filter may contain are looked up, and the
+// sorted rows found are merged with the batch.
+func (im *importer) dropDuplicates(ctx context.Context, batch []candidate) ([]candidate, error) {
+	var suspects []string
+	for i, c := range batch {
+		if (i == 0 || batch[i-1].key != c.key) && im.filter.mayContain(c.key) {
+			suspects = append(suspects, c.record.Number)
+		}
+	}
+	stored, err := im.lookup(ctx, suspects)
+	if err != nil {
+		return nil, err
+	}
+
+	unique := batch[:0]
+	next := 0
+	for i, c := range batch {
+		for next < len(stored) && stored[next] < c.key {
+			next++
+		}
+		repeated := i > 0 && batch[i-1].key == c.key
+		if repeated || next < len(stored) && stored[next] == c.key {
+			im.stats.Duplicates++
+			im.skip(c.record.Line, ErrDuplicate)
+			continue
+		}
+		unique = append(unique, c)
+	}
+	return unique, nil
+}
+
+// lookup returns which of the sorted numbers are stored or archived, packed
+// and sorted.
+// It runs in the open transaction, so it sees the cards imported by it.
+func (im *importer) lookup(ctx context.Context, numbers []string) ([]uint64, error) {
+	var stored []uint64
+	for start := 0; start < len(numbers); start += lookupBatchSize {
+		batch := numbers[start:min(start+lookupBatchSize, len(numbers))]
+		args := make([]any, len(batch))
+		for i, number := range batch {
+			args[i] = number
+		}
+		in := "number IN (?" + strings.Repeat(", ?", len(batch)-1) + ")"
+		query := "SELECT number FROM card WHERE " + in +
+			" UNION SELECT number FROM card_archive WHERE " + in + " ORDER BY number"
+		rows, err := im.tx.QueryContext(ctx, query, append(args, args...)...)
+		if err != nil {
+			return nil, err
+		}
+		for rows.Next() {
+			var number string
+			if err := rows.Scan(&number); err != nil {
+				rows.Close()
+				return nil, err
+			}
+			n, _ := cardnumber.Parse(number)
+			stored = append(stored, n.Uint64())
+		}
+		if err := errors.Join(rows.Err(), rows.Close()); err != nil {
+			return nil, err
+		}
+	}
+	return stored, nil
+}
+
+func (im *importer) insert(ctx context.Context, c candidate) error {
+	pin := c.record.PIN
+	if im.options.HashPIN != nil {
+		var err error
+		if pin, err = im.options.HashPIN(pin); err != nil {
+			return err
+		}
+	}
+	if _, err := im.insertCard.ExecContext(ctx, c.record.Number, pin, c.record.Balance); err != nil {
+		return err
+	}
+	if c.record.Balance != 0 {
+		if _, err := im.insertEntry.ExecContext(ctx, c.record.Number, c.record.Balance, journal.KindImport,
+			time.Now()); err != nil {
+			return err
+		}
+		im.pendingEntries++
+	}
+	im.filter.add(c.key)
+
+	im.pending++
+	if im.pending < im.options.TransactionSize {
+		return nil
+	}
+	if err := im.commit(); err != nil {
+		return err
+	}
+	return im.begin(ctx)
+}
+
+// begin opens a transaction unless one is open already.
+func (im *importer) begin(ctx context.Context) error {
+	if im.tx != nil {
+		return nil
+	}
+	tx, err := im.db.BeginTx(ctx, nil)
+	if err != nil {
+		return err
+	}
+	im.tx = tx
+	if im.insertCard, err = tx.PrepareContext(ctx,
+		"INSERT INTO card (number, pin, balance) VALUES (?, ?, ?)"); err != nil {
+		return err
+	}
+	im.insertEntry, err = tx.PrepareContext(ctx,
+		"INSERT INTO transactions (number, amount, kind, reference, created_at) VALUES (?, ?, ?, '', ?)")
+	return err
+}
+
+// commit commits the open transaction, if any, and reports the progress.
+func (im *importer) commit() error {
+	if im.tx == nil {
+		return nil
+	}
+	err := im.tx.Commit()
+	im.tx = nil
+	if err != nil {
+		return err
+	}
+	im.stats.Imported += im.pending
+	im.stats.Journaled += im.pendingEntries
+	im.pending, im.pendingEntries = 0, 0
+	if im.options.Progress != nil {
+		stats := im.stats
+		stats.Elapsed = time.Since(im.start)
+		im.options.Progress(stats)
+	}
+	return nil
+}
+
+func (im *importer) rollback() {
+	if im.tx != nil {
+		im.tx.Rollback()
+		im.tx = nil
+	}
+}
+
+func (im *importer) skip(line int, err error) {
+	if im.options.Reject != nil {
+		im.options.Reject(line, err)
+	}
+}
@@ -0,0 +1,182 @@
+package ingest
+
+import (
+	"context"
+	"database/sql"
+	"errors"
+	"fmt"
+	"io"
+	"path/filepath"
+	"reflect"
+	"strings"
+	"testing"
+	"time"
+
+	_ "github.com/mattn/go-sqlite3"
+
+	"stage4/cardnumber"
+)
+
+func decodeAll(t *testing.T, input, format string) (records []Record, errs []int) {
+	t.Helper()
+	decoder, err := NewDecoder(strings.NewReader(input), format)
+	if err != nil {
+		t.Fatal(err)
+	}
+	for {
+		var record Record
+		err := decoder.Decode(&record)
+		var recordErr *RecordError
+		switch {
+		case err == io.EOF:
+			return records, errs
+		case errors.As(err, &recordErr):
+			errs = append(errs, recordErr.Line)
+		case err != nil:
+			t.Fatal(err)
+		default:
+			records = append(records, record)
+		}
+	}
+}
+
+func TestDecodeCSV(t *testing.T) {
+	input := "number,pin,balance\n" +
+		"4000000000000002,0001,100\n" +
+		"4000000000000010,0002\n" +
+		"4000000000000028, 0003, 300\n" +
+		"4000000000000036,0004,lots\n"
+	records, errs := decodeAll(t, input, "")
+
+	want := []Record{
+		{Line: 2, Number: "4000000000000002", PIN: "0001", Balance: 100},
+		{Line: 4, Number: "4000000000000028", PIN: "0003", Balance: 300},
+	}
+	if !reflect.DeepEqual(records, want) {
+		t.Errorf("records = %+v, want %+v", records, want)
+	}
+	if !reflect.DeepEqual(errs, []int{3, 5}) {
+		t.Errorf("malformed records reported on lines %v, want 3 and 5", errs)
+	}
+}
+
+func TestDecodeJSONL(t *testing.T) {
+	input := "\n  {\"number\": \"4000000000000002\", \"pin\": \"0001\", \"balance\": 100}\n" +
+		"{\"number\": 4000000000000010}\n" +
+		"\n" +
+		"{\"number\": \"4000000000000028\", \"pin\": \"0003\"}\n"
+	records, errs := decodeAll(t, input, "")
+
+	want := []Record{
+		{Line: 2, Number: "4000000000000002", PIN: "0001", Balance: 100},
+		{Line: 5, Number: "4000000000000028", PIN: "0003"},
+	}
+	if !reflect.DeepEqual(records, want) {
+		t.Errorf("records = %+v, want %+v", records, want)
+	}
+	if !reflect.DeepEqual(errs, []int{3}) {
+		t.Errorf("malformed records reported on lines %v, want 3", errs)
+	}
+	if _, err := NewDecoder(strings.NewReader(""), "xml"); err == nil {
+		t.Error("NewDecoder accepted an unknown format")
+	}
+}
+
+func TestBloomFilter(t *testing.T) {
+	const n = 100000
+	f := newBloomFilter(n)
+	for i := uint64(0); i < n; i++ {
+		f.add(4000000000000000 + i*10)
+	}
+	falsePositives := 0
+	for i := uint64(0); i < n; i++ {
+		if !f.mayContain(4000000000000000 + i*10) {
+			t.Fatalf("the filter lost key %d", i)
+		}
+		if f.mayContain(4000000000000000 + i*10 + 5) {
+			falsePositives++
+		}
+	}
+	if rate := float64(falsePositives) / n; rate > 0.02 {
+		t.Errorf("false positive rate = %.4f, want about 0.01", rate)
+	}
+}
+
+func number(account uint64) string {
+	return cardnumber.Generate(400000, account).String()
+}
+
+func TestImportSkipsInvalidAndDuplicateRecords(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "card.s3db")
+	db, err := sql.Open("sqlite3", "file:"+path+"?_journal_mode=WAL")
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer db.Close()
+	db.SetMaxOpenConns(1)
+	for _, statement := range []string{
+		"CREATE TABLE card (id INTEGER PRIMARY KEY, number TEXT NOT NULL UNIQUE, pin TEXT, balance INTEGER DEFAULT 0)",
+		"CREATE TABLE transactions (id INTEGER PRIMARY KEY, number TEXT NOT NULL, amount INTEGER NOT NULL, " +
+			"kind TEXT NOT NULL, reference TEXT, created_at DATETIME)",
+		"CREATE TABLE card_archive (id INTEGER PRIMARY KEY, number TEXT NOT NULL, pin TEXT, balance INTEGER, " +
+			"closed_at DATETIME NOT NULL)",
+	} {
+		if _, err := db.Exec(statement); err != nil {
+			t.Fatal(err)
+		}
+	}
+	if _, err := db.Exec("INSERT INTO card (number, pin, balance) VALUES (?, '0000', 5)", number(7)); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := db.Exec("INSERT INTO card_archive (number, pin, balance, closed_at) VALUES (?, '0000', 0, ?)",
+		number(13), time.Now()); err != nil {
+		t.Fatal(err)
+	}
+
+	var input strings.Builder
+	for account := uint64(100); account > 0; account-- {
+		fmt.Fprintf(&input, "%s,1234,%d\n", number(account), account)
+	}
+	fmt.Fprintf(&input, "%s,1234,1\n", number(42))   // imported from an earlier batch
+	fmt.Fprintf(&input, "%s,1234,1\n", number(42))   // repeated in its batch
+	fmt.Fprintf(&input, "4000000000000001,1234,1\n") // fails the Luhn check
+	fmt.Fprintf(&input, "%s,12345,1\n", number(101))
+	fmt.Fprintf(&input, "%s,1234,-1\n", number(102))
+	fmt.Fprintf(&input, "%s,1234,0\n", number(103))
+
+	decoder, err := NewDecoder(strings.NewReader(input.String()), CSV)
+	if err != nil {
+		t.Fatal(err)
+	}
+	var rejected []error
+	commits := 0
+	stats, err := Import(context.Background(), db, decoder, Options{
+		BatchSize:       8,
+		TransactionSize: 16,
+		Reject:          func(line int, err error) { rejected = append(rejected, err) },
+		Progress:        func(Stats) { commits++ },
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	want := Stats{Read: 106, Imported: 99, Invalid: 3, Duplicates: 4, Journaled: 98, Elapsed: stats.Elapsed}
+	if stats != want {
+		t.Errorf("stats = %+v, want %+v", stats, want)
+	}
+	if len(rejected) != 7 || commits != 7 {
+		t.Errorf("%d records rejected in %d commits, want 7 in 7", len(rejected), commits)
+	}
+
+	var cards, total, journaled int
+	if err := db.QueryRow("SELECT COUNT(*), SUM(balance) FROM card").Scan(&cards, &total); err != nil {
+		t.Fatal(err)
+	}
+	if err := db.QueryRow("SELECT SUM(amount) FROM transactions WHERE kind = 'import'").Scan(&journaled); err != nil {
+		t.Fatal(err)
+	}
+	if cards != 100 || total != 5+5050-7-13 || journaled != 5050-7-13 {
+		t.Errorf("%d cards with %d in total and %d journaled, want 100 with %d and %d",
+			cards, total, journaled, 5+5050-7-13, 5050-7-13)
+	}
+}
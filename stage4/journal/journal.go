@@ -0,0 +1,219 @@
+// Package journal keeps an append-only record of every balance change made
+// by the banking system, so balances can be audited and rebuilt by replay.
+package journal
+
+import (
+	"fmt"
+	"time"
+
+	"gorm.io/gorm"
+)
+
+// DefaultCheckpointInterval is the number of journal entries written between
+// two checkpoints.
+const DefaultCheckpointInterval = 1000
+
+// Kinds of journal entries.
+const (
+	KindIncome      = "income"
+	KindTransferOut = "transfer_out"
+	KindTransferIn  = "transfer_in"
+	// KindImport is the opening balance of a card imported from another
+	// processor.
+	KindImport = "import"
+	// KindClose takes the balance of a closed account out, so a card
+	// reissued with its number starts from zero.
+	KindClose = "close"
+)
+
+// Entry is a single signed balance change of one card.
+type Entry struct {
+	ID        uint   `gorm:"primaryKey"`
+	Number    string `gorm:"index;not null"`
+	Amount    int    `gorm:"not null"`
+	Kind      string `gorm:"not null"`
+	Reference string
+	CreatedAt time.Time
+}
+
+func (Entry) TableName() string {
+	return "transactions"
+}
+
+// Checkpoint marks the journal position up to which balances were folded
+// into CheckpointBalance rows.
+type Checkpoint struct {
+	ID          uint `gorm:"primaryKey"`
+	LastEntryID uint `gorm:"not null"`
+	CreatedAt   time.Time
+}
+
+func (Checkpoint) TableName() string {
+	return "journal_checkpoints"
+}
+
+// CheckpointBalance is the balance of one card as of a checkpoint.
+type CheckpointBalance struct {
+	CheckpointID uint   `gorm:"primaryKey;autoIncrement:false"`
+	Number       string `gorm:"primaryKey"`
+	Balance      int    `gorm:"not null"`
+}
+
+func (CheckpointBalance) TableName() string {
+	return "journal_checkpoint_balances"
+}
+
+// Migrate creates the journal tables if they don't exist yet.
+func Migrate(db *gorm.DB) error {
+	if err := db.AutoMigrate(&Entry{}, &Checkpoint{}, &CheckpointBalance{}); err != nil {
+		return fmt.Errorf("failed to migrate journal tables: %w", err)
+	}
+	return nil
+}
+
+// Append records entries using tx, which must be the transaction that applies
+// the balance change itself, so the journal and the card table never diverge.
+func Append(tx *gorm.DB, entries ...Entry) error {
+	if len(entries) == 0 {
+		return nil
+	}
+	return tx.Create(&entries).Error
+}
+
+// latestCheckpoint returns the most recent checkpoint, or a zero Checkpoint
+// when the journal has never been checkpointed.
+func latestCheckpoint(db *gorm.DB) (Checkpoint, error) {
+	var cp Checkpoint
+	err := db.Order("id DESC").Limit(1).Find(&cp).Error
+	return cp, err
+}
+
+// TakeCheckpoint folds the previous checkpoint and every entry written after
+// it into a new checkpoint. The balances of the superseded checkpoint are
+// dropped, so the checkpoint tables stay proportional to the number of cards.
+func TakeCheckpoint(db *gorm.DB) error {
+	return db.Transaction(func(tx *gorm.DB) error {
+		last, err := latestCheckpoint(tx)
+		if err != nil {
+			return err
+		}
+
+		var lastEntryID uint
+		if err := tx.Model(&Entry{}).Select("COALESCE(MAX(id), 0)").Scan(&lastEntryID).Error; err != nil {
+			return err
+		}
+		if lastEntryID <= last.LastEntryID {
+			return nil
+		}
+
+		cp := Checkpoint{LastEntryID: lastEntryID}
+		if err := tx.Create(&cp).Error; err != nil {
+			return err
+		}
+
+		err = tx.Exec(`INSERT INTO journal_checkpoint_balances (checkpoint_id, number, balance)
+			SELECT ?, number, SUM(amount) FROM (
+				SELECT number, balance AS amount FROM journal_checkpoint_balances WHERE checkpoint_id = ?
+				UNION ALL
+				SELECT number, amount FROM transactions WHERE id > ? AND id <= ?
+			) GROUP BY number`,
+			cp.ID, last.ID, last.LastEntryID, lastEntryID).Error
+		if err != nil {
+			return err
+		}
+
+		return tx.Where("checkpoint_id = ?", last.ID).Delete(&CheckpointBalance{}).Error
+	})
+}
+
+// Checkpointer takes a checkpoint every Interval appended entries.
+type Checkpointer struct {
+	db       *gorm.DB
+	interval int
+	pending  int
+}
+
+// NewCheckpointer returns a Checkpointer that already accounts for the
+// entries written since the latest checkpoint by previous runs.
+func NewCheckpointer(db *gorm.DB, interval int) (*Checkpointer, error) {
+	last, err := latestCheckpoint(db)
+	if err != nil {
+		return nil, err
+	}
+
+	var pending int64
+	if err := db.Model(&Entry{}).Where("id > ?", last.LastEntryID).Count(&pending).Error; err != nil {
+		return nil, err
+	}
+
+	return &Checkpointer{db: db, interval: interval, pending: int(pending)}, nil
+}
+
+// Appended must be called after a transaction that appended n entries has
+// been committed.
+func (c *Checkpointer) Appended(n int) error {
+	c.pending += n
+	if c.interval <= 0 || c.pending < c.interval {
+		return nil
+	}
+	if err := TakeCheckpoint(c.db); err != nil {
+		return fmt.Errorf("failed to checkpoint the journal: %w", err)
+	}
+	c.pending = 0
+	return nil
+}
+
+// Replay rebuilds balances from the latest checkpoint and the entries written
+// after it, calling fn once per open card in card number order: every card
+// of the card table that isn't marked closed in card_closing, with a zero
+// balance if it has no entries. The entries of archived cards are skipped.
+// Rows are streamed and folded one card at a time, so memory use doesn't
+// depend on the size of the journal.
+func Replay(db *gorm.DB, fn func(number string, balance int) error) error {
+	last, err := latestCheckpoint(db)
+	if err != nil {
+		return err
+	}
+
+	rows, err := db.Raw(`SELECT card.number, COALESCE(journal.amount, 0) FROM card
+		LEFT JOIN (
+			SELECT number, balance AS amount, 0 AS seq FROM journal_checkpoint_balances WHERE checkpoint_id = ?
+			UNION ALL
+			SELECT number, amount, id AS seq FROM transactions WHERE id > ?
+		) AS journal ON journal.number = card.number
+		WHERE card.number NOT IN (SELECT number FROM card_closing)
+		ORDER BY card.number, journal.seq`,
+		last.ID, last.LastEntryID).Rows()
+	if err != nil {
+		return err
+	}
+	defer rows.Close()
+
+	var (
+		current string
+		balance int
+		started bool
+	)
+	for rows.Next() {
+		var number string
+		var amount int
+		if err := rows.Scan(&number, &amount); err != nil {
+			return err
+		}
+		if started && number != current {
+			if err := fn(current, balance); err != nil {
+				return err
+			}
+			balance = 0
+		}
+		current, started = number, true
+		balance += amount
+	}
+	if err := rows.Err(); err != nil {
+		return err
+	}
+	if started {
+		return fn(current, balance)
+	}
+	return nil
+}
@@ -1,15 +1,44 @@
 package main
 
 import (
+	"context"
+	"errors"
+	"flag"
 	"fmt"
 	"gorm.io/driver/sqlite"
 	"gorm.io/gorm"
+	"gorm.io/gorm/clause"
+	"io"
 	"log"
 	"math/rand"
+	"os"
+	"stage4/archive"
+	"stage4/auth"
+	"stage4/cardnumber"
+	"stage4/history"
+	"stage4/ingest"
+	"stage4/journal"
+	"stage4/metrics"
+	"stage4/pool"
+	"stage4/profiling"
+	"stage4/ratelimit"
+	"stage4/report"
+	"stage4/sqlxstore"
+	"stage4/store"
+	"stage4/store/gormstore"
+	"stage4/store/memstore"
+	"stage4/transfer"
+	"strconv"
+	"sync"
+	"sync/atomic"
+	"time"
 )
 
 const DatabaseName = "card.s3db"
 
+// IIN is the issuer identification number every card number starts with.
+const IIN = 400000
+
 const (
 	MainMenuCreateAccount = "1. Create an account"
 	MainMenuLogin         = "2. Log into account"
@@ -30,66 +59,77 @@ const (
 )
 
 const (
-	WrongCredentialsMsg = "Wrong card number or PIN"
-	WrongOptionMsg      = "Wrong option!"
-	LoggedInMsg         = "You have successfully logged in!"
-	LoggedOutMsg        = "You have successfully logged out!"
-	GoodbyeMsg          = "Bye!"
-	CardCreatedMsg      = "Your card has been created"
-	CardNumberMsg       = "Your card number:\n%s\n"
-	CardPINMsg          = "Your card PIN:\n%s\n\n"
-	BalanceMsg          = "Balance: %d"
-	IncomePrompt        = "Enter income:"
-	TransferPrompt      = "Transfer\nEnter card number:"
-	CloseAccountMsg     = "The account has been closed!"
+	WrongCredentialsMsg  = "Wrong card number or PIN"
+	TooManyAttemptsMsg   = "Too many failed attempts, please try again later"
+	SlowedDownMsg        = "Too many failed attempts in this session, answering in %v\n"
+	WrongOptionMsg       = "Wrong option!"
+	LoggedInMsg          = "You have successfully logged in!"
+	LoggedOutMsg         = "You have successfully logged out!"
+	GoodbyeMsg           = "Bye!"
+	CardCreatedMsg       = "Your card has been created"
+	CardNumberMsg        = "Your card number:\n%s\n"
+	CardPINMsg           = "Your card PIN:\n%s\n\n"
+	BalanceMsg           = "Balance: %d"
+	IncomePrompt         = "Enter income:"
+	TransferPrompt       = "Transfer\nEnter card number:"
+	TransferAmountPrompt = "Enter how much money you want to transfer:"
+	TransferSuccessMsg   = "Success!"
+	SameAccountMsg       = "You can't transfer money to the same account!"
+	CardNumberMistakeMsg = "Probably you made a mistake in the card number. Please try again!"
+	NoSuchCardMsg        = "Such a card does not exist."
+	InvalidAmountMsg     = "The amount must be a positive number!"
+	NotEnoughMoneyMsg    = "Not enough money!"
+	CloseAccountMsg      = "The account has been closed!"
 )
 
-func luhnAlgorithm(number string) bool {
-	sum := 0
-
-	for i, char := range number {
-		digit := int(char - '0')
-
-		if (len(number)-i)%2 == 0 {
-			digit *= 2
-			if digit > 9 {
-				digit -= 9
-			}
-		}
-
-		sum += digit
-	}
+type Card = store.Card
 
-	return sum%10 == 0
+// LoginLockout is a card locked out after too many failed logins.
+type LoginLockout struct {
+	Number      string    `gorm:"primaryKey"`
+	LockedUntil time.Time `gorm:"not null"`
 }
 
-func generateLuhnChecksum(number string) int {
-	checksum := 0
-
-	for i := 0; i <= 9; i++ {
-		if luhnAlgorithm(number + fmt.Sprintf("%d", i)) {
-			checksum = i
-			break
-		}
-	}
-
-	return checksum
+func (LoginLockout) TableName() string {
+	return "login_lockouts"
 }
 
-type Card struct {
-	// gorm.Model // WE CANT USE GORM MODEL
-	ID      uint   `gorm:"primaryKey"`
-	Number  string `gorm:"unique;not null"`
-	PIN     string
-	Balance int `gorm:"default:0"`
-}
-
-func (Card) TableName() string {
-	return "card"
+// Config holds the tunable settings of a BankingSystem.
+type Config struct {
+	CheckpointInterval int
+	// PINIterations is the PBKDF2 cost of stored PINs; 0 stores them in plaintext.
+	PINIterations int
+	AuthCacheTTL  time.Duration
+	RateLimit     ratelimit.Config
+	// Store names the backend keeping the cards, see package store.
+	Store string
+	// WriteBehind configures the flusher of the memory store.
+	WriteBehind memstore.Options
+	// Archive configures how closed accounts are moved to the archive.
+	Archive archive.Options
+	// History configures the balance history recorder.
+	History history.Options
+	// Seed makes the card numbers and PINs of new accounts reproducible, so
+	// a load scenario replays exactly; 0 picks a random seed.
+	Seed int64
 }
 
 type BankingSystem struct {
-	db *gorm.DB
+	db           *gorm.DB
+	reader       *gorm.DB
+	store        store.Store
+	checkpointer *journal.Checkpointer
+	metrics      *metrics.Registry
+	auth         *auth.Authenticator
+	limiter      *ratelimit.Limiter
+	transfers    *transfer.Pipeline
+	history      *history.Recorder
+	// rng draws the cards of new accounts; seeded reports whether it was
+	// given a seed.
+	rng    *rand.Rand
+	seeded bool
+	// balances reads balances without locking, if the store can.
+	balances store.BalanceReader
 }
 
 func (bs *BankingSystem) MainMenu() {
@@ -105,8 +145,13 @@ func (bs *BankingSystem) MainMenu() {
 		case 1:
 			bs.CreateAccount()
 		case 2:
-			bs.Login()
+			if bs.Login() {
+				bs.flush()
+				fmt.Println("\n" + GoodbyeMsg)
+				return
+			}
 		case 0:
+			bs.flush()
 			fmt.Println("\n" + GoodbyeMsg)
 			return
 		default:
@@ -116,13 +161,20 @@ func (bs *BankingSystem) MainMenu() {
 }
 
 func (bs *BankingSystem) CreateAccount() {
+	timer := bs.metrics.StartTimer("CreateAccount")
+	defer timer.Stop()
+
 	cardNumber, pin := bs.GenerateCardAndPIN()
-	card := Card{Number: cardNumber, PIN: pin}
-	result := bs.db.Create(&card)
-	if result.Error != nil {
-		fmt.Printf("cannot create card: %v\n", result.Error)
+	storedPIN, err := bs.auth.Hash(pin)
+	if err != nil {
+		fmt.Printf("cannot create card: %v\n", err)
+		return
+	}
+	if err := bs.store.Create(Card{Number: cardNumber, PIN: storedPIN}); err != nil {
+		fmt.Printf("cannot create card: %v\n", err)
 		return
 	}
+	bs.transfers.Created(cardNumber)
 
 	fmt.Println("\n" + CardCreatedMsg)
 	fmt.Printf(CardNumberMsg, cardNumber)
@@ -130,14 +182,162 @@ func (bs *BankingSystem) CreateAccount() {
 }
 
 func (bs *BankingSystem) GenerateCardAndPIN() (string, string) {
-	cardBase := "400000" + fmt.Sprintf("%09d", rand.Intn(1000000000))
-	checksum := generateLuhnChecksum(cardBase)
-	cardNumber := cardBase + fmt.Sprintf("%d", checksum)
-	pin := fmt.Sprintf("%04d", rand.Intn(10000))
-	return cardNumber, pin
+	cardNumber := cardnumber.Generate(IIN, uint64(bs.rng.Intn(1000000000)))
+	pin := bs.rng.Intn(10000)
+	pinDigits := [4]byte{byte('0' + pin/1000), byte('0' + pin/100%10), byte('0' + pin/10%10), byte('0' + pin%10)}
+	return cardNumber.String(), string(pinDigits[:])
+}
+
+// issueBatchSize is the number of cards inserted per statement by IssueCards.
+const issueBatchSize = 1000
+
+// IssueCards issues count new cards with the parallel generator and bulk
+// inserts them in one transaction. Numbers that are already taken are
+// skipped and replaced by further rounds. Cards are inserted directly into
+// the database, whichever store serves the menus.
+func (bs *BankingSystem) IssueCards(count int) error {
+	start := time.Now()
+	generator := cardnumber.Generator{IIN: IIN}
+	for issued := 0; issued < count; {
+		if bs.seeded {
+			// Every round draws other numbers, still from the seed.
+			generator.Seed = max(1, bs.rng.Int63())
+		}
+		batch, err := generator.Generate(count - issued)
+		if err != nil {
+			return err
+		}
+
+		cards := make([]Card, len(batch))
+		for i := range batch {
+			storedPIN, err := bs.auth.Hash(string(batch[i].PIN[:]))
+			if err != nil {
+				return err
+			}
+			cards[i] = Card{Number: batch[i].Number.String(), PIN: storedPIN}
+		}
+
+		result := bs.db.Clauses(clause.OnConflict{DoNothing: true}).CreateInBatches(cards, issueBatchSize)
+		if result.Error != nil {
+			return result.Error
+		}
+		issued += int(result.RowsAffected)
+	}
+	fmt.Printf("Issued %d cards in %v\n", count, time.Since(start).Round(time.Millisecond))
+	return nil
 }
 
-func (bs *BankingSystem) Login() {
+// ImportCards imports the cards of a portfolio read from r in the given
+// format, csv or jsonl, or detected from the input if format is empty.
+// Skipped records and the progress after every transaction are printed to
+// stderr. Like IssueCards, it inserts the cards directly into the database,
+// after flushing the store so the duplicates checked against it include the
+// cards still buffered or waiting to be archived.
+func (bs *BankingSystem) ImportCards(r io.Reader, format string) error {
+	decoder, err := ingest.NewDecoder(r, format)
+	if err != nil {
+		return err
+	}
+	if flusher, ok := bs.store.(store.Flusher); ok {
+		if err := flusher.Flush(); err != nil {
+			return err
+		}
+	}
+	writer, err := bs.db.DB()
+	if err != nil {
+		return err
+	}
+
+	options := ingest.DefaultOptions
+	options.HashPIN = bs.auth.Hash
+	options.Reject = func(line int, err error) {
+		fmt.Fprintf(os.Stderr, "line %d skipped: %v\n", line, err)
+	}
+	options.Progress = func(stats ingest.Stats) {
+		fmt.Fprintf(os.Stderr, "%d records read, %d cards imported in %v\n",
+			stats.Read, stats.Imported, stats.Elapsed.Round(time.Millisecond))
+	}
+	stats, err := ingest.Import(context.Background(), writer, decoder, options)
+	bs.journalAppended(stats.Journaled)
+	if err != nil {
+		return err
+	}
+	fmt.Printf("Imported %d cards in %v, skipped %d invalid and %d duplicate records\n",
+		stats.Imported, stats.Elapsed.Round(time.Millisecond), stats.Invalid, stats.Duplicates)
+	return nil
+}
+
+// SimulateTransfers makes count transfers of 1 between random pairs of
+// stored cards on the given number of goroutines, all through the store, and
+// prints the throughput. With the memory store the transfers run
+// concurrently; the SQL stores queue them on their single writer. The pairs
+// are drawn from the seed of the banking system.
+func (bs *BankingSystem) SimulateTransfers(goroutines, count int) error {
+	var numbers []string
+	if err := bs.reader.Model(&Card{}).Order("number").Pluck("number", &numbers).Error; err != nil {
+		return err
+	}
+	if len(numbers) < 2 {
+		return errors.New("at least two cards are needed")
+	}
+
+	start := time.Now()
+	var made, refused atomic.Int64
+	errs := make([]error, goroutines)
+	var wg sync.WaitGroup
+	for g := 0; g < goroutines; g++ {
+		wg.Add(1)
+		rng := rand.New(rand.NewSource(bs.rng.Int63()))
+		go func(g int) {
+			defer wg.Done()
+			for i := g; i < count; i += goroutines {
+				from, to := rng.Intn(len(numbers)), rng.Intn(len(numbers)-1)
+				if to >= from {
+					to++
+				}
+				_, _, err := bs.store.Transfer(numbers[from], numbers[to], 1)
+				switch {
+				case errors.Is(err, transfer.ErrInsufficientFunds), errors.Is(err, transfer.ErrUnknownCard):
+					refused.Add(1)
+				case err != nil:
+					errs[g] = err
+					return
+				default:
+					made.Add(1)
+				}
+			}
+		}(g)
+	}
+	wg.Wait()
+	elapsed := time.Since(start)
+	bs.journalAppended(2 * int(made.Load()))
+	if err := errors.Join(errs...); err != nil {
+		return err
+	}
+
+	fmt.Printf("Made %d transfers and refused %d on %d goroutines in %v, %.0f transfers/s\n",
+		made.Load(), refused.Load(), goroutines, elapsed.Round(time.Millisecond),
+		float64(made.Load()+refused.Load())/elapsed.Seconds())
+	return nil
+}
+
+// PrintHistory prints the balance history of a card at the given resolution
+// from since on, one bucket per line.
+func (bs *BankingSystem) PrintHistory(number string, resolution history.Resolution, since time.Time) error {
+	buckets, err := history.Series(bs.reader, number, resolution, since)
+	if err != nil {
+		return err
+	}
+	fmt.Println("start open high low close events")
+	for _, b := range buckets {
+		start := time.Unix(b.Start, 0).UTC().Format(time.RFC3339)
+		fmt.Printf("%s %d %d %d %d %d\n", start, b.Open, b.High, b.Low, b.Close, b.Events)
+	}
+	return nil
+}
+
+// Login reports whether the user chose to exit from the account menu.
+func (bs *BankingSystem) Login() bool {
 	fmt.Println("\n" + CardNumberPrompt)
 	var cardNumber string
 	fmt.Scanln(&cardNumber)
@@ -146,18 +346,37 @@ func (bs *BankingSystem) Login() {
 	var pin string
 	fmt.Scanln(&pin)
 
-	var card Card
-	result := bs.db.Where("number = ? AND pin = ?", cardNumber, pin).First(&card)
-	if result.Error != nil {
+	timer := bs.metrics.StartTimer("Login")
+	if !bs.limiter.Allow(cardNumber) {
+		fmt.Println("\n" + TooManyAttemptsMsg)
+		timer.Stop()
+		return false
+	}
+
+	card, err := bs.store.Authenticate(cardNumber, func(storedPIN string) bool {
+		return bs.auth.Verify(cardNumber, pin, storedPIN)
+	})
+	if errors.Is(err, store.ErrNotFound) {
+		bs.auth.Reject(pin)
+	}
+	if err != nil {
+		if wait := bs.limiter.Failed(cardNumber); wait > 0 {
+			fmt.Printf("\n"+SlowedDownMsg, wait.Round(time.Millisecond))
+			time.Sleep(wait)
+		}
 		fmt.Println("\n" + WrongCredentialsMsg)
-		return
+		timer.Stop()
+		return false
 	}
+	bs.limiter.Succeeded(cardNumber)
 
 	fmt.Println("\n" + LoggedInMsg)
-	bs.AccountOperationsMenu(&card)
+	timer.Stop()
+	return bs.AccountOperationsMenu(&card)
 }
 
-func (bs *BankingSystem) AccountOperationsMenu(card *Card) {
+// AccountOperationsMenu reports whether the user chose to exit the program.
+func (bs *BankingSystem) AccountOperationsMenu(card *Card) bool {
 	for {
 		fmt.Println("\n" + AccountOperationsBalance)
 		fmt.Println(AccountOperationsAddIncome)
@@ -171,37 +390,57 @@ func (bs *BankingSystem) AccountOperationsMenu(card *Card) {
 
 		switch choice {
 		case 1:
-			fmt.Printf("\n"+BalanceMsg+"\n", card.Balance)
+			bs.Balance(card)
 		case 2:
 			bs.AddIncome(card)
 		case 3:
 			bs.DoTransfer(card)
 		case 4:
 			bs.CloseAccount(card)
-			return
+			return false
 		case 5:
 			fmt.Println("\n" + LoggedOutMsg)
-			return
+			return false
 		case 0:
-			return
+			return true
 		default:
 			fmt.Println(WrongOptionMsg)
 		}
 	}
 }
 
+// Balance prints the balance of card. Stores that read balances without
+// locking are asked for the current one, which concurrent transfers may have
+// changed since the card was read; the others print the balance as of the
+// last operation of the session, saving a query.
+func (bs *BankingSystem) Balance(card *Card) {
+	if bs.balances != nil {
+		balance, err := bs.balances.Balance(card.Number)
+		if err != nil {
+			fmt.Println("Error reading balance:", err)
+			return
+		}
+		card.Balance = balance
+	}
+	fmt.Printf("\n"+BalanceMsg+"\n", card.Balance)
+}
+
 func (bs *BankingSystem) AddIncome(card *Card) {
 	fmt.Println(IncomePrompt)
 	var income int
 	fmt.Scanln(&income)
 
-	result := bs.db.Model(&card).Update("balance", gorm.Expr("balance + ?", income))
-	if result.Error != nil {
-		fmt.Println("Error updating balance:", result.Error)
+	timer := bs.metrics.StartTimer("AddIncome")
+	defer timer.Stop()
+
+	updated, err := bs.store.Credit(card.Number, income)
+	if err != nil {
+		fmt.Println("Error updating balance:", err)
 		return
 	}
-	// Update the in-memory card's balance by re-querying the database
-	bs.db.Where("number = ? AND pin = ?", card.Number, card.PIN).First(&card)
+	*card = updated
+	bs.history.Record(card.Number, time.Now(), updated.Balance-income, updated.Balance)
+	bs.journalAppended(1)
 
 	fmt.Println("Income was added!")
 }
@@ -211,57 +450,109 @@ func (bs *BankingSystem) DoTransfer(card *Card) {
 	var anotherCardNumber string
 	fmt.Scanln(&anotherCardNumber)
 
-	if card.Number == anotherCardNumber {
-		fmt.Println("You can't transfer money to the same account!")
+	timer := bs.metrics.StartTimer("DoTransfer")
+	defer timer.Stop()
+
+	if err := bs.transfers.ValidateTarget(card.Number, anotherCardNumber); err != nil {
+		printTransferError(err)
 		return
 	}
 
-	if !luhnAlgorithm(anotherCardNumber) {
-		fmt.Println("Probably you made a mistake in the card number. Please try again!")
+	fmt.Println(TransferAmountPrompt)
+	timer.Pause()
+	var amount int
+	fmt.Scanln(&amount)
+	timer.Resume()
+
+	if err := bs.transfers.ValidateAmount(card.Balance, amount); err != nil {
+		printTransferError(err)
 		return
 	}
 
-	var anotherCard Card
-	result := bs.db.Where("number = ?", anotherCardNumber).First(&anotherCard)
-	if result.Error != nil {
-		fmt.Println("Such a card does not exist.")
+	updated, receiver, err := bs.store.Transfer(card.Number, anotherCardNumber, amount)
+	switch {
+	case errors.Is(err, transfer.ErrUnknownCard):
+		bs.transfers.Closed(anotherCardNumber)
+		printTransferError(err)
+		return
+	case errors.Is(err, transfer.ErrInsufficientFunds):
+		printTransferError(err)
 		return
+	case err != nil:
+		log.Fatal(err)
 	}
 
-	fmt.Println("Enter how much money you want to transfer:")
-	var amount int
-	fmt.Scanln(&amount)
+	*card = updated
+	now := time.Now()
+	bs.history.Record(updated.Number, now, updated.Balance+amount, updated.Balance)
+	bs.history.Record(receiver.Number, now, receiver.Balance-amount, receiver.Balance)
+	fmt.Println(TransferSuccessMsg)
+	bs.journalAppended(2)
+}
 
-	if card.Balance < amount {
-		fmt.Println("Not enough money!")
-		return
+func printTransferError(err error) {
+	switch {
+	case errors.Is(err, transfer.ErrSameAccount):
+		fmt.Println(SameAccountMsg)
+	case errors.Is(err, transfer.ErrMalformedNumber):
+		fmt.Println(CardNumberMistakeMsg)
+	case errors.Is(err, transfer.ErrUnknownCard):
+		fmt.Println(NoSuchCardMsg)
+	case errors.Is(err, transfer.ErrInvalidAmount):
+		fmt.Println(InvalidAmountMsg)
+	case errors.Is(err, transfer.ErrInsufficientFunds):
+		fmt.Println(NotEnoughMoneyMsg)
+	default:
+		fmt.Println("Transfer failed:", err)
 	}
+}
 
-	err := bs.db.Transaction(func(tx *gorm.DB) error {
-		if err := tx.Model(&card).Update("balance", gorm.Expr("balance - ?", amount)).Error; err != nil {
-			return err
-		}
-		if err := tx.Model(&anotherCard).Update("balance", gorm.Expr("balance + ?", amount)).Error; err != nil {
-			return err
-		}
-		tx.Where("number = ? AND pin = ?", card.Number, card.PIN).First(&card)
-		fmt.Println("Success!")
-		return nil
-	})
-	if err != nil {
-		log.Fatal(err)
+// cardExists reports whether a card with the given number is stored.
+func (bs *BankingSystem) cardExists(number string) (bool, error) {
+	_, err := bs.store.Get(number)
+	if errors.Is(err, store.ErrNotFound) {
+		return false, nil
+	}
+	return err == nil, err
+}
+
+// journalAppended lets the checkpointer know that n journal entries were committed.
+func (bs *BankingSystem) journalAppended(n int) {
+	if err := bs.checkpointer.Appended(n); err != nil {
+		log.Println(err)
 	}
 }
 
 func (bs *BankingSystem) CloseAccount(card *Card) {
-	result := bs.db.Delete(&card)
-	if result.Error != nil {
-		log.Fatal(result.Error)
+	timer := bs.metrics.StartTimer("CloseAccount")
+	defer timer.Stop()
+
+	if err := bs.store.Delete(card.Number); err != nil {
+		log.Fatal(err)
 	}
+	if card.Balance != 0 {
+		bs.journalAppended(1)
+	}
+	bs.auth.Forget(card.Number)
+	bs.transfers.Closed(card.Number)
 	fmt.Println(CloseAccountMsg)
 }
 
-func NewBankingSystem(db *gorm.DB) (*BankingSystem, error) {
+// NewBankingSystem returns a banking system that writes through db and runs
+// lookups that don't need to see its own uncommitted writes through reader.
+func NewBankingSystem(db, reader *gorm.DB, config Config) (*BankingSystem, error) {
+	registry := metrics.NewRegistry()
+	if err := errors.Join(instrumentStatements(db, registry), instrumentStatements(reader, registry)); err != nil {
+		return nil, fmt.Errorf("failed to instrument the database: %w", err)
+	}
+	writer, err := db.DB()
+	if err != nil {
+		return nil, err
+	}
+	if err := archive.PrepareIncrementalVacuum(writer); err != nil {
+		return nil, fmt.Errorf("failed to enable incremental vacuum: %w", err)
+	}
+
 	if !db.Migrator().HasTable(&Card{}) {
 		err := db.Migrator().CreateTable(&Card{})
 		if err != nil {
@@ -269,21 +560,444 @@ func NewBankingSystem(db *gorm.DB) (*BankingSystem, error) {
 		}
 	}
 
-	return &BankingSystem{
-		db: db,
-	}, nil
+	if err := journal.Migrate(db); err != nil {
+		return nil, err
+	}
+	if err := archive.Migrate(db); err != nil {
+		return nil, err
+	}
+	if err := history.Migrate(db); err != nil {
+		return nil, err
+	}
+
+	checkpointer, err := journal.NewCheckpointer(db, config.CheckpointInterval)
+	if err != nil {
+		return nil, fmt.Errorf("failed to load the journal checkpoint: %w", err)
+	}
+
+	authenticator, err := auth.NewAuthenticator(auth.Hasher{Iterations: config.PINIterations}, config.AuthCacheTTL)
+	if err != nil {
+		return nil, fmt.Errorf("failed to set up authentication: %w", err)
+	}
+
+	limiter, err := loadLockouts(db, config.RateLimit)
+	if err != nil {
+		return nil, err
+	}
+
+	cards, err := openStore(config, db, reader, registry)
+	if err != nil {
+		return nil, fmt.Errorf("failed to open the %s store: %w", config.Store, err)
+	}
+
+	archived, err := archive.New(cards, writer, config.Archive)
+	if err != nil {
+		return nil, err
+	}
+	bs := &BankingSystem{
+		db:           db,
+		reader:       reader,
+		store:        archived,
+		checkpointer: checkpointer,
+		metrics:      registry,
+		auth:         authenticator,
+		limiter:      limiter,
+		history:      history.NewRecorder(db, config.History),
+		seeded:       config.Seed != 0,
+	}
+	if _, ok := cards.(store.BalanceReader); ok {
+		bs.balances = archived
+	}
+	if bs.seeded {
+		bs.rng = rand.New(rand.NewSource(config.Seed))
+	} else {
+		bs.rng = rand.New(rand.NewSource(time.Now().UnixNano()))
+	}
+	bs.transfers = transfer.NewPipeline(strconv.Itoa(IIN), bs.cardExists, transfer.DefaultNegativeTTL)
+	return bs, nil
+}
+
+// openStore opens the named storage backend over the database handles of
+// the banking system.
+func openStore(config Config, db, reader *gorm.DB, registry *metrics.Registry) (archive.Backend, error) {
+	switch config.Store {
+	case store.GORM:
+		return gormstore.New(db, reader), nil
+	case store.SQLX:
+		writerPool, err := db.DB()
+		if err != nil {
+			return nil, err
+		}
+		readerPool, err := reader.DB()
+		if err != nil {
+			return nil, err
+		}
+		repo := sqlxstore.New(writerPool, readerPool)
+		repo.Observe(registry.ObserveStatement)
+		return repo, nil
+	case store.Memory:
+		return memstore.Open(gormstore.New(db, reader), config.WriteBehind)
+	}
+	return nil, store.ValidateBackend(config.Store)
+}
+
+// flush makes the writes buffered by the store and the balance history
+// durable before the user is told goodbye, so a crash after the exit message
+// loses nothing.
+func (bs *BankingSystem) flush() {
+	if flusher, ok := bs.store.(store.Flusher); ok {
+		if err := flusher.Flush(); err != nil {
+			log.Printf("failed to flush the store: %v", err)
+		}
+	}
+	if err := bs.history.Flush(); err != nil {
+		log.Printf("failed to flush the balance history: %v", err)
+	}
+}
+
+// Close closes the store and the history recorder, saving the changes they
+// buffer.
+func (bs *BankingSystem) Close() error {
+	return errors.Join(bs.store.Close(), bs.history.Close())
+}
+
+// Shutdown saves the changes buffered by the store, the history recorder and
+// the login limiter, then closes the pools, checkpointing the WAL within
+// budget. The whole shutdown is recorded as the Shutdown operation and the
+// checkpoint as Checkpoint, so a metrics dump written afterwards reports
+// both.
+func (bs *BankingSystem) Shutdown(pools *pool.Pools, budget time.Duration) {
+	timer := bs.metrics.StartTimer("Shutdown")
+	defer timer.Stop()
+
+	if err := bs.Close(); err != nil {
+		log.Printf("failed to close the store: %v", err)
+	}
+	if err := bs.persistLockouts(); err != nil {
+		log.Printf("failed to persist lockouts: %v", err)
+	}
+	stats, err := pools.Shutdown()
+	if err != nil {
+		log.Printf("failed to close the database: %v", err)
+	}
+	if budget > 0 {
+		bs.metrics.Operation("Checkpoint").Record(stats.Checkpoint)
+		if err == nil && !stats.Checkpointed {
+			log.Printf("the WAL couldn't be checkpointed within %v, the next start reads it", budget)
+		}
+	}
+}
+
+// Vacuum switches an existing database to incremental auto-vacuum, so the
+// archiver can return the pages of closed accounts to the file system. It
+// rewrites the whole file once, so it is a maintenance command rather than
+// part of startup; new databases use incremental auto-vacuum from the start.
+func (bs *BankingSystem) Vacuum() error {
+	writer, err := bs.db.DB()
+	if err != nil {
+		return err
+	}
+	start := time.Now()
+	if err := archive.EnableIncrementalVacuum(writer); err != nil {
+		return err
+	}
+	fmt.Printf("Incremental vacuum enabled in %v\n", time.Since(start).Round(time.Millisecond))
+	return nil
+}
+
+// loadLockouts returns a login limiter that knows the lockouts still active
+// from earlier runs.
+func loadLockouts(db *gorm.DB, config ratelimit.Config) (*ratelimit.Limiter, error) {
+	if err := db.AutoMigrate(&LoginLockout{}); err != nil {
+		return nil, fmt.Errorf("failed to migrate the lockouts table: %w", err)
+	}
+
+	var lockouts []LoginLockout
+	if err := db.Where("locked_until > ?", time.Now()).Find(&lockouts).Error; err != nil {
+		return nil, fmt.Errorf("failed to load lockouts: %w", err)
+	}
+
+	limiter := ratelimit.New(config)
+	for _, lockout := range lockouts {
+		limiter.Restore(lockout.Number, lockout.LockedUntil)
+	}
+	return limiter, nil
+}
+
+// persistLockouts saves the lockouts started during this run. Lockouts are
+// kept in memory until then, so failed logins cost no extra writes.
+func (bs *BankingSystem) persistLockouts() error {
+	taken := bs.limiter.TakeLockouts()
+	if len(taken) == 0 {
+		return nil
+	}
+
+	lockouts := make([]LoginLockout, 0, len(taken))
+	for number, until := range taken {
+		lockouts = append(lockouts, LoginLockout{Number: number, LockedUntil: until})
+	}
+	return bs.db.Clauses(clause.OnConflict{UpdateAll: true}).Create(&lockouts).Error
+}
+
+// instrumentStatements registers GORM callbacks that time every SQL
+// statement and count the rows it touched.
+func instrumentStatements(db *gorm.DB, registry *metrics.Registry) error {
+	const startKey = "metrics:start"
+
+	before := func(tx *gorm.DB) {
+		tx.InstanceSet(startKey, time.Now())
+	}
+	after := func(tx *gorm.DB) {
+		start, ok := tx.InstanceGet(startKey)
+		if !ok {
+			return
+		}
+		registry.ObserveStatement(tx.Statement.SQL.String(), time.Since(start.(time.Time)), tx.RowsAffected)
+	}
+
+	callbacks := db.Callback()
+	return errors.Join(
+		callbacks.Create().Before("gorm:create").Register("metrics:before_create", before),
+		callbacks.Create().After("gorm:create").Register("metrics:after_create", after),
+		callbacks.Query().Before("gorm:query").Register("metrics:before_query", before),
+		callbacks.Query().After("gorm:query").Register("metrics:after_query", after),
+		callbacks.Update().Before("gorm:update").Register("metrics:before_update", before),
+		callbacks.Update().After("gorm:update").Register("metrics:after_update", after),
+		callbacks.Delete().Before("gorm:delete").Register("metrics:before_delete", before),
+		callbacks.Delete().After("gorm:delete").Register("metrics:after_delete", after),
+		callbacks.Row().Before("gorm:row").Register("metrics:before_row", before),
+		callbacks.Row().After("gorm:row").Register("metrics:after_row", after),
+		callbacks.Raw().Before("gorm:raw").Register("metrics:before_raw", before),
+		callbacks.Raw().After("gorm:raw").Register("metrics:after_raw", after),
+	)
+}
+
+// ReplayJournal prints the balance of every card rebuilt from the journal.
+func (bs *BankingSystem) ReplayJournal() error {
+	accounts := 0
+	err := journal.Replay(bs.reader, func(number string, balance int) error {
+		accounts++
+		_, err := fmt.Printf("%s %d\n", number, balance)
+		return err
+	})
+	if err != nil {
+		return err
+	}
+	fmt.Printf("Replayed %d accounts\n", accounts)
+	return nil
+}
+
+// printReport prints the report of the database at path, one aggregate per
+// line as soon as it is computed.
+func printReport(path string, busyTimeout time.Duration, quantiles []float64) error {
+	db, err := report.Open(sqlite.DriverName, path, busyTimeout)
+	if err != nil {
+		return err
+	}
+	defer db.Close()
+
+	return report.Run(context.Background(), db, quantiles, func(line report.Line) error {
+		_, err := fmt.Printf("%s %d\n", line.Name, line.Value)
+		return err
+	})
+}
+
+// parseHistoryArgs parses the arguments of the history command: a card
+// number, optionally followed by a resolution (hourly by default) and by how
+// far back the series goes (all of it by default).
+func parseHistoryArgs(args []string) (number string, resolution history.Resolution, since time.Time, err error) {
+	if len(args) == 0 {
+		return "", "", time.Time{}, errors.New("missing card number")
+	}
+	resolution = history.Hour
+	if len(args) > 1 {
+		if resolution, err = history.ParseResolution(args[1]); err != nil {
+			return "", "", time.Time{}, err
+		}
+	}
+	if len(args) > 2 {
+		d, err := time.ParseDuration(args[2])
+		if err != nil {
+			return "", "", time.Time{}, err
+		}
+		since = time.Now().Add(-d)
+	}
+	return args[0], resolution, since, nil
+}
+
+// defaultSeed returns the seed given by the BANK_SEED environment variable,
+// or 0. Like BANK_STORE, it lets a test suite seed every program it starts
+// without changing their command lines.
+func defaultSeed() int64 {
+	value := os.Getenv("BANK_SEED")
+	if value == "" {
+		return 0
+	}
+	seed, err := strconv.ParseInt(value, 10, 64)
+	if err != nil {
+		log.Fatalf("invalid BANK_SEED %q: %v", value, err)
+	}
+	return seed
 }
 
 func main() {
-	db, err := gorm.Open(sqlite.Open(DatabaseName), &gorm.Config{})
+	fileName := flag.String("fileName", DatabaseName, "name of the SQLite database file")
+	checkpointInterval := flag.Int("checkpointInterval", journal.DefaultCheckpointInterval,
+		"number of journal entries between two replay checkpoints (0 disables checkpoints)")
+	metricsFile := flag.String("metrics", "",
+		"write a latency metrics dump to this file on exit and on SIGUSR1")
+	pinIterations := flag.Int("pinIterations", 0,
+		"PBKDF2 iterations used to hash new PINs (0 stores them in plaintext)")
+	authCacheTTL := flag.Duration("authCacheTTL", 30*time.Second,
+		"how long a verified login skips the PIN hash (0 disables the cache)")
+	lockoutThreshold := flag.Int("lockoutThreshold", ratelimit.DefaultConfig.LockoutThreshold,
+		"consecutive failed logins that lock a card (0 disables lockouts)")
+	lockoutDuration := flag.Duration("lockoutDuration", ratelimit.DefaultConfig.LockoutDuration,
+		"how long a card stays locked after too many failed logins")
+	sessionBurst := flag.Int("sessionBurst", ratelimit.DefaultConfig.SessionBurst,
+		"failed logins answered at once before the session is slowed down")
+	sessionRefill := flag.Duration("sessionRefill", ratelimit.DefaultConfig.SessionRefill,
+		"rate at which a slowed down session gets failed logins back (0 disables the session budget)")
+	storeName := flag.String("store", store.DefaultBackend(),
+		"backend keeping the cards: gorm, sqlx or memory (defaults to $BANK_STORE, then gorm)")
+	flushInterval := flag.Duration("flushInterval", memstore.DefaultOptions.FlushInterval,
+		"longest time a change of the memory store waits before it is written to the database")
+	writeQueue := flag.Int("writeQueue", memstore.DefaultOptions.QueueSize,
+		"journal entries the memory store buffers before writers wait for a flush")
+	archiveInterval := flag.Duration("archiveInterval", archive.DefaultOptions.Interval,
+		"how often closed accounts are moved to the archive and the database is vacuumed")
+	seed := flag.Int64("seed", defaultSeed(),
+		"seed of the card numbers and PINs of new accounts, for replayable runs (defaults to $BANK_SEED, "+
+			"0 picks a random seed)")
+	poolFlags := pool.RegisterFlags(flag.CommandLine)
+	profile := profiling.RegisterFlags(flag.CommandLine)
+	flag.Parse()
+
+	if err := store.ValidateBackend(*storeName); err != nil {
+		log.Fatal(err)
+	}
+	poolConfig, err := poolFlags.Config()
+	if err != nil {
+		log.Fatal(err)
+	}
+
+	stopProfiling, err := profile.Start()
+	if err != nil {
+		log.Fatal(err)
+	}
+	defer stopProfiling()
+
+	// A report reads on a connection of its own and must not migrate the
+	// database or take its writer, so it doesn't open the banking system.
+	if flag.Arg(0) == "report" {
+		quantiles, err := report.ParseQuantiles(flag.Args()[1:])
+		if err != nil {
+			fmt.Fprintf(os.Stderr, "%v\nusage: report [quantile...]\n", err)
+			os.Exit(2)
+		}
+		if err := printReport(*fileName, poolConfig.BusyTimeout, quantiles); err != nil {
+			log.Fatalf("failed to report: %v", err)
+		}
+		return
+	}
+
+	pools, err := pool.Open(sqlite.DriverName, *fileName, poolConfig)
 	if err != nil {
-		log.Fatalf("failed to open %s: %v", DatabaseName, err)
+		log.Fatal(err)
 	}
 
-	bs, err := NewBankingSystem(db)
+	db, err := gorm.Open(&sqlite.Dialector{Conn: pools.Writer}, &gorm.Config{TranslateError: true})
+	if err != nil {
+		log.Fatalf("failed to open %s: %v", *fileName, err)
+	}
+	reader, err := gorm.Open(&sqlite.Dialector{Conn: pools.Reader}, &gorm.Config{TranslateError: true})
+	if err != nil {
+		log.Fatalf("failed to open %s: %v", *fileName, err)
+	}
+
+	rateLimit := ratelimit.DefaultConfig
+	rateLimit.LockoutThreshold = *lockoutThreshold
+	rateLimit.LockoutDuration = *lockoutDuration
+	rateLimit.SessionBurst = *sessionBurst
+	rateLimit.SessionRefill = *sessionRefill
+
+	bs, err := NewBankingSystem(db, reader, Config{
+		CheckpointInterval: *checkpointInterval,
+		PINIterations:      *pinIterations,
+		AuthCacheTTL:       *authCacheTTL,
+		RateLimit:          rateLimit,
+		Store:              *storeName,
+		WriteBehind:        memstore.Options{FlushInterval: *flushInterval, QueueSize: *writeQueue},
+		Archive:            archive.Options{Interval: *archiveInterval},
+		Seed:               *seed,
+	})
 	if err != nil {
 		log.Fatalf("failed to initialize the application: %v", err)
 	}
 
-	bs.MainMenu()
+	bs.metrics.AddPool("writer", pools.Writer.Stats)
+	bs.metrics.AddPool("reader", pools.Reader.Stats)
+	if *metricsFile != "" {
+		bs.metrics.DumpOnSignal(*metricsFile)
+	}
+
+	switch flag.Arg(0) {
+	case "":
+		bs.MainMenu()
+	case "replay":
+		if err := bs.ReplayJournal(); err != nil {
+			log.Fatalf("failed to replay the journal: %v", err)
+		}
+	case "history":
+		number, resolution, since, err := parseHistoryArgs(flag.Args()[1:])
+		if err != nil {
+			fmt.Fprintf(os.Stderr, "%v\nusage: history <card number> [minute|hour|day] [since, e.g. 24h]\n", err)
+			os.Exit(2)
+		}
+		if err := bs.PrintHistory(number, resolution, since); err != nil {
+			log.Fatalf("failed to read the balance history: %v", err)
+		}
+	case "issue":
+		count, err := strconv.Atoi(flag.Arg(1))
+		if err != nil || count < 0 {
+			fmt.Fprintln(os.Stderr, "usage: issue <number of cards>")
+			os.Exit(2)
+		}
+		if err := bs.IssueCards(count); err != nil {
+			log.Fatalf("failed to issue cards: %v", err)
+		}
+	case "simulate":
+		goroutines, goroutinesErr := strconv.Atoi(flag.Arg(1))
+		count, countErr := strconv.Atoi(flag.Arg(2))
+		if goroutinesErr != nil || countErr != nil || goroutines <= 0 || count < 0 {
+			fmt.Fprintln(os.Stderr, "usage: simulate <goroutines> <number of transfers>")
+			os.Exit(2)
+		}
+		if err := bs.SimulateTransfers(goroutines, count); err != nil {
+			log.Fatalf("failed to simulate transfers: %v", err)
+		}
+	case "vacuum":
+		if err := bs.Vacuum(); err != nil {
+			log.Fatalf("failed to vacuum the database: %v", err)
+		}
+	case "import":
+		if flag.NArg() > 2 {
+			fmt.Fprintln(os.Stderr, "usage: import [csv|jsonl] < portfolio")
+			os.Exit(2)
+		}
+		if err := bs.ImportCards(os.Stdin, flag.Arg(1)); err != nil {
+			log.Fatalf("failed to import cards: %v", err)
+		}
+	default:
+		fmt.Fprintf(os.Stderr, "unknown command %q\n", flag.Arg(0))
+		os.Exit(2)
+	}
+
+	bs.Shutdown(pools, poolConfig.ShutdownTimeout)
+
+	if *metricsFile != "" {
+		if err := bs.metrics.DumpFile(*metricsFile); err != nil {
+			log.Printf("failed to dump metrics: %v", err)
+		}
+	}
 }
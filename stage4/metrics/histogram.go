@@ -0,0 +1,125 @@
+package metrics
+
+import (
+	"math"
+	"math/bits"
+	"sync/atomic"
+	"time"
+)
+
+// subBucketBits sets the precision of a Histogram: every power of two is
+// split into 1<<subBucketBits linear sub-buckets, which keeps the relative
+// error of any recorded value below 1/32 (about 3%).
+const subBucketBits = 5
+
+const (
+	subBucketCount = 1 << subBucketBits
+	bucketCount    = (64-subBucketBits)*subBucketCount + subBucketCount
+)
+
+// Histogram is a high dynamic range histogram of durations in nanoseconds.
+// Buckets are log-linear, so it covers nanoseconds to hours with constant
+// relative precision and a fixed memory footprint. Record is lock-free and
+// safe for concurrent use.
+type Histogram struct {
+	counts [bucketCount]uint64
+	total  uint64
+	sum    uint64
+	max    uint64
+}
+
+func bucketIndex(v uint64) int {
+	length := bits.Len64(v)
+	if length <= subBucketBits+1 {
+		return int(v)
+	}
+	shift := length - subBucketBits - 1
+	return shift*subBucketCount + int(v>>shift)
+}
+
+// bucketUpperBound returns the highest value that falls into bucket i.
+func bucketUpperBound(i int) uint64 {
+	if i < 2*subBucketCount {
+		return uint64(i)
+	}
+	shift := i/subBucketCount - 1
+	mantissa := uint64(i - shift*subBucketCount)
+	return (mantissa+1)<<shift - 1
+}
+
+// Record adds d to the histogram. Negative durations are recorded as zero.
+func (h *Histogram) Record(d time.Duration) {
+	v := uint64(0)
+	if d > 0 {
+		v = uint64(d)
+	}
+	atomic.AddUint64(&h.counts[bucketIndex(v)], 1)
+	atomic.AddUint64(&h.total, 1)
+	atomic.AddUint64(&h.sum, v)
+	for {
+		current := atomic.LoadUint64(&h.max)
+		if v <= current || atomic.CompareAndSwapUint64(&h.max, current, v) {
+			return
+		}
+	}
+}
+
+// Merge adds the values recorded by other to h, e.g. to combine the
+// histograms of several workers. other may still be recording, in which case
+// its concurrent values may or may not be merged.
+func (h *Histogram) Merge(other *Histogram) {
+	for i := range other.counts {
+		if n := atomic.LoadUint64(&other.counts[i]); n > 0 {
+			atomic.AddUint64(&h.counts[i], n)
+		}
+	}
+	atomic.AddUint64(&h.total, atomic.LoadUint64(&other.total))
+	atomic.AddUint64(&h.sum, atomic.LoadUint64(&other.sum))
+	v := atomic.LoadUint64(&other.max)
+	for {
+		current := atomic.LoadUint64(&h.max)
+		if v <= current || atomic.CompareAndSwapUint64(&h.max, current, v) {
+			return
+		}
+	}
+}
+
+// Count returns the number of recorded values.
+func (h *Histogram) Count() uint64 {
+	return atomic.LoadUint64(&h.total)
+}
+
+// Sum returns the sum of all recorded values.
+func (h *Histogram) Sum() time.Duration {
+	return time.Duration(atomic.LoadUint64(&h.sum))
+}
+
+// Max returns the largest recorded value.
+func (h *Histogram) Max() time.Duration {
+	return time.Duration(atomic.LoadUint64(&h.max))
+}
+
+// Quantile returns the value below which the fraction q of the recorded
+// values fall, rounded up to the bucket boundary.
+func (h *Histogram) Quantile(q float64) time.Duration {
+	total := h.Count()
+	if total == 0 {
+		return 0
+	}
+	rank := uint64(math.Ceil(q * float64(total)))
+	if rank == 0 {
+		rank = 1
+	}
+
+	var seen uint64
+	for i := range h.counts {
+		seen += atomic.LoadUint64(&h.counts[i])
+		if seen >= rank {
+			if upper := time.Duration(bucketUpperBound(i)); upper < h.Max() {
+				return upper
+			}
+			return h.Max()
+		}
+	}
+	return h.Max()
+}
@@ -0,0 +1,114 @@
+package metrics
+
+import (
+	"math/rand"
+	"sync"
+	"testing"
+	"time"
+)
+
+func TestBucketBoundariesAtPowersOfTwo(t *testing.T) {
+	previous := -1
+	for k := 0; k < 64; k++ {
+		v := uint64(1) << k
+		i := bucketIndex(v)
+		if i <= previous || i >= bucketCount {
+			t.Fatalf("2^%d falls into bucket %d, after bucket %d of %d", k, i, previous, bucketCount)
+		}
+		previous = i
+		if upper := bucketUpperBound(i); upper < v {
+			t.Errorf("bucket %d of 2^%d ends at %d", i, k, upper)
+		}
+		if upper := bucketUpperBound(i - 1); k > 0 && upper != v-1 {
+			t.Errorf("the bucket before 2^%d ends at %d, want %d", k, upper, v-1)
+		}
+		if got := bucketIndex(v - 1); k > 0 && got != i-1 {
+			t.Errorf("2^%d-1 falls into bucket %d, want %d", k, got, i-1)
+		}
+	}
+	if i := bucketIndex(^uint64(0)); i != bucketCount-1 || bucketUpperBound(i) != ^uint64(0) {
+		t.Errorf("the largest value falls into bucket %d ending at %d, want the last bucket %d",
+			i, bucketUpperBound(i), bucketCount-1)
+	}
+}
+
+func TestBucketRelativeError(t *testing.T) {
+	rng := rand.New(rand.NewSource(1))
+	for n := 0; n < 100000; n++ {
+		v := rng.Uint64() >> rng.Intn(64)
+		upper := bucketUpperBound(bucketIndex(v))
+		if upper < v || upper-v > v/subBucketCount {
+			t.Fatalf("%d falls into a bucket ending at %d", v, upper)
+		}
+	}
+}
+
+func TestQuantiles(t *testing.T) {
+	var empty Histogram
+	if q := empty.Quantile(0.5); q != 0 {
+		t.Errorf("the median of an empty histogram = %v, want 0", q)
+	}
+
+	var constant Histogram
+	for n := 0; n < 100; n++ {
+		constant.Record(3 * time.Millisecond)
+	}
+	for _, q := range Quantiles {
+		if got := constant.Quantile(q); got != 3*time.Millisecond {
+			t.Errorf("quantile %g of a constant = %v, want 3ms", q, got)
+		}
+	}
+
+	var uniform Histogram
+	for n := 1; n <= 1000; n++ {
+		uniform.Record(time.Duration(n) * time.Microsecond)
+	}
+	for _, q := range []float64{0.01, 0.5, 0.9, 0.99} {
+		want := time.Duration(q*1000) * time.Microsecond
+		if got := uniform.Quantile(q); got < want || got > want+want/subBucketCount {
+			t.Errorf("quantile %g of 1..1000µs = %v, want %v rounded up by at most 1/%d",
+				q, got, want, subBucketCount)
+		}
+	}
+	if got := uniform.Quantile(1); got != time.Millisecond {
+		t.Errorf("quantile 1 of 1..1000µs = %v, want the maximum 1ms", got)
+	}
+	if uniform.Count() != 1000 || uniform.Sum() != 500500*time.Microsecond || uniform.Max() != time.Millisecond {
+		t.Errorf("count %d, sum %v and max %v, want 1000, 500.5ms and 1ms", uniform.Count(), uniform.Sum(),
+			uniform.Max())
+	}
+}
+
+func TestMerge(t *testing.T) {
+	var whole Histogram
+	parts := make([]Histogram, 4)
+	var wg sync.WaitGroup
+	for w := range parts {
+		wg.Add(1)
+		go func(part *Histogram, w int) {
+			defer wg.Done()
+			for n := w; n < 10000; n += len(parts) {
+				part.Record(time.Duration(n) * time.Microsecond)
+			}
+		}(&parts[w], w)
+	}
+	for n := 0; n < 10000; n++ {
+		whole.Record(time.Duration(n) * time.Microsecond)
+	}
+	wg.Wait()
+
+	var merged Histogram
+	for w := range parts {
+		merged.Merge(&parts[w])
+	}
+	if merged.counts != whole.counts || merged.Count() != whole.Count() || merged.Sum() != whole.Sum() ||
+		merged.Max() != whole.Max() {
+		t.Errorf("merged count %d, sum %v and max %v, want %d, %v and %v", merged.Count(), merged.Sum(),
+			merged.Max(), whole.Count(), whole.Sum(), whole.Max())
+	}
+	for _, q := range Quantiles {
+		if merged.Quantile(q) != whole.Quantile(q) {
+			t.Errorf("merged quantile %g = %v, want %v", q, merged.Quantile(q), whole.Quantile(q))
+		}
+	}
+}
@@ -0,0 +1,220 @@
+// Package metrics collects operation and SQL statement latencies of the
+// banking system and exports them as a plain text dump.
+package metrics
+
+import (
+	"bufio"
+	"database/sql"
+	"fmt"
+	"io"
+	"os"
+	"path/filepath"
+	"sort"
+	"strconv"
+	"sync"
+	"time"
+)
+
+// Quantiles exported for every histogram.
+var Quantiles = []float64{0.5, 0.9, 0.99, 0.999}
+
+type statement struct {
+	latency Histogram
+	rows    int64
+}
+
+// Registry holds the latency histograms of banking operations and of every
+// distinct SQL statement, and the statistics of the connection pools. It is
+// safe for concurrent use.
+type Registry struct {
+	mu sync.Mutex
+	// dumping serializes DumpFile, so the dump on SIGUSR1 and the one on
+	// exit never race to replace the file.
+	dumping    sync.Mutex
+	operations map[string]*Histogram
+	statements map[string]*statement
+	pools      map[string]func() sql.DBStats
+}
+
+// NewRegistry returns an empty Registry.
+func NewRegistry() *Registry {
+	return &Registry{
+		operations: make(map[string]*Histogram),
+		statements: make(map[string]*statement),
+		pools:      make(map[string]func() sql.DBStats),
+	}
+}
+
+// AddPool exports the statistics of a connection pool, usually the Stats
+// method of a *sql.DB, under the given name.
+func (r *Registry) AddPool(name string, stats func() sql.DBStats) {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	r.pools[name] = stats
+}
+
+// Operation returns the latency histogram of the named operation.
+func (r *Registry) Operation(name string) *Histogram {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	h, ok := r.operations[name]
+	if !ok {
+		h = &Histogram{}
+		r.operations[name] = h
+	}
+	return h
+}
+
+// ObserveStatement records one execution of sql that took d and touched rows rows.
+func (r *Registry) ObserveStatement(sql string, d time.Duration, rows int64) {
+	r.mu.Lock()
+	s, ok := r.statements[sql]
+	if !ok {
+		s = &statement{}
+		r.statements[sql] = s
+	}
+	s.rows += rows
+	r.mu.Unlock()
+
+	s.latency.Record(d)
+}
+
+// Statements returns the total number of SQL statements executed so far.
+func (r *Registry) Statements() uint64 {
+	r.mu.Lock()
+	defer r.mu.Unlock()
+
+	var total uint64
+	for _, s := range r.statements {
+		total += s.latency.Count()
+	}
+	return total
+}
+
+// Timer measures the time an operation spends working, leaving out the
+// pauses in which it waits for user input.
+type Timer struct {
+	histogram *Histogram
+	start     time.Time
+	elapsed   time.Duration
+	paused    bool
+}
+
+// StartTimer starts timing one run of the named operation.
+func (r *Registry) StartTimer(name string) *Timer {
+	return &Timer{histogram: r.Operation(name), start: time.Now()}
+}
+
+// Pause stops the clock, e.g. while waiting for input.
+func (t *Timer) Pause() {
+	if !t.paused {
+		t.elapsed += time.Since(t.start)
+		t.paused = true
+	}
+}
+
+// Resume restarts a paused clock.
+func (t *Timer) Resume() {
+	if t.paused {
+		t.start = time.Now()
+		t.paused = false
+	}
+}
+
+// Stop records the measured time. It is meant to be deferred.
+func (t *Timer) Stop() {
+	t.Pause()
+	t.histogram.Record(t.elapsed)
+}
+
+// WriteText writes every histogram in a line-oriented text format:
+//
+//	banking_operation_latency_ns{op="Login",quantile="0.99"} 81920
+//	banking_statement_rows{sql="SELECT * FROM `card` WHERE number = ?"} 3
+//	banking_pool_wait_count{pool="writer"} 0
+//
+// Series are sorted, so two dumps of the same run can be diffed.
+func (r *Registry) WriteText(w io.Writer) error {
+	r.mu.Lock()
+	operations := make([]string, 0, len(r.operations))
+	for name := range r.operations {
+		operations = append(operations, name)
+	}
+	statements := make([]string, 0, len(r.statements))
+	rows := make(map[string]int64, len(r.statements))
+	for sql, s := range r.statements {
+		statements = append(statements, sql)
+		rows[sql] = s.rows
+	}
+	pools := make([]string, 0, len(r.pools))
+	stats := make(map[string]sql.DBStats, len(r.pools))
+	for name, fn := range r.pools {
+		pools = append(pools, name)
+		stats[name] = fn()
+	}
+	r.mu.Unlock()
+
+	sort.Strings(operations)
+	sort.Strings(statements)
+	sort.Strings(pools)
+
+	bw := bufio.NewWriter(w)
+	for _, name := range operations {
+		writeHistogram(bw, "banking_operation", "op="+strconv.Quote(name), r.Operation(name))
+	}
+	for _, sql := range statements {
+		label := "sql=" + strconv.Quote(sql)
+		r.mu.Lock()
+		s := r.statements[sql]
+		r.mu.Unlock()
+		writeHistogram(bw, "banking_statement", label, &s.latency)
+		fmt.Fprintf(bw, "banking_statement_rows{%s} %d\n", label, rows[sql])
+	}
+	for _, name := range pools {
+		writePoolStats(bw, "pool="+strconv.Quote(name), stats[name])
+	}
+	return bw.Flush()
+}
+
+func writePoolStats(w io.Writer, label string, s sql.DBStats) {
+	fmt.Fprintf(w, "banking_pool_max_open{%s} %d\n", label, s.MaxOpenConnections)
+	fmt.Fprintf(w, "banking_pool_open{%s} %d\n", label, s.OpenConnections)
+	fmt.Fprintf(w, "banking_pool_in_use{%s} %d\n", label, s.InUse)
+	fmt.Fprintf(w, "banking_pool_idle{%s} %d\n", label, s.Idle)
+	fmt.Fprintf(w, "banking_pool_wait_count{%s} %d\n", label, s.WaitCount)
+	fmt.Fprintf(w, "banking_pool_wait_duration_ns{%s} %d\n", label, s.WaitDuration)
+}
+
+func writeHistogram(w io.Writer, prefix, label string, h *Histogram) {
+	fmt.Fprintf(w, "%s_count{%s} %d\n", prefix, label, h.Count())
+	fmt.Fprintf(w, "%s_latency_ns_sum{%s} %d\n", prefix, label, h.Sum())
+	for _, q := range Quantiles {
+		fmt.Fprintf(w, "%s_latency_ns{%s,quantile=\"%g\"} %d\n", prefix, label, q, h.Quantile(q))
+	}
+	fmt.Fprintf(w, "%s_latency_ns_max{%s} %d\n", prefix, label, h.Max())
+}
+
+// DumpFile writes the text dump to path, replacing the file atomically so a
+// reader never sees a partial dump. Concurrent dumps run one after the other,
+// each through its own temporary file.
+func (r *Registry) DumpFile(path string) error {
+	r.dumping.Lock()
+	defer r.dumping.Unlock()
+
+	f, err := os.CreateTemp(filepath.Dir(path), filepath.Base(path)+".*.tmp")
+	if err != nil {
+		return err
+	}
+	if err := r.WriteText(f); err != nil {
+		f.Close()
+		os.Remove(f.Name())
+		return err
+	}
+	if err := f.Close(); err != nil {
+		os.Remove(f.Name())
+		return err
+	}
+	return os.Rename(f.Name(), path)
+}
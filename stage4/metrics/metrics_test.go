@@ -0,0 +1,96 @@
+package metrics
+
+import (
+	"bytes"
+	"database/sql"
+	"os"
+	"path/filepath"
+	"strings"
+	"sync"
+	"testing"
+	"time"
+)
+
+func TestWriteText(t *testing.T) {
+	r := NewRegistry()
+	r.Operation("Login").Record(2 * time.Millisecond)
+	r.Operation("Balance").Record(time.Millisecond)
+	r.ObserveStatement("SELECT * FROM `card` WHERE number = ?", time.Millisecond, 1)
+	r.ObserveStatement("SELECT * FROM `card` WHERE number = ?", 3*time.Millisecond, 0)
+	r.AddPool("writer", func() sql.DBStats { return sql.DBStats{MaxOpenConnections: 1, WaitCount: 4} })
+
+	var buf bytes.Buffer
+	if err := r.WriteText(&buf); err != nil {
+		t.Fatal(err)
+	}
+	dump := buf.String()
+	for _, line := range []string{
+		`banking_operation_count{op="Login"} 1`,
+		`banking_operation_latency_ns{op="Balance",quantile="0.5"} 1000000`,
+		"banking_statement_count{sql=\"SELECT * FROM `card` WHERE number = ?\"} 2",
+		"banking_statement_latency_ns_max{sql=\"SELECT * FROM `card` WHERE number = ?\"} 3000000",
+		"banking_statement_rows{sql=\"SELECT * FROM `card` WHERE number = ?\"} 1",
+		`banking_pool_max_open{pool="writer"} 1`,
+		`banking_pool_wait_count{pool="writer"} 4`,
+	} {
+		if !strings.Contains(dump, line+"\n") {
+			t.Errorf("the dump lacks %s:\n%s", line, dump)
+		}
+	}
+	if r.Statements() != 2 {
+		t.Errorf("Statements() = %d, want 2", r.Statements())
+	}
+
+	if strings.Index(dump, `op="Balance"`) > strings.Index(dump, `op="Login"`) {
+		t.Error("the operations aren't sorted")
+	}
+}
+
+func TestConcurrentDumps(t *testing.T) {
+	dir := t.TempDir()
+	path := filepath.Join(dir, "metrics.txt")
+	r := NewRegistry()
+	for n := 0; n < 100; n++ {
+		r.ObserveStatement("SELECT "+strings.Repeat("x", n), time.Millisecond, 1)
+	}
+
+	var want bytes.Buffer
+	if err := r.WriteText(&want); err != nil {
+		t.Fatal(err)
+	}
+	var wg sync.WaitGroup
+	errs := make(chan error, 16)
+	for n := 0; n < cap(errs); n++ {
+		wg.Add(1)
+		go func() {
+			defer wg.Done()
+			errs <- r.DumpFile(path)
+		}()
+	}
+	wg.Wait()
+	close(errs)
+	for err := range errs {
+		if err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	got, err := os.ReadFile(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if !bytes.Equal(got, want.Bytes()) {
+		t.Errorf("the dump holds %d bytes, want the %d of a whole dump", len(got), want.Len())
+	}
+	entries, err := os.ReadDir(dir)
+	if err != nil {
+		t.Fatal(err)
+	}
+	var names []string
+	for _, entry := range entries {
+		names = append(names, entry.Name())
+	}
+	if len(names) != 1 {
+		t.Errorf("the dumps left %v behind, want only metrics.txt", names)
+	}
+}
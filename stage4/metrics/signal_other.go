@@ -0,0 +1,7 @@
+//go:build !unix
+
+package metrics
+
+// DumpOnSignal is a no-op on platforms without SIGUSR1; the dump is still
+// written on exit.
+func (r *Registry) DumpOnSignal(path string) {}
@@ -0,0 +1,24 @@
+//go:build unix
+
+package metrics
+
+import (
+	"log"
+	"os"
+	"os/signal"
+	"syscall"
+)
+
+// DumpOnSignal writes the text dump to path every time the process receives
+// SIGUSR1.
+func (r *Registry) DumpOnSignal(path string) {
+	signals := make(chan os.Signal, 1)
+	signal.Notify(signals, syscall.SIGUSR1)
+	go func() {
+		for range signals {
+			if err := r.DumpFile(path); err != nil {
+				log.Printf("failed to dump metrics: %v", err)
+			}
+		}
+	}()
+}
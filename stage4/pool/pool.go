@@ -0,0 +1,253 @@
+// Package pool opens the SQLite connection pools shared by all banking
+// binaries: a single writer connection, so writers queue in the pool instead
+// of fighting over the database lock, and a pool of read-only connections.
+package pool
+
+import (
+	"bufio"
+	"context"
+	"database/sql"
+	"errors"
+	"flag"
+	"fmt"
+	"net/url"
+	"os"
+	"strings"
+	"time"
+)
+
+// Config configures the connection pools.
+type Config struct {
+	// Readers bounds the number of open read-only connections.
+	Readers int
+	// IdleReaders is the number of read-only connections kept open between
+	// operations.
+	IdleReaders int
+	// ConnMaxIdleTime closes connections that have been idle for longer.
+	ConnMaxIdleTime time.Duration
+	// ConnMaxLifetime closes connections that have been open for longer.
+	ConnMaxLifetime time.Duration
+	// BusyTimeout is how long a statement waits for a lock held by another
+	// process before failing with "database is locked".
+	BusyTimeout time.Duration
+	// JournalMode is the SQLite journal mode. WAL lets readers run while the
+	// writer commits.
+	JournalMode string
+	// ShutdownTimeout bounds the WAL checkpoint of Shutdown; 0 skips it.
+	ShutdownTimeout time.Duration
+}
+
+// DefaultConfig suits a single interactive session with some headroom for
+// background readers.
+var DefaultConfig = Config{
+	Readers:         4,
+	IdleReaders:     2,
+	ConnMaxIdleTime: 5 * time.Minute,
+	ConnMaxLifetime: time.Hour,
+	BusyTimeout:     5 * time.Second,
+	JournalMode:     "WAL",
+	ShutdownTimeout: 2 * time.Second,
+}
+
+// Flags holds the values of the pool flags.
+type Flags struct {
+	fs      *flag.FlagSet
+	profile string
+	config  Config
+}
+
+// RegisterFlags defines -poolProfile, -poolReaders, -poolIdleReaders,
+// -poolConnMaxIdleTime, -poolConnMaxLifetime, -busyTimeout, -journalMode and
+// -shutdownTimeout on fs.
+func RegisterFlags(fs *flag.FlagSet) *Flags {
+	f := &Flags{fs: fs, config: DefaultConfig}
+	fs.StringVar(&f.profile, "poolProfile", "",
+		"read pool settings from this file of name=value lines, named like the pool flags")
+	fs.IntVar(&f.config.Readers, "poolReaders", f.config.Readers, "maximum number of read-only connections")
+	fs.IntVar(&f.config.IdleReaders, "poolIdleReaders", f.config.IdleReaders,
+		"number of idle read-only connections kept open")
+	fs.DurationVar(&f.config.ConnMaxIdleTime, "poolConnMaxIdleTime", f.config.ConnMaxIdleTime,
+		"close connections idle for longer than this")
+	fs.DurationVar(&f.config.ConnMaxLifetime, "poolConnMaxLifetime", f.config.ConnMaxLifetime,
+		"close connections open for longer than this")
+	fs.DurationVar(&f.config.BusyTimeout, "busyTimeout", f.config.BusyTimeout,
+		"how long to wait for a database locked by another process")
+	fs.StringVar(&f.config.JournalMode, "journalMode", f.config.JournalMode, "SQLite journal mode")
+	fs.DurationVar(&f.config.ShutdownTimeout, "shutdownTimeout", f.config.ShutdownTimeout,
+		"longest time spent folding the WAL back into the database on exit (0 skips it)")
+	return f
+}
+
+// Config returns the configured settings. Values from the profile file
+// apply to every pool flag that wasn't given on the command line, so a
+// profile can be tweaked for a single run without editing it.
+func (f *Flags) Config() (Config, error) {
+	if f.profile == "" {
+		return f.config, nil
+	}
+
+	given := make(map[string]bool)
+	f.fs.Visit(func(fl *flag.Flag) {
+		given[fl.Name] = true
+	})
+
+	file, err := os.Open(f.profile)
+	if err != nil {
+		return Config{}, fmt.Errorf("failed to open the pool profile: %w", err)
+	}
+	defer file.Close()
+
+	scanner := bufio.NewScanner(file)
+	for line := 1; scanner.Scan(); line++ {
+		text := strings.TrimSpace(scanner.Text())
+		if text == "" || strings.HasPrefix(text, "#") {
+			continue
+		}
+		name, value, ok := strings.Cut(text, "=")
+		name, value = strings.TrimSpace(name), strings.TrimSpace(value)
+		if !ok || !isPoolFlag(name) {
+			return Config{}, fmt.Errorf("%s:%d: expected a pool setting, got %q", f.profile, line, text)
+		}
+		if given[name] {
+			continue
+		}
+		if err := f.fs.Set(name, value); err != nil {
+			return Config{}, fmt.Errorf("%s:%d: %w", f.profile, line, err)
+		}
+	}
+	if err := scanner.Err(); err != nil {
+		return Config{}, fmt.Errorf("failed to read the pool profile: %w", err)
+	}
+	return f.config, nil
+}
+
+func isPoolFlag(name string) bool {
+	switch name {
+	case "poolReaders", "poolIdleReaders", "poolConnMaxIdleTime", "poolConnMaxLifetime", "busyTimeout", "journalMode",
+		"shutdownTimeout":
+		return true
+	}
+	return false
+}
+
+// Pools are the connection pools of one database file.
+type Pools struct {
+	Writer *sql.DB
+	Reader *sql.DB
+	config Config
+}
+
+// Open opens the pools of the database at path with the given database/sql
+// driver, which must be the mattn/go-sqlite3 driver or a wrapper of it.
+// Transactions on the writer begin IMMEDIATE, so a transaction that reads
+// before it writes can't fail on upgrading its lock.
+func Open(driver, path string, config Config) (*Pools, error) {
+	if config.Readers < 1 {
+		return nil, errors.New("the pool needs at least one reader")
+	}
+
+	writer, err := sql.Open(driver, dsn(path, config, url.Values{"_txlock": {"immediate"}}))
+	if err != nil {
+		return nil, fmt.Errorf("failed to open %s: %w", path, err)
+	}
+	writer.SetMaxOpenConns(1)
+	writer.SetMaxIdleConns(1)
+	writer.SetConnMaxIdleTime(0)
+	writer.SetConnMaxLifetime(0)
+
+	// The writer goes first: it creates the file and switches the journal
+	// mode, which read-only connections can't do.
+	if err := writer.Ping(); err != nil {
+		writer.Close()
+		return nil, fmt.Errorf("failed to open %s: %w", path, err)
+	}
+
+	reader, err := sql.Open(driver, dsn(path, config, url.Values{"_query_only": {"true"}}))
+	if err != nil {
+		writer.Close()
+		return nil, fmt.Errorf("failed to open %s: %w", path, err)
+	}
+	reader.SetMaxOpenConns(config.Readers)
+	reader.SetMaxIdleConns(config.IdleReaders)
+	reader.SetConnMaxIdleTime(config.ConnMaxIdleTime)
+	reader.SetConnMaxLifetime(config.ConnMaxLifetime)
+
+	return &Pools{Writer: writer, Reader: reader, config: config}, nil
+}
+
+func dsn(path string, config Config, params url.Values) string {
+	params.Set("_busy_timeout", fmt.Sprint(config.BusyTimeout.Milliseconds()))
+	if config.JournalMode != "" {
+		params.Set("_journal_mode", config.JournalMode)
+	}
+	return "file:" + path + "?" + params.Encode()
+}
+
+// Close closes both pools.
+func (p *Pools) Close() error {
+	return errors.Join(p.Reader.Close(), p.Writer.Close())
+}
+
+// ShutdownStats describes a Shutdown.
+type ShutdownStats struct {
+	// Checkpointed reports whether the database file holds every commit:
+	// the whole WAL, if any, was copied into it and truncated.
+	Checkpointed bool
+	// Frames is the number of WAL frames the checkpoint found.
+	Frames int
+	// Checkpoint is the time the checkpoint took, and Elapsed the time of
+	// the whole shutdown.
+	Checkpoint time.Duration
+	Elapsed    time.Duration
+}
+
+// Shutdown closes both pools, checkpointing the WAL in between with
+// wal_checkpoint(TRUNCATE), so the next process opening the database doesn't
+// start with a long WAL to read through. The readers are closed first, so
+// their snapshots don't hold the checkpoint back. A checkpoint that is still
+// blocked by another process after ShutdownTimeout is abandoned: the WAL
+// stays valid and is checkpointed later.
+func (p *Pools) Shutdown() (ShutdownStats, error) {
+	start := time.Now()
+	var stats ShutdownStats
+	err := p.Reader.Close()
+	if p.config.ShutdownTimeout > 0 {
+		checkpointStart := time.Now()
+		ctx, cancel := context.WithTimeout(context.Background(), p.config.ShutdownTimeout)
+		var busy, frames, checkpointed int
+		checkpointErr := p.checkpoint(ctx, &busy, &frames, &checkpointed)
+		stats.Checkpoint = time.Since(checkpointStart)
+		switch {
+		case ctx.Err() != nil:
+		case checkpointErr != nil:
+			err = errors.Join(err, fmt.Errorf("failed to checkpoint the WAL: %w", checkpointErr))
+		default:
+			// Outside of WAL mode the frame counts are -1.
+			stats.Checkpointed = busy == 0
+			stats.Frames = max(frames, 0)
+		}
+		cancel()
+	}
+	err = errors.Join(err, p.Writer.Close())
+	stats.Elapsed = time.Since(start)
+	return stats, err
+}
+
+// checkpoint runs wal_checkpoint(TRUNCATE) on the writer. The busy timeout
+// is lowered to the deadline of ctx first, since SQLite waits for the readers
+// of other processes in its busy handler, which an interrupt doesn't cut
+// short.
+func (p *Pools) checkpoint(ctx context.Context, busy, frames, checkpointed *int) error {
+	conn, err := p.Writer.Conn(ctx)
+	if err != nil {
+		return err
+	}
+	defer conn.Close()
+	if deadline, ok := ctx.Deadline(); ok {
+		timeout := max(time.Until(deadline).Milliseconds(), 1)
+		if _, err := conn.ExecContext(ctx, fmt.Sprintf("PRAGMA busy_timeout = %d", timeout)); err != nil {
+			return err
+		}
+	}
+	return conn.QueryRowContext(ctx, "PRAGMA wal_checkpoint(TRUNCATE)").Scan(busy, frames, checkpointed)
+}
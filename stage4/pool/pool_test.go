@@ -0,0 +1,81 @@
+package pool
+
+import (
+	"database/sql"
+	"os"
+	"path/filepath"
+	"testing"
+	"time"
+
+	_ "github.com/mattn/go-sqlite3"
+)
+
+func openWithRows(t *testing.T, config Config) (*Pools, string) {
+	t.Helper()
+	path := filepath.Join(t.TempDir(), "card.s3db")
+	pools, err := Open("sqlite3", path, config)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if _, err := pools.Writer.Exec("CREATE TABLE card (id INTEGER PRIMARY KEY, number TEXT NOT NULL UNIQUE, " +
+		"pin TEXT, balance INTEGER DEFAULT 0)"); err != nil {
+		t.Fatal(err)
+	}
+	for i := 0; i < 100; i++ {
+		if _, err := pools.Writer.Exec("INSERT INTO card (number, pin) VALUES (?, '0000')", 4000000000010000+i); err != nil {
+			t.Fatal(err)
+		}
+	}
+	return pools, path
+}
+
+func TestShutdownTruncatesWAL(t *testing.T) {
+	pools, path := openWithRows(t, DefaultConfig)
+	stats, err := pools.Shutdown()
+	if err != nil {
+		t.Fatal(err)
+	}
+	if !stats.Checkpointed || stats.Frames == 0 {
+		t.Errorf("stats = %+v, want a checkpoint of the WAL frames", stats)
+	}
+	if info, err := os.Stat(path + "-wal"); err == nil && info.Size() != 0 {
+		t.Errorf("the WAL holds %d bytes after the shutdown, want none", info.Size())
+	}
+}
+
+func TestShutdownGivesUpOnBlockedCheckpoint(t *testing.T) {
+	config := DefaultConfig
+	config.ShutdownTimeout = 100 * time.Millisecond
+	pools, path := openWithRows(t, config)
+
+	// Another process reading from the WAL keeps it from being truncated.
+	other, err := sql.Open("sqlite3", "file:"+path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer other.Close()
+	tx, err := other.Begin()
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer tx.Rollback()
+	var cards int
+	if err := tx.QueryRow("SELECT COUNT(*) FROM card").Scan(&cards); err != nil {
+		t.Fatal(err)
+	}
+
+	stats, err := pools.Shutdown()
+	if err != nil {
+		t.Fatal(err)
+	}
+	if stats.Checkpointed {
+		t.Error("the checkpoint succeeded while another process read the WAL")
+	}
+	if stats.Elapsed > time.Second {
+		t.Errorf("the shutdown took %v with a budget of %v", stats.Elapsed, config.ShutdownTimeout)
+	}
+	tx.Rollback()
+	if err := other.QueryRow("SELECT COUNT(*) FROM card").Scan(&cards); err != nil || cards == 0 {
+		t.Errorf("read %d cards after the shutdown: %v", cards, err)
+	}
+}
@@ -0,0 +1,114 @@
+// Package profiling wires the standard Go CPU and heap profilers and the
+// pprof HTTP endpoint to command-line flags shared by all banking binaries.
+package profiling
+
+import (
+	"flag"
+	"fmt"
+	"log"
+	"net"
+	"net/http"
+	"net/http/pprof"
+	"os"
+	"runtime"
+	rpprof "runtime/pprof"
+)
+
+// Flags holds the values of the profiling flags.
+type Flags struct {
+	CPUProfile string
+	MemProfile string
+	PprofAddr  string
+}
+
+// RegisterFlags defines -cpuprofile, -memprofile and -pprof on fs.
+func RegisterFlags(fs *flag.FlagSet) *Flags {
+	f := &Flags{}
+	fs.StringVar(&f.CPUProfile, "cpuprofile", "", "write a CPU profile to this file")
+	fs.StringVar(&f.MemProfile, "memprofile", "", "write a heap profile to this file on exit")
+	fs.StringVar(&f.PprofAddr, "pprof", "",
+		"serve the pprof HTTP endpoint on this loopback address, e.g. localhost:6060")
+	return f
+}
+
+// Start starts the requested profilers. The returned function stops them and
+// writes the heap profile; it must be called before the program exits.
+func (f *Flags) Start() (func(), error) {
+	var cpuFile *os.File
+	if f.CPUProfile != "" {
+		var err error
+		cpuFile, err = os.Create(f.CPUProfile)
+		if err != nil {
+			return nil, fmt.Errorf("failed to create the CPU profile: %w", err)
+		}
+		if err := rpprof.StartCPUProfile(cpuFile); err != nil {
+			cpuFile.Close()
+			return nil, fmt.Errorf("failed to start the CPU profile: %w", err)
+		}
+	}
+
+	if f.PprofAddr != "" {
+		if err := serve(f.PprofAddr); err != nil {
+			if cpuFile != nil {
+				rpprof.StopCPUProfile()
+				cpuFile.Close()
+			}
+			return nil, err
+		}
+	}
+
+	return func() {
+		if cpuFile != nil {
+			rpprof.StopCPUProfile()
+			cpuFile.Close()
+		}
+		if f.MemProfile != "" {
+			if err := writeHeapProfile(f.MemProfile); err != nil {
+				log.Printf("failed to write the heap profile: %v", err)
+			}
+		}
+	}, nil
+}
+
+func writeHeapProfile(path string) error {
+	file, err := os.Create(path)
+	if err != nil {
+		return err
+	}
+	defer file.Close()
+
+	// Collect garbage first so the profile shows live objects only.
+	runtime.GC()
+	return rpprof.WriteHeapProfile(file)
+}
+
+// serve starts the pprof endpoint in the background. Only loopback addresses
+// are accepted, since the profiles expose the program's internals.
+func serve(addr string) error {
+	host, _, err := net.SplitHostPort(addr)
+	if err != nil {
+		return fmt.Errorf("invalid pprof address %q: %w", addr, err)
+	}
+	if ip := net.ParseIP(host); host != "localhost" && (ip == nil || !ip.IsLoopback()) {
+		return fmt.Errorf("the pprof endpoint may only listen on a loopback address, got %q", addr)
+	}
+
+	listener, err := net.Listen("tcp", addr)
+	if err != nil {
+		return fmt.Errorf("failed to listen on %s: %w", addr, err)
+	}
+
+	mux := http.NewServeMux()
+	mux.HandleFunc("/debug/pprof/", pprof.Index)
+	mux.HandleFunc("/debug/pprof/cmdline", pprof.Cmdline)
+	mux.HandleFunc("/debug/pprof/profile", pprof.Profile)
+	mux.HandleFunc("/debug/pprof/symbol", pprof.Symbol)
+	mux.HandleFunc("/debug/pprof/trace", pprof.Trace)
+
+	go func() {
+		if err := http.Serve(listener, mux); err != nil {
+			log.Printf("pprof endpoint stopped: %v", err)
+		}
+	}()
+	return nil
+}
@@ -0,0 +1,223 @@
+// Package ratelimit throttles failed logins with token buckets per card
+// number and per session, and locks a card out after too many consecutive
+// failures. Only a card's own failures refuse logins to it, so an attacker
+// can't lock every user out at once; the session budget instead slows down
+// the answers to failed logins once it is spent, so guessing across many
+// cards is throttled while valid logins go through. Every check is O(1)
+// and happens in memory, so rejected attempts never reach the database.
+package ratelimit
+
+import (
+	"container/list"
+	"sync"
+	"time"
+)
+
+// Config sets the limits of a Limiter.
+type Config struct {
+	// CardBurst failed attempts are allowed per card before they are
+	// throttled to one every CardRefill.
+	CardBurst  int
+	CardRefill time.Duration
+	// SessionBurst failed attempts are answered at once per session, then
+	// one every SessionRefill. A zero SessionRefill disables the budget.
+	SessionBurst  int
+	SessionRefill time.Duration
+	// LockoutThreshold consecutive failures lock a card for LockoutDuration.
+	LockoutThreshold int
+	LockoutDuration  time.Duration
+	// MaxCards bounds the number of cards whose failures are tracked. Once
+	// it is reached, the card whose last failure is the oldest is forgotten.
+	// Lockouts are kept apart until they expire, so this never lifts one.
+	MaxCards int
+}
+
+// DefaultConfig is used by the banking binary unless overridden by flags.
+var DefaultConfig = Config{
+	CardBurst:        3,
+	CardRefill:       time.Minute,
+	SessionBurst:     20,
+	SessionRefill:    time.Second,
+	LockoutThreshold: 3,
+	LockoutDuration:  15 * time.Minute,
+	MaxCards:         1 << 16,
+}
+
+type bucket struct {
+	tokens float64
+	last   time.Time
+}
+
+func newBucket(burst int, now time.Time) bucket {
+	return bucket{tokens: float64(burst), last: now}
+}
+
+func (b *bucket) refill(now time.Time, burst int, every time.Duration) {
+	if every > 0 {
+		b.tokens += float64(now.Sub(b.last)) / float64(every)
+	}
+	if b.tokens > float64(burst) {
+		b.tokens = float64(burst)
+	}
+	b.last = now
+}
+
+type cardState struct {
+	number   string
+	bucket   bucket
+	failures int
+}
+
+// Limiter tracks the failed logins of one session. It is safe for
+// concurrent use.
+type Limiter struct {
+	mu      sync.Mutex
+	config  Config
+	now     func() time.Time
+	session bucket
+	// cards indexes the elements of recent, which holds the *cardState of
+	// every tracked card, most recently failed first.
+	cards  map[string]*list.Element
+	recent *list.List
+	// locked holds the end of every lockout, expired ones until the next
+	// prune, which runs once locked has grown to pruneAt.
+	locked  map[string]time.Time
+	pruneAt int
+	dirty   map[string]time.Time
+}
+
+// New returns a Limiter enforcing config.
+func New(config Config) *Limiter {
+	if config.MaxCards <= 0 {
+		config.MaxCards = DefaultConfig.MaxCards
+	}
+	l := &Limiter{
+		config:  config,
+		now:     time.Now,
+		cards:   make(map[string]*list.Element),
+		recent:  list.New(),
+		locked:  make(map[string]time.Time),
+		pruneAt: config.MaxCards,
+		dirty:   make(map[string]time.Time),
+	}
+	l.session = newBucket(config.SessionBurst, l.now())
+	return l
+}
+
+// card returns the state of card number, tracking it if it isn't yet, and
+// marks it the most recently used.
+func (l *Limiter) card(number string, now time.Time) *cardState {
+	if element, ok := l.cards[number]; ok {
+		l.recent.MoveToFront(element)
+		return element.Value.(*cardState)
+	}
+	if l.recent.Len() >= l.config.MaxCards {
+		oldest := l.recent.Back()
+		l.recent.Remove(oldest)
+		delete(l.cards, oldest.Value.(*cardState).number)
+	}
+	state := &cardState{number: number, bucket: newBucket(l.config.CardBurst, now)}
+	l.cards[number] = l.recent.PushFront(state)
+	return state
+}
+
+// lock locks card number until the given time, first dropping the expired
+// lockouts if locked has grown to pruneAt.
+func (l *Limiter) lock(number string, until, now time.Time) {
+	if len(l.locked) >= l.pruneAt {
+		for locked, lockedUntil := range l.locked {
+			if !now.Before(lockedUntil) {
+				delete(l.locked, locked)
+			}
+		}
+		l.pruneAt = max(2*len(l.locked), l.config.MaxCards)
+	}
+	l.locked[number] = until
+}
+
+// Allow reports whether a login to card number may be attempted now. Only
+// the failures on that card count.
+func (l *Limiter) Allow(number string) bool {
+	l.mu.Lock()
+	defer l.mu.Unlock()
+
+	now := l.now()
+	if until, ok := l.locked[number]; ok {
+		if now.Before(until) {
+			return false
+		}
+		delete(l.locked, number)
+	}
+	element, ok := l.cards[number]
+	if !ok {
+		return true
+	}
+	state := element.Value.(*cardState)
+	state.bucket.refill(now, l.config.CardBurst, l.config.CardRefill)
+	return state.bucket.tokens >= 1
+}
+
+// Failed records a failed login to card number and returns how long the
+// caller should wait before answering it, which is zero until the session
+// budget is spent. Valid logins never wait, so only guessing is slowed down.
+func (l *Limiter) Failed(number string) time.Duration {
+	l.mu.Lock()
+	defer l.mu.Unlock()
+
+	now := l.now()
+	state := l.card(number, now)
+	state.bucket.refill(now, l.config.CardBurst, l.config.CardRefill)
+	state.bucket.tokens--
+	state.failures++
+	if l.config.LockoutThreshold > 0 && state.failures >= l.config.LockoutThreshold {
+		state.failures = 0
+		until := now.Add(l.config.LockoutDuration)
+		l.lock(number, until, now)
+		l.dirty[number] = until
+	}
+
+	if l.config.SessionRefill <= 0 {
+		return 0
+	}
+	// The session bucket goes into debt rather than refusing, and the wait
+	// is the time it takes to refill back to zero.
+	l.session.refill(now, l.config.SessionBurst, l.config.SessionRefill)
+	l.session.tokens--
+	if l.session.tokens >= 0 {
+		return 0
+	}
+	return time.Duration(-l.session.tokens * float64(l.config.SessionRefill))
+}
+
+// Succeeded records a successful login to card number.
+func (l *Limiter) Succeeded(number string) {
+	l.mu.Lock()
+	defer l.mu.Unlock()
+
+	if element, ok := l.cards[number]; ok {
+		element.Value.(*cardState).failures = 0
+	}
+}
+
+// Restore locks card number until the given time, e.g. after loading a
+// lockout persisted by an earlier run.
+func (l *Limiter) Restore(number string, until time.Time) {
+	l.mu.Lock()
+	defer l.mu.Unlock()
+
+	now := l.now()
+	if until.After(now) {
+		l.lock(number, until, now)
+	}
+}
+
+// TakeLockouts returns the lockouts started since the previous call, so the
+// caller can persist them whenever it is convenient.
+func (l *Limiter) TakeLockouts() map[string]time.Time {
+	l.mu.Lock()
+	defer l.mu.Unlock()
+
+	lockouts := l.dirty
+	l.dirty = make(map[string]time.Time)
+	return lockouts
+}
@@ -0,0 +1,122 @@
+package ratelimit
+
+import (
+	"fmt"
+	"testing"
+	"time"
+)
+
+func newTestLimiter(config Config) (*Limiter, *time.Time) {
+	l := New(config)
+	now := time.Unix(0, 0)
+	l.now = func() time.Time { return now }
+	l.session = newBucket(config.SessionBurst, now)
+	return l, &now
+}
+
+func TestFailuresOnOtherCardsDontThrottle(t *testing.T) {
+	l, now := newTestLimiter(DefaultConfig)
+	for round := 0; round < 1000; round++ {
+		for i := 0; i < 2; i++ {
+			number := fmt.Sprintf("4000000000%06d", 2*round+i)
+			if l.Allow(number) {
+				l.Failed(number)
+			}
+		}
+		*now = now.Add(50 * time.Millisecond)
+		if !l.Allow("4000009999999999") {
+			t.Fatalf("a card without failures was refused in round %d", round)
+		}
+	}
+}
+
+func TestLockout(t *testing.T) {
+	l, now := newTestLimiter(DefaultConfig)
+	const number = "4000000000000002"
+	for i := 0; i < DefaultConfig.LockoutThreshold; i++ {
+		if !l.Allow(number) {
+			t.Fatalf("attempt %d was refused before the lockout", i+1)
+		}
+		l.Failed(number)
+	}
+	if l.Allow(number) {
+		t.Error("the card wasn't locked out")
+	}
+	if lockouts := l.TakeLockouts(); len(lockouts) != 1 {
+		t.Errorf("took %d lockouts, want 1", len(lockouts))
+	}
+	*now = now.Add(DefaultConfig.LockoutDuration + DefaultConfig.CardRefill)
+	if !l.Allow(number) {
+		t.Error("the card is still locked after the lockout")
+	}
+}
+
+func TestSessionBudgetSlowsDownFailures(t *testing.T) {
+	l, now := newTestLimiter(DefaultConfig)
+	for i := 0; i < DefaultConfig.SessionBurst; i++ {
+		if wait := l.Failed(fmt.Sprintf("4000000000%06d", i)); wait != 0 {
+			t.Fatalf("failure %d within the session budget waits %v", i+1, wait)
+		}
+	}
+	if wait := l.Failed("4000000000999999"); wait != DefaultConfig.SessionRefill {
+		t.Errorf("the first failure over the session budget waits %v, want %v", wait, DefaultConfig.SessionRefill)
+	}
+	if wait := l.Failed("4000000000999998"); wait != 2*DefaultConfig.SessionRefill {
+		t.Errorf("the second failure over the session budget waits %v, want %v", wait, 2*DefaultConfig.SessionRefill)
+	}
+	if !l.Allow("4000009999999999") {
+		t.Error("a spent session budget refused a login to a card without failures")
+	}
+	*now = now.Add(2 * DefaultConfig.SessionRefill)
+	if wait := l.Failed("4000000000999997"); wait != DefaultConfig.SessionRefill {
+		t.Errorf("a failure after the session waited waits %v, want %v", wait, DefaultConfig.SessionRefill)
+	}
+}
+
+func TestTrackedCardsBounded(t *testing.T) {
+	config := DefaultConfig
+	config.MaxCards = 4
+	config.LockoutThreshold = 0
+	l, _ := newTestLimiter(config)
+	for i := 0; i < 10; i++ {
+		for j := 0; j < config.CardBurst; j++ {
+			l.Failed(fmt.Sprintf("40000000000000%02d", i))
+		}
+	}
+	if len(l.cards) != config.MaxCards || l.recent.Len() != config.MaxCards {
+		t.Errorf("tracking %d cards in a list of %d, want %d", len(l.cards), l.recent.Len(), config.MaxCards)
+	}
+	if l.Allow("4000000000000009") {
+		t.Error("the most recently failed card was forgotten")
+	}
+	if !l.Allow("4000000000000000") {
+		t.Error("the least recently failed card is still tracked")
+	}
+}
+
+func TestEvictionKeepsLockouts(t *testing.T) {
+	config := DefaultConfig
+	config.MaxCards = 4
+	l, now := newTestLimiter(config)
+	const number = "4000000000000002"
+	for i := 0; i < config.LockoutThreshold; i++ {
+		l.Failed(number)
+	}
+	for i := 0; i < 10*config.MaxCards; i++ {
+		l.Failed(fmt.Sprintf("4000000001%06d", i))
+	}
+	if l.Allow(number) {
+		t.Error("failures on other cards lifted a lockout")
+	}
+	*now = now.Add(config.LockoutDuration)
+	for i := 0; i < 10*config.MaxCards; i++ {
+		l.Failed(fmt.Sprintf("4000000002%06d", i))
+		l.Restore(fmt.Sprintf("4000000002%06d", i), now.Add(time.Minute))
+	}
+	if _, ok := l.locked[number]; ok {
+		t.Error("the expired lockout wasn't pruned")
+	}
+	if !l.Allow(number) {
+		t.Error("the card is still locked after the lockout")
+	}
+}
@@ -0,0 +1,127 @@
+// Package report computes aggregates over the card table on a read-only
+// connection of its own. A report runs inside one read transaction: in WAL
+// mode the transaction reads a snapshot of the database as of its first
+// statement, so a report never blocks the writer of a live session and never
+// sees half of a transfer, however long it runs.
+package report
+
+import (
+	"context"
+	"database/sql"
+	"fmt"
+	"math"
+	"net/url"
+	"slices"
+	"strconv"
+	"time"
+)
+
+// DefaultQuantiles are the balance quantiles a report includes unless others
+// are asked for.
+var DefaultQuantiles = []float64{0.5, 0.9, 0.99}
+
+// Line is one aggregate of a report.
+type Line struct {
+	Name  string
+	Value int64
+}
+
+// Open opens a read-only connection to the database at path with the given
+// database/sql driver, which must be the mattn/go-sqlite3 driver or a
+// wrapper of it. Nothing can be written through it, not even the journal
+// mode, so opening it doesn't need the write lock either.
+func Open(driver, path string, busyTimeout time.Duration) (*sql.DB, error) {
+	params := url.Values{
+		"mode":          {"ro"},
+		"_query_only":   {"true"},
+		"_busy_timeout": {fmt.Sprint(busyTimeout.Milliseconds())},
+	}
+	db, err := sql.Open(driver, "file:"+path+"?"+params.Encode())
+	if err != nil {
+		return nil, fmt.Errorf("failed to open %s: %w", path, err)
+	}
+	// A report is one transaction, which holds one connection.
+	db.SetMaxOpenConns(1)
+	if err := db.Ping(); err != nil {
+		db.Close()
+		return nil, fmt.Errorf("failed to open %s: %w", path, err)
+	}
+	return db, nil
+}
+
+// ParseQuantiles parses quantiles given as arguments, such as 0.5 or 0.999.
+// No arguments means DefaultQuantiles.
+func ParseQuantiles(args []string) ([]float64, error) {
+	if len(args) == 0 {
+		return DefaultQuantiles, nil
+	}
+	quantiles := make([]float64, len(args))
+	for i, arg := range args {
+		q, err := strconv.ParseFloat(arg, 64)
+		if err != nil || q <= 0 || q > 1 {
+			return nil, fmt.Errorf("invalid quantile %q, expected a number in (0, 1]", arg)
+		}
+		quantiles[i] = q
+	}
+	return quantiles, nil
+}
+
+// QuantileName names the line of a quantile: p50 for 0.5, p99.9 for 0.999.
+func QuantileName(q float64) string {
+	return "p" + strconv.FormatFloat(math.Round(q*1e6)/1e4, 'f', -1, 64)
+}
+
+// Run computes a report on db and passes every aggregate to emit as soon as
+// it is known: the number of accounts and the total balance first, then the
+// balance quantiles in increasing order as the balances stream by in order.
+// A quantile is the nearest-rank one, the smallest balance with at least
+// that share of the accounts at or below it.
+func Run(ctx context.Context, db *sql.DB, quantiles []float64, emit func(Line) error) error {
+	tx, err := db.BeginTx(ctx, nil)
+	if err != nil {
+		return err
+	}
+	defer tx.Rollback()
+
+	var accounts int64
+	var total sql.NullInt64
+	if err := tx.QueryRowContext(ctx, "SELECT COUNT(*), SUM(balance) FROM card").Scan(&accounts, &total); err != nil {
+		return err
+	}
+	if err := emit(Line{Name: "accounts", Value: accounts}); err != nil {
+		return err
+	}
+	if err := emit(Line{Name: "total_balance", Value: total.Int64}); err != nil {
+		return err
+	}
+	if accounts == 0 || len(quantiles) == 0 {
+		return nil
+	}
+
+	quantiles = slices.Clone(quantiles)
+	slices.Sort(quantiles)
+	ranks := make([]int64, len(quantiles))
+	for i, q := range quantiles {
+		ranks[i] = max(0, int64(math.Ceil(q*float64(accounts)))-1)
+	}
+
+	rows, err := tx.QueryContext(ctx, "SELECT balance FROM card ORDER BY balance")
+	if err != nil {
+		return err
+	}
+	defer rows.Close()
+
+	next := 0
+	for rank := int64(0); next < len(ranks) && rows.Next(); rank++ {
+		var balance int64
+		if err := rows.Scan(&balance); err != nil {
+			return err
+		}
+		for ; next < len(ranks) && ranks[next] == rank; next++ {
+			if err := emit(Line{Name: QuantileName(quantiles[next]), Value: balance}); err != nil {
+				return err
+			}
+		}
+	}
+	return rows.Err()
+}
@@ -0,0 +1,165 @@
+package report
+
+import (
+	"context"
+	"database/sql"
+	"path/filepath"
+	"reflect"
+	"testing"
+	"time"
+
+	_ "github.com/mattn/go-sqlite3"
+)
+
+// newDatabase creates a WAL database holding cards with the balances 1 to n
+// and returns its path and a writer connection that fails at once instead of
+// waiting for a lock.
+func newDatabase(tb testing.TB, n int) (string, *sql.DB) {
+	tb.Helper()
+	path := filepath.Join(tb.TempDir(), "card.s3db")
+	writer, err := sql.Open("sqlite3", "file:"+path+"?_journal_mode=WAL&_busy_timeout=0")
+	if err != nil {
+		tb.Fatal(err)
+	}
+	writer.SetMaxOpenConns(1)
+	tb.Cleanup(func() { writer.Close() })
+
+	if _, err := writer.Exec("CREATE TABLE card (id INTEGER PRIMARY KEY, number TEXT NOT NULL UNIQUE, " +
+		"pin TEXT, balance INTEGER DEFAULT 0)"); err != nil {
+		tb.Fatal(err)
+	}
+	tx, err := writer.Begin()
+	if err != nil {
+		tb.Fatal(err)
+	}
+	for i := 1; i <= n; i++ {
+		if _, err := tx.Exec("INSERT INTO card (number, pin, balance) VALUES (?, '0000', ?)",
+			4000000000000000+i, i); err != nil {
+			tb.Fatal(err)
+		}
+	}
+	if err := tx.Commit(); err != nil {
+		tb.Fatal(err)
+	}
+	return path, writer
+}
+
+func openReader(tb testing.TB, path string) *sql.DB {
+	tb.Helper()
+	db, err := Open("sqlite3", path, 0)
+	if err != nil {
+		tb.Fatal(err)
+	}
+	tb.Cleanup(func() { db.Close() })
+	return db
+}
+
+func TestRunStreamsAggregates(t *testing.T) {
+	path, _ := newDatabase(t, 1000)
+
+	var lines []Line
+	err := Run(context.Background(), openReader(t, path), []float64{0.99, 0.5, 0.9}, func(line Line) error {
+		lines = append(lines, line)
+		return nil
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	want := []Line{{"accounts", 1000}, {"total_balance", 500500}, {"p50", 500}, {"p90", 900}, {"p99", 990}}
+	if !reflect.DeepEqual(lines, want) {
+		t.Errorf("report = %v, want %v", lines, want)
+	}
+}
+
+func TestRunReadsASnapshotWithoutBlockingTheWriter(t *testing.T) {
+	path, writer := newDatabase(t, 1000)
+
+	var lines []Line
+	err := Run(context.Background(), openReader(t, path), []float64{1}, func(line Line) error {
+		if line.Name == "accounts" {
+			// The writer has no busy timeout: it fails if the report holds
+			// a lock it needs.
+			if _, err := writer.Exec("UPDATE card SET balance = 1000000 WHERE id = 1"); err != nil {
+				t.Errorf("the writer was blocked by a running report: %v", err)
+			}
+			if _, err := writer.Exec("DELETE FROM card WHERE id = 2"); err != nil {
+				t.Errorf("the writer was blocked by a running report: %v", err)
+			}
+		}
+		lines = append(lines, line)
+		return nil
+	})
+	if err != nil {
+		t.Fatal(err)
+	}
+	want := []Line{{"accounts", 1000}, {"total_balance", 500500}, {"p100", 1000}}
+	if !reflect.DeepEqual(lines, want) {
+		t.Errorf("report = %v, want the snapshot from before the writes %v", lines, want)
+	}
+}
+
+func TestParseQuantiles(t *testing.T) {
+	if got, err := ParseQuantiles(nil); err != nil || !reflect.DeepEqual(got, DefaultQuantiles) {
+		t.Errorf("ParseQuantiles() = %v, %v, want the defaults", got, err)
+	}
+	if got, err := ParseQuantiles([]string{"0.999", "1"}); err != nil || !reflect.DeepEqual(got, []float64{0.999, 1}) {
+		t.Errorf("ParseQuantiles(0.999, 1) = %v, %v", got, err)
+	}
+	for _, arg := range []string{"0", "1.5", "half"} {
+		if _, err := ParseQuantiles([]string{arg}); err == nil {
+			t.Errorf("ParseQuantiles accepted %q", arg)
+		}
+	}
+	for q, want := range map[float64]string{0.5: "p50", 0.99: "p99", 0.999: "p99.9"} {
+		if got := QuantileName(q); got != want {
+			t.Errorf("QuantileName(%g) = %q, want %q", q, got, want)
+		}
+	}
+}
+
+// BenchmarkReportDuringWrites runs full reports over 10^6 cards while a
+// writer keeps updating balances, and reports the slowest write. With the
+// report on its own read-only connection in WAL mode the slowest write stays
+// in the range of a lone write instead of waiting for the report.
+func BenchmarkReportDuringWrites(b *testing.B) {
+	path, writer := newDatabase(b, 1000000)
+	if _, err := writer.Exec("PRAGMA busy_timeout = 5000"); err != nil {
+		b.Fatal(err)
+	}
+	reader := openReader(b, path)
+
+	done := make(chan struct{})
+	stopped := make(chan struct{})
+	var writes int
+	var slowest time.Duration
+	go func() {
+		defer close(stopped)
+		for i := 1; ; i++ {
+			select {
+			case <-done:
+				return
+			default:
+			}
+			start := time.Now()
+			if _, err := writer.Exec("UPDATE card SET balance = balance + 1 WHERE id = ?", i%1000000+1); err != nil {
+				b.Error(err)
+				return
+			}
+			slowest = max(slowest, time.Since(start))
+			writes++
+		}
+	}()
+
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		if err := Run(context.Background(), reader, DefaultQuantiles, func(Line) error { return nil }); err != nil {
+			b.Fatal(err)
+		}
+	}
+	b.StopTimer()
+	close(done)
+	<-stopped
+
+	b.ReportMetric(float64(slowest.Microseconds())/1000, "max-write-ms")
+	b.ReportMetric(float64(writes)/b.Elapsed().Seconds(), "writes/s")
+}
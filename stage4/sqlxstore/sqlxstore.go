@@ -0,0 +1,375 @@
+// Package sqlxstore keeps the cards of the banking system with sqlx. Every
+// operation that runs more than one statement goes through a
+// transaction-scoped Tx, so its reads and writes share one connection and
+// see one consistent snapshot of the database.
+package sqlxstore
+
+import (
+	"database/sql"
+	"errors"
+	"time"
+
+	"github.com/jmoiron/sqlx"
+	"github.com/mattn/go-sqlite3"
+
+	"stage4/journal"
+	"stage4/pool"
+	"stage4/store"
+	"stage4/transfer"
+)
+
+const driverName = "sqlite3"
+
+const cardColumns = "id, number, pin, balance"
+
+// schema creates the card, journal, archive and closing tables the way GORM
+// creates them for store.Card, journal.Entry, archive.Card and
+// archive.Closing, so both backends share one file.
+var schema = []string{
+	"CREATE TABLE IF NOT EXISTS `card` (`id` integer PRIMARY KEY AUTOINCREMENT,`number` text NOT NULL UNIQUE," +
+		"`pin` text,`balance` integer DEFAULT 0)",
+	"CREATE TABLE IF NOT EXISTS `transactions` (`id` integer PRIMARY KEY AUTOINCREMENT,`number` text NOT NULL," +
+		"`amount` integer NOT NULL,`kind` text NOT NULL,`reference` text,`created_at` datetime)",
+	"CREATE INDEX IF NOT EXISTS `idx_transactions_number` ON `transactions`(`number`)",
+	"CREATE TABLE IF NOT EXISTS `card_archive` (`id` integer PRIMARY KEY AUTOINCREMENT,`number` text NOT NULL," +
+		"`pin` text,`balance` integer,`closed_at` datetime NOT NULL)",
+	"CREATE INDEX IF NOT EXISTS `idx_card_archive_number` ON `card_archive`(`number`)",
+	"CREATE TABLE IF NOT EXISTS `card_closing` (`number` text,`closed_at` datetime NOT NULL,PRIMARY KEY (`number`))",
+}
+
+// archiveBatchSize is the number of cards moved per pair of statements by
+// Tx.Archive.
+const archiveBatchSize = 500
+
+// ErrNotFound is returned when a card doesn't exist.
+var ErrNotFound = store.ErrNotFound
+
+// Card is a row of the card table.
+type Card = store.Card
+
+// Observer is told about every statement run by a Repository.
+type Observer func(query string, d time.Duration, rows int64)
+
+// Repository is a store.Store keeping the cards of one database file.
+// Transactions run on the single writer connection; lookups run on the
+// read-only pool.
+type Repository struct {
+	pools   *pool.Pools
+	writer  *sqlx.DB
+	reader  *sqlx.DB
+	observe Observer
+}
+
+// Open opens the database at path with the given pool settings.
+func Open(path string, config pool.Config) (*Repository, error) {
+	pools, err := pool.Open(driverName, path, config)
+	if err != nil {
+		return nil, err
+	}
+	repo := New(pools.Writer, pools.Reader)
+	repo.pools = pools
+	return repo, nil
+}
+
+// New returns a Repository over pools opened by the caller, which stay
+// open when the Repository is closed.
+func New(writer, reader *sql.DB) *Repository {
+	return &Repository{
+		writer:  sqlx.NewDb(writer, driverName),
+		reader:  sqlx.NewDb(reader, driverName),
+		observe: func(string, time.Duration, int64) {},
+	}
+}
+
+// Observe makes the repository report every statement it runs to fn.
+func (r *Repository) Observe(fn Observer) {
+	r.observe = fn
+}
+
+// Pools returns the connection pools opened by Open, e.g. to export their
+// statistics.
+func (r *Repository) Pools() *pool.Pools {
+	return r.pools
+}
+
+// Close closes the connection pools opened by Open.
+func (r *Repository) Close() error {
+	if r.pools == nil {
+		return nil
+	}
+	return r.pools.Close()
+}
+
+// Migrate creates the card and journal tables if they don't exist yet.
+func (r *Repository) Migrate() error {
+	for _, statement := range schema {
+		if _, err := r.writer.Exec(statement); err != nil {
+			return err
+		}
+	}
+	return nil
+}
+
+// InTx runs fn in a transaction, committing it if fn returns nil and rolling
+// it back otherwise.
+func (r *Repository) InTx(fn func(tx *Tx) error) error {
+	tx, err := r.writer.Beginx()
+	if err != nil {
+		return err
+	}
+	if err := fn(&Tx{tx: tx, observe: r.observe}); err != nil {
+		return errors.Join(err, tx.Rollback())
+	}
+	return tx.Commit()
+}
+
+// CardExists reports whether a card with the given number exists.
+func (r *Repository) CardExists(number string) (bool, error) {
+	_, err := r.Get(number)
+	if errors.Is(err, ErrNotFound) {
+		return false, nil
+	}
+	return err == nil, err
+}
+
+func (r *Repository) Create(card Card) error {
+	return r.InTx(func(tx *Tx) error {
+		return tx.Create(card)
+	})
+}
+
+func (r *Repository) Get(number string) (Card, error) {
+	return getCard(r.reader, r.observe, number)
+}
+
+func (r *Repository) Authenticate(number string, verify func(storedPIN string) bool) (Card, error) {
+	card, err := r.Get(number)
+	if err != nil {
+		return Card{}, err
+	}
+	if !verify(card.PIN) {
+		return Card{}, store.ErrWrongPIN
+	}
+	return card, nil
+}
+
+func (r *Repository) Credit(number string, amount int) (Card, error) {
+	var card Card
+	err := r.InTx(func(tx *Tx) (err error) {
+		if err := tx.Credit(number, amount); err != nil {
+			if errors.Is(err, transfer.ErrUnknownCard) {
+				return ErrNotFound
+			}
+			return err
+		}
+		if err := tx.Append(journal.Entry{Number: number, Amount: amount, Kind: journal.KindIncome}); err != nil {
+			return err
+		}
+		card, err = tx.Card(number)
+		return err
+	})
+	return card, err
+}
+
+func (r *Repository) Transfer(from, to string, amount int) (Card, Card, error) {
+	var sender, receiver Card
+	err := r.InTx(func(tx *Tx) (err error) {
+		if err := tx.Debit(from, amount); err != nil {
+			return err
+		}
+		if err := tx.Credit(to, amount); err != nil {
+			return err
+		}
+		err = tx.Append(
+			journal.Entry{Number: from, Amount: -amount, Kind: journal.KindTransferOut, Reference: to},
+			journal.Entry{Number: to, Amount: amount, Kind: journal.KindTransferIn, Reference: from},
+		)
+		if err != nil {
+			return err
+		}
+		if sender, err = tx.Card(from); err != nil {
+			return err
+		}
+		receiver, err = tx.Card(to)
+		return err
+	})
+	return sender, receiver, err
+}
+
+// Delete moves the card with the given number to the archive, or fails with
+// ErrNotFound.
+func (r *Repository) Delete(number string) error {
+	return r.InTx(func(tx *Tx) error {
+		now := time.Now()
+		if err := tx.MarkClosed(number, now); err != nil {
+			return err
+		}
+		return tx.Archive([]string{number}, now)
+	})
+}
+
+// MarkClosed marks the card with the given number closed.
+func (r *Repository) MarkClosed(number string, closedAt time.Time) error {
+	return r.InTx(func(tx *Tx) error {
+		return tx.MarkClosed(number, closedAt)
+	})
+}
+
+// Marked returns the numbers of the cards marked closed.
+func (r *Repository) Marked() ([]string, error) {
+	const query = "SELECT number FROM card_closing"
+
+	start := time.Now()
+	var numbers []string
+	err := r.reader.Select(&numbers, query)
+	r.observe(query, time.Since(start), int64(len(numbers)))
+	return numbers, err
+}
+
+// Archive moves the cards with the given numbers to the archive in one
+// transaction.
+func (r *Repository) Archive(numbers []string, closedAt time.Time) error {
+	return r.InTx(func(tx *Tx) error {
+		return tx.Archive(numbers, closedAt)
+	})
+}
+
+// Tx is a transaction of a Repository.
+type Tx struct {
+	tx      *sqlx.Tx
+	observe Observer
+}
+
+// Card returns the card with the given number as seen by the transaction.
+func (t *Tx) Card(number string) (Card, error) {
+	return getCard(t.tx, t.observe, number)
+}
+
+// Create inserts card, failing with store.ErrExists if its number is taken.
+func (t *Tx) Create(card Card) error {
+	_, err := t.exec("INSERT INTO card (number, pin, balance) VALUES (?, ?, ?)",
+		card.Number, card.PIN, card.Balance)
+	var sqliteErr sqlite3.Error
+	if errors.As(err, &sqliteErr) && sqliteErr.ExtendedCode == sqlite3.ErrConstraintUnique {
+		return store.ErrExists
+	}
+	return err
+}
+
+// Credit adds amount to the balance of a card, failing with
+// transfer.ErrUnknownCard if there is no such card.
+func (t *Tx) Credit(number string, amount int) error {
+	res, err := t.exec("UPDATE card SET balance = balance + ? WHERE number = ?", amount, number)
+	return expectRow(res, err, transfer.ErrUnknownCard)
+}
+
+// Debit subtracts amount from the balance of a card, failing with
+// transfer.ErrInsufficientFunds instead of letting the balance go negative.
+func (t *Tx) Debit(number string, amount int) error {
+	res, err := t.exec("UPDATE card SET balance = balance - ? WHERE number = ? AND balance >= ?",
+		amount, number, amount)
+	return expectRow(res, err, transfer.ErrInsufficientFunds)
+}
+
+// MarkClosed marks the card with the given number closed and journals its
+// balance out, failing with ErrNotFound if there is no such card or it is
+// marked already.
+func (t *Tx) MarkClosed(number string, closedAt time.Time) error {
+	res, err := t.exec("INSERT INTO card_closing (number, closed_at) SELECT number, ? FROM card "+
+		"WHERE number = ? AND number NOT IN (SELECT number FROM card_closing)", closedAt, number)
+	if err := expectRow(res, err, ErrNotFound); err != nil {
+		return err
+	}
+	_, err = t.exec("INSERT INTO transactions (number, amount, kind, reference, created_at) "+
+		"SELECT number, -balance, ?, '', ? FROM card WHERE number = ? AND balance != 0",
+		journal.KindClose, closedAt, number)
+	return err
+}
+
+// Archive copies the cards with the given numbers to the archive and
+// deletes them from the card table. A card marked closed is archived with
+// the time of its mark, and unmarked; closedAt is the time of the others.
+func (t *Tx) Archive(numbers []string, closedAt time.Time) error {
+	for start := 0; start < len(numbers); start += archiveBatchSize {
+		batch := numbers[start:min(start+archiveBatchSize, len(numbers))]
+
+		query, args, err := sqlx.In("INSERT INTO card_archive (number, pin, balance, closed_at) "+
+			"SELECT card.number, pin, balance, COALESCE(card_closing.closed_at, ?) FROM card "+
+			"LEFT JOIN card_closing ON card_closing.number = card.number WHERE card.number IN (?)",
+			closedAt, batch)
+		if err != nil {
+			return err
+		}
+		if _, err := t.exec(query, args...); err != nil {
+			return err
+		}
+
+		for _, table := range []string{"card", "card_closing"} {
+			query, args, err = sqlx.In("DELETE FROM "+table+" WHERE number IN (?)", batch)
+			if err != nil {
+				return err
+			}
+			if _, err := t.exec(query, args...); err != nil {
+				return err
+			}
+		}
+	}
+	return nil
+}
+
+// Append records journal entries in the transaction.
+func (t *Tx) Append(entries ...journal.Entry) error {
+	now := time.Now()
+	for _, entry := range entries {
+		_, err := t.exec("INSERT INTO transactions (number, amount, kind, reference, created_at) VALUES (?, ?, ?, ?, ?)",
+			entry.Number, entry.Amount, entry.Kind, entry.Reference, now)
+		if err != nil {
+			return err
+		}
+	}
+	return nil
+}
+
+func (t *Tx) exec(query string, args ...any) (sql.Result, error) {
+	start := time.Now()
+	res, err := t.tx.Exec(query, args...)
+	var rows int64
+	if err == nil {
+		rows, _ = res.RowsAffected()
+	}
+	t.observe(query, time.Since(start), rows)
+	return res, err
+}
+
+func getCard(q sqlx.Queryer, observe Observer, number string) (Card, error) {
+	const query = "SELECT " + cardColumns + " FROM card WHERE number = ? LIMIT 1"
+
+	start := time.Now()
+	var card Card
+	err := sqlx.Get(q, &card, query, number)
+	var rows int64
+	if err == nil {
+		rows = 1
+	}
+	observe(query, time.Since(start), rows)
+
+	if errors.Is(err, sql.ErrNoRows) {
+		return Card{}, ErrNotFound
+	}
+	return card, err
+}
+
+// expectRow returns notMatched if a successful statement changed no row.
+func expectRow(res sql.Result, err error, notMatched error) error {
+	if err != nil {
+		return err
+	}
+	n, err := res.RowsAffected()
+	if err != nil {
+		return err
+	}
+	if n == 0 {
+		return notMatched
+	}
+	return nil
+}
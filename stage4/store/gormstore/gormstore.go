@@ -0,0 +1,211 @@
+// Package gormstore keeps the cards of the banking system with GORM.
+package gormstore
+
+import (
+	"errors"
+	"time"
+
+	"gorm.io/gorm"
+	"gorm.io/gorm/clause"
+
+	"stage4/archive"
+	"stage4/journal"
+	"stage4/store"
+	"stage4/transfer"
+)
+
+// saveBatchSize is the number of rows written per statement by Save.
+const saveBatchSize = 500
+
+// Store is a store.Store backed by GORM. Writes go through db; lookups that
+// don't need to see uncommitted writes go through reader.
+type Store struct {
+	db     *gorm.DB
+	reader *gorm.DB
+}
+
+// New returns a Store using db for writes and reader for lookups. The card
+// and journal tables must already exist.
+func New(db, reader *gorm.DB) *Store {
+	return &Store{db: db, reader: reader}
+}
+
+func (s *Store) Create(card store.Card) error {
+	if err := s.db.Create(&card).Error; err != nil {
+		if errors.Is(err, gorm.ErrDuplicatedKey) {
+			return store.ErrExists
+		}
+		return err
+	}
+	return nil
+}
+
+func (s *Store) Get(number string) (store.Card, error) {
+	return find(s.reader, number)
+}
+
+func (s *Store) Authenticate(number string, verify func(storedPIN string) bool) (store.Card, error) {
+	card, err := find(s.reader, number)
+	if err != nil {
+		return store.Card{}, err
+	}
+	if !verify(card.PIN) {
+		return store.Card{}, store.ErrWrongPIN
+	}
+	return card, nil
+}
+
+func (s *Store) Credit(number string, amount int) (store.Card, error) {
+	var card store.Card
+	err := s.db.Transaction(func(tx *gorm.DB) error {
+		credit := tx.Model(&store.Card{}).Where("number = ?", number).
+			Update("balance", gorm.Expr("balance + ?", amount))
+		if credit.Error != nil {
+			return credit.Error
+		}
+		if credit.RowsAffected == 0 {
+			return store.ErrNotFound
+		}
+
+		err := journal.Append(tx, journal.Entry{Number: number, Amount: amount, Kind: journal.KindIncome})
+		if err != nil {
+			return err
+		}
+		return tx.Where("number = ?", number).First(&card).Error
+	})
+	return card, err
+}
+
+func (s *Store) Transfer(from, to string, amount int) (store.Card, store.Card, error) {
+	var sender, receiver store.Card
+	err := s.db.Transaction(func(tx *gorm.DB) error {
+		debit := tx.Model(&store.Card{}).Where("number = ? AND balance >= ?", from, amount).
+			Update("balance", gorm.Expr("balance - ?", amount))
+		if debit.Error != nil {
+			return debit.Error
+		}
+		if debit.RowsAffected == 0 {
+			return transfer.ErrInsufficientFunds
+		}
+
+		credit := tx.Model(&store.Card{}).Where("number = ?", to).
+			Update("balance", gorm.Expr("balance + ?", amount))
+		if credit.Error != nil {
+			return credit.Error
+		}
+		if credit.RowsAffected == 0 {
+			return transfer.ErrUnknownCard
+		}
+
+		err := journal.Append(tx,
+			journal.Entry{Number: from, Amount: -amount, Kind: journal.KindTransferOut, Reference: to},
+			journal.Entry{Number: to, Amount: amount, Kind: journal.KindTransferIn, Reference: from},
+		)
+		if err != nil {
+			return err
+		}
+		if err := tx.Where("number = ?", from).First(&sender).Error; err != nil {
+			return err
+		}
+		return tx.Where("number = ?", to).First(&receiver).Error
+	})
+	return sender, receiver, err
+}
+
+// Delete moves the card with the given number to the archive, or fails with
+// store.ErrNotFound.
+func (s *Store) Delete(number string) error {
+	return s.db.Transaction(func(tx *gorm.DB) error {
+		now := time.Now()
+		if err := archive.MarkClosed(tx, number, now); err != nil {
+			return err
+		}
+		return archive.Move(tx, []string{number}, now)
+	})
+}
+
+// MarkClosed marks the card with the given number closed.
+func (s *Store) MarkClosed(number string, closedAt time.Time) error {
+	return archive.MarkClosed(s.db, number, closedAt)
+}
+
+// Marked returns the numbers of the cards marked closed.
+func (s *Store) Marked() ([]string, error) {
+	return archive.Marked(s.reader)
+}
+
+// Archive moves the cards with the given numbers to the archive in one
+// transaction.
+func (s *Store) Archive(numbers []string, closedAt time.Time) error {
+	return s.db.Transaction(func(tx *gorm.DB) error {
+		return archive.Move(tx, numbers, closedAt)
+	})
+}
+
+// Close does nothing; the connection pools belong to the caller.
+func (s *Store) Close() error {
+	return nil
+}
+
+// Load calls fn for every stored card, streaming the card table.
+func (s *Store) Load(fn func(card store.Card) error) error {
+	rows, err := s.reader.Model(&store.Card{}).Rows()
+	if err != nil {
+		return err
+	}
+	defer rows.Close()
+
+	for rows.Next() {
+		var card store.Card
+		if err := s.reader.ScanRows(rows, &card); err != nil {
+			return err
+		}
+		if err := fn(card); err != nil {
+			return err
+		}
+	}
+	return rows.Err()
+}
+
+// Save writes the state kept by an in-memory store in one transaction: it
+// archives the closed cards, inserts or updates the changed ones and appends
+// their journal entries. Cards are matched by number; their IDs are ignored.
+func (s *Store) Save(cards, closed []store.Card, entries []journal.Entry) error {
+	for i := range cards {
+		cards[i].ID = 0
+	}
+
+	return s.db.Transaction(func(tx *gorm.DB) error {
+		if err := archive.Insert(tx, closed, time.Now()); err != nil {
+			return err
+		}
+
+		if len(cards) > 0 {
+			err := tx.Clauses(clause.OnConflict{
+				Columns:   []clause.Column{{Name: "number"}},
+				DoUpdates: clause.AssignmentColumns([]string{"pin", "balance"}),
+			}).CreateInBatches(cards, saveBatchSize).Error
+			if err != nil {
+				return err
+			}
+		}
+
+		if len(entries) > 0 {
+			return tx.CreateInBatches(entries, saveBatchSize).Error
+		}
+		return nil
+	})
+}
+
+// find returns the card with the given number, or store.ErrNotFound.
+func find(db *gorm.DB, number string) (store.Card, error) {
+	var card store.Card
+	result := db.Where("number = ?", number).Limit(1).Find(&card)
+	if result.Error != nil {
+		return store.Card{}, result.Error
+	}
+	if result.RowsAffected == 0 {
+		return store.Card{}, store.ErrNotFound
+	}
+	return card, nil
+}
@@ -0,0 +1,429 @@
+// Package memstore keeps the cards of the banking system in memory. Cards
+// are spread over lock stripes, so operations on different cards rarely
+// contend, and a transfer locks its two stripes in a fixed order, so two
+// opposite transfers can't deadlock. Balances are atomic and changed only
+// with their stripe locked, so reading a card takes no lock at all. The
+// engine is the throughput ceiling the SQL backends are measured against.
+//
+// Changes are written behind: a background flusher saves them to the
+// Backing every FlushInterval. Many updates of one card between two flushes
+// are coalesced into a single row write, so a crash loses at most the
+// changes of the last FlushInterval.
+package memstore
+
+import (
+	"errors"
+	"log"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"stage4/journal"
+	"stage4/store"
+	"stage4/transfer"
+)
+
+// stripeCount is the number of lock stripes; a power of two.
+const stripeCount = 64
+
+// Options configures the write-behind flusher.
+type Options struct {
+	// FlushInterval is the longest time a change stays in memory only.
+	FlushInterval time.Duration
+	// QueueSize bounds the journal entries waiting for a flush. Once it is
+	// reached, writers block until the flusher catches up.
+	QueueSize int
+}
+
+// DefaultOptions bounds data loss on a crash to a tenth of a second.
+var DefaultOptions = Options{
+	FlushInterval: 100 * time.Millisecond,
+	QueueSize:     4096,
+}
+
+// Backing is the durable storage an Engine is loaded from and saved to.
+type Backing interface {
+	// Load calls fn for every stored card.
+	Load(fn func(card store.Card) error) error
+	// Save archives the closed cards, inserts or updates the changed ones and
+	// appends the journal entries, atomically. A number may be both closed and
+	// changed if it was reissued after its card was closed.
+	Save(cards, closed []store.Card, entries []journal.Entry) error
+}
+
+// stripe serializes the changes of the cards hashed to it.
+type stripe struct {
+	mu sync.Mutex
+	// dirty holds the numbers of the cards changed since the last flush and
+	// closed the cards deleted since then.
+	dirty  map[string]struct{}
+	closed []store.Card
+}
+
+// account is a card held by an Engine. Its balance is only changed with
+// the lock of its stripe held, but read without any; the Balance field of
+// card is the one it was loaded or created with.
+type account struct {
+	card    store.Card
+	balance atomic.Int64
+}
+
+func newAccount(card store.Card) *account {
+	a := &account{card: card}
+	a.balance.Store(int64(card.Balance))
+	return a
+}
+
+// snapshot returns the card with its current balance.
+func (a *account) snapshot() store.Card {
+	card := a.card
+	card.Balance = int(a.balance.Load())
+	return card
+}
+
+// Engine is an in-memory store.Store that writes its changes behind to a
+// Backing.
+type Engine struct {
+	stripes [stripeCount]stripe
+	// accounts maps card numbers to their *account. It is only changed with
+	// the stripe of the number locked, and read without locking.
+	accounts sync.Map
+	backing  Backing
+	options  Options
+
+	// mu guards entries. It is taken after stripe locks, so a flush sees the
+	// balance changes and the journal entries of a transfer together.
+	mu      sync.Mutex
+	entries []journal.Entry
+	drained *sync.Cond
+
+	// flushMu serializes flushes.
+	flushMu sync.Mutex
+
+	kick    chan struct{}
+	done    chan struct{}
+	stopped chan struct{}
+}
+
+// Open returns an Engine holding every card of backing and starts its
+// flusher. Options that aren't positive take their DefaultOptions value.
+func Open(backing Backing, options Options) (*Engine, error) {
+	if options.FlushInterval <= 0 {
+		options.FlushInterval = DefaultOptions.FlushInterval
+	}
+	if options.QueueSize <= 0 {
+		options.QueueSize = DefaultOptions.QueueSize
+	}
+	e := &Engine{
+		backing: backing,
+		options: options,
+		kick:    make(chan struct{}, 1),
+		done:    make(chan struct{}),
+		stopped: make(chan struct{}),
+	}
+	e.drained = sync.NewCond(&e.mu)
+	for i := range e.stripes {
+		e.stripes[i].dirty = make(map[string]struct{})
+	}
+
+	err := backing.Load(func(card store.Card) error {
+		e.accounts.Store(card.Number, newAccount(card))
+		return nil
+	})
+	if err != nil {
+		return nil, err
+	}
+
+	go e.run()
+	return e, nil
+}
+
+// stripeIndex hashes number with FNV-1a.
+func stripeIndex(number string) int {
+	h := uint32(2166136261)
+	for i := 0; i < len(number); i++ {
+		h ^= uint32(number[i])
+		h *= 16777619
+	}
+	return int(h & (stripeCount - 1))
+}
+
+func (e *Engine) stripeOf(number string) *stripe {
+	return &e.stripes[stripeIndex(number)]
+}
+
+func (e *Engine) account(number string) *account {
+	a, ok := e.accounts.Load(number)
+	if !ok {
+		return nil
+	}
+	return a.(*account)
+}
+
+func (e *Engine) Create(card store.Card) error {
+	s := e.stripeOf(card.Number)
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	if _, loaded := e.accounts.LoadOrStore(card.Number, newAccount(card)); loaded {
+		return store.ErrExists
+	}
+	s.dirty[card.Number] = struct{}{}
+	return nil
+}
+
+// Get returns a card without locking. Every balance it returns was the
+// card's balance at some point, but the cards of a transfer read one after
+// the other may be read on either side of it.
+func (e *Engine) Get(number string) (store.Card, error) {
+	a := e.account(number)
+	if a == nil {
+		return store.Card{}, store.ErrNotFound
+	}
+	return a.snapshot(), nil
+}
+
+// Balance returns the balance of a card without locking, like Get.
+func (e *Engine) Balance(number string) (int, error) {
+	a := e.account(number)
+	if a == nil {
+		return 0, store.ErrNotFound
+	}
+	return int(a.balance.Load()), nil
+}
+
+func (e *Engine) Authenticate(number string, verify func(storedPIN string) bool) (store.Card, error) {
+	card, err := e.Get(number)
+	if err != nil {
+		return store.Card{}, err
+	}
+	if !verify(card.PIN) {
+		return store.Card{}, store.ErrWrongPIN
+	}
+	return card, nil
+}
+
+func (e *Engine) Credit(number string, amount int) (store.Card, error) {
+	e.waitForRoom()
+
+	s := e.stripeOf(number)
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	a := e.account(number)
+	if a == nil {
+		return store.Card{}, store.ErrNotFound
+	}
+	a.balance.Add(int64(amount))
+	s.dirty[number] = struct{}{}
+	e.record(journal.Entry{Number: number, Amount: amount, Kind: journal.KindIncome})
+	return a.snapshot(), nil
+}
+
+func (e *Engine) Transfer(from, to string, amount int) (store.Card, store.Card, error) {
+	e.waitForRoom()
+
+	i, j := stripeIndex(from), stripeIndex(to)
+	first, second := i, j
+	if first > second {
+		first, second = second, first
+	}
+	e.stripes[first].mu.Lock()
+	defer e.stripes[first].mu.Unlock()
+	if second != first {
+		e.stripes[second].mu.Lock()
+		defer e.stripes[second].mu.Unlock()
+	}
+
+	sender, receiver := e.account(from), e.account(to)
+	switch {
+	case sender == nil || sender.balance.Load() < int64(amount):
+		return store.Card{}, store.Card{}, transfer.ErrInsufficientFunds
+	case receiver == nil:
+		return store.Card{}, store.Card{}, transfer.ErrUnknownCard
+	}
+
+	sender.balance.Add(-int64(amount))
+	receiver.balance.Add(int64(amount))
+	e.stripes[i].dirty[from] = struct{}{}
+	e.stripes[j].dirty[to] = struct{}{}
+	e.record(
+		journal.Entry{Number: from, Amount: -amount, Kind: journal.KindTransferOut, Reference: to},
+		journal.Entry{Number: to, Amount: amount, Kind: journal.KindTransferIn, Reference: from},
+	)
+	return sender.snapshot(), receiver.snapshot(), nil
+}
+
+// Delete removes the card with the given number and journals its balance
+// out, or fails with store.ErrNotFound.
+func (e *Engine) Delete(number string) error {
+	e.waitForRoom()
+	s := e.stripeOf(number)
+	s.mu.Lock()
+	defer s.mu.Unlock()
+
+	a, ok := e.accounts.LoadAndDelete(number)
+	if !ok {
+		return store.ErrNotFound
+	}
+	card := a.(*account).snapshot()
+	delete(s.dirty, number)
+	s.closed = append(s.closed, card)
+	if card.Balance != 0 {
+		e.record(journal.Entry{Number: number, Amount: -card.Balance, Kind: journal.KindClose})
+	}
+	return nil
+}
+
+// MarkClosed deletes the card with the given number and flushes, so the
+// Backing has archived it when MarkClosed returns.
+func (e *Engine) MarkClosed(number string, closedAt time.Time) error {
+	if err := e.Delete(number); err != nil {
+		return err
+	}
+	return e.Flush()
+}
+
+// Marked returns no numbers: a card is archived as soon as it is marked.
+func (e *Engine) Marked() ([]string, error) {
+	return nil, nil
+}
+
+// Archive deletes the cards with the given numbers that are still open; the
+// Backing archives them with the next flush.
+func (e *Engine) Archive(numbers []string, closedAt time.Time) error {
+	for _, number := range numbers {
+		if err := e.Delete(number); err != nil && !errors.Is(err, store.ErrNotFound) {
+			return err
+		}
+	}
+	return nil
+}
+
+// Flush saves every change made so far. The snapshot is taken with all
+// stripes locked, so it never contains half of a transfer.
+func (e *Engine) Flush() error {
+	e.flushMu.Lock()
+	defer e.flushMu.Unlock()
+
+	var cards, closed []store.Card
+	for i := range e.stripes {
+		e.stripes[i].mu.Lock()
+	}
+	for i := range e.stripes {
+		s := &e.stripes[i]
+		for number := range s.dirty {
+			cards = append(cards, e.account(number).snapshot())
+		}
+		if len(s.dirty) > 0 {
+			s.dirty = make(map[string]struct{})
+		}
+		closed = append(closed, s.closed...)
+		s.closed = nil
+	}
+	e.mu.Lock()
+	entries := e.entries
+	e.entries = nil
+	e.drained.Broadcast()
+	e.mu.Unlock()
+	for i := range e.stripes {
+		e.stripes[i].mu.Unlock()
+	}
+
+	if len(cards) == 0 && len(closed) == 0 && len(entries) == 0 {
+		return nil
+	}
+	if err := e.backing.Save(cards, closed, entries); err != nil {
+		e.requeue(cards, closed, entries)
+		return err
+	}
+	return nil
+}
+
+// requeue marks the changes of a failed flush dirty again, so the next
+// flush retries them with the cards' current state.
+func (e *Engine) requeue(cards, closed []store.Card, entries []journal.Entry) {
+	for _, card := range cards {
+		s := e.stripeOf(card.Number)
+		s.mu.Lock()
+		if e.account(card.Number) != nil {
+			s.dirty[card.Number] = struct{}{}
+		}
+		s.mu.Unlock()
+	}
+	for _, card := range closed {
+		s := e.stripeOf(card.Number)
+		s.mu.Lock()
+		s.closed = append(s.closed, card)
+		s.mu.Unlock()
+	}
+
+	e.mu.Lock()
+	e.entries = append(entries, e.entries...)
+	e.mu.Unlock()
+}
+
+// Close stops the flusher and saves every remaining change.
+func (e *Engine) Close() error {
+	close(e.done)
+	<-e.stopped
+	return e.Flush()
+}
+
+// run flushes every FlushInterval, and early when the queue fills up.
+func (e *Engine) run() {
+	defer close(e.stopped)
+
+	ticker := time.NewTicker(e.options.FlushInterval)
+	defer ticker.Stop()
+	for {
+		select {
+		case <-ticker.C:
+		case <-e.kick:
+		case <-e.done:
+			return
+		}
+		if err := e.Flush(); err != nil {
+			log.Printf("failed to flush the in-memory store: %v", err)
+		}
+	}
+}
+
+// waitForRoom blocks while the journal queue is full. It is called before
+// any stripe is locked, since the flusher needs every stripe to drain the
+// queue; concurrent writers may therefore overshoot the bound by a few
+// entries.
+func (e *Engine) waitForRoom() {
+	e.mu.Lock()
+	defer e.mu.Unlock()
+
+	for len(e.entries) >= e.options.QueueSize {
+		e.flushSoon()
+		e.drained.Wait()
+	}
+}
+
+// record queues journal entries. The caller holds the stripe locks of the
+// cards the entries belong to.
+func (e *Engine) record(entries ...journal.Entry) {
+	now := time.Now()
+	for i := range entries {
+		entries[i].CreatedAt = now
+	}
+
+	e.mu.Lock()
+	defer e.mu.Unlock()
+
+	e.entries = append(e.entries, entries...)
+	if len(e.entries) >= e.options.QueueSize/2 {
+		e.flushSoon()
+	}
+}
+
+// flushSoon wakes the flusher without waiting for it.
+func (e *Engine) flushSoon() {
+	select {
+	case e.kick <- struct{}{}:
+	default:
+	}
+}
@@ -0,0 +1,429 @@
+package memstore
+
+import (
+	"errors"
+	"fmt"
+	"math/rand"
+	"reflect"
+	"runtime"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+
+	"stage4/journal"
+	"stage4/store"
+	"stage4/transfer"
+)
+
+// memoryBacking keeps what an Engine saves. If gate is set, Save waits for
+// it first.
+type memoryBacking struct {
+	mu       sync.Mutex
+	cards    map[string]store.Card
+	archived []store.Card
+	entries  []journal.Entry
+	gate     chan struct{}
+}
+
+func newMemoryBacking(cards int, balance int) *memoryBacking {
+	b := &memoryBacking{cards: make(map[string]store.Card)}
+	for i := 0; i < cards; i++ {
+		number := fmt.Sprintf("4000000%09d", i)
+		b.cards[number] = store.Card{Number: number, PIN: "1234", Balance: balance}
+	}
+	return b
+}
+
+func (b *memoryBacking) Load(fn func(card store.Card) error) error {
+	for _, card := range b.cards {
+		if err := fn(card); err != nil {
+			return err
+		}
+	}
+	return nil
+}
+
+func (b *memoryBacking) Save(cards, closed []store.Card, entries []journal.Entry) error {
+	if b.gate != nil {
+		<-b.gate
+	}
+	b.mu.Lock()
+	defer b.mu.Unlock()
+
+	for _, card := range closed {
+		delete(b.cards, card.Number)
+	}
+	b.archived = append(b.archived, closed...)
+	for _, card := range cards {
+		b.cards[card.Number] = card
+	}
+	b.entries = append(b.entries, entries...)
+	return nil
+}
+
+func (b *memoryBacking) balance(number string) int {
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	return b.cards[number].Balance
+}
+
+func (b *memoryBacking) total() int {
+	total := 0
+	for _, card := range b.cards {
+		total += card.Balance
+	}
+	return total
+}
+
+func TestConcurrentTransfersConserveMoney(t *testing.T) {
+	const cards, balance, workers, transfers = 16, 100, 8, 2000
+
+	backing := newMemoryBacking(cards, balance)
+	e, err := Open(backing, DefaultOptions)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	// A reader checks the balances without locks while the transfers run.
+	done := make(chan struct{})
+	reads := make(chan int)
+	go func() {
+		n := 0
+		defer func() { reads <- n }()
+		for {
+			select {
+			case <-done:
+				return
+			default:
+			}
+			number := fmt.Sprintf("4000000%09d", n%cards)
+			if balance, err := e.Balance(number); err != nil || balance < 0 {
+				t.Errorf("Balance(%s) = %d, %v during the transfers", number, balance, err)
+				return
+			}
+			n++
+		}
+	}()
+
+	var wg sync.WaitGroup
+	for w := 0; w < workers; w++ {
+		wg.Add(1)
+		go func(w int) {
+			defer wg.Done()
+			for i := 0; i < transfers; i++ {
+				from := fmt.Sprintf("4000000%09d", (w+i)%cards)
+				to := fmt.Sprintf("4000000%09d", (w+2*i+1)%cards)
+				if from == to {
+					continue
+				}
+				_, _, err := e.Transfer(from, to, 7)
+				if err != nil && !errors.Is(err, transfer.ErrInsufficientFunds) {
+					t.Error(err)
+					return
+				}
+			}
+		}(w)
+	}
+	wg.Wait()
+	close(done)
+	if <-reads == 0 {
+		t.Error("no balance was read during the transfers")
+	}
+
+	total := 0
+	for i := 0; i < cards; i++ {
+		b, err := e.Balance(fmt.Sprintf("4000000%09d", i))
+		if err != nil {
+			t.Fatal(err)
+		}
+		total += b
+	}
+	if total != cards*balance {
+		t.Errorf("balances read add up to %d after concurrent transfers, want %d", total, cards*balance)
+	}
+
+	if err := e.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if got, want := backing.total(), cards*balance; got != want {
+		t.Errorf("balances add up to %d after concurrent transfers, want %d", got, want)
+	}
+	for number, card := range backing.cards {
+		if card.Balance < 0 {
+			t.Errorf("card %s was overdrawn to %d", number, card.Balance)
+		}
+	}
+	sum := 0
+	for _, entry := range backing.entries {
+		sum += entry.Amount
+	}
+	if sum != 0 {
+		t.Errorf("transfer journal entries add up to %d, want 0", sum)
+	}
+}
+
+func TestCloseSavesOnlyChanges(t *testing.T) {
+	backing := newMemoryBacking(4, 0)
+	e, err := Open(backing, Options{FlushInterval: time.Hour})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	if err := e.Create(store.Card{Number: "4000009999999999", PIN: "0000"}); err != nil {
+		t.Fatal(err)
+	}
+	if err := e.Create(store.Card{Number: "4000009999999999", PIN: "0000"}); !errors.Is(err, store.ErrExists) {
+		t.Errorf("creating a duplicate card returned %v, want ErrExists", err)
+	}
+	if _, err := e.Credit("4000000000000000", 50); err != nil {
+		t.Fatal(err)
+	}
+	if err := e.Delete("4000000000000001"); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := e.Get("4000000000000001"); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("Get of a deleted card returned %v, want ErrNotFound", err)
+	}
+	if err := e.Delete("4000000000000001"); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("deleting a deleted card returned %v, want ErrNotFound", err)
+	}
+	// A card closed before it was ever saved is still archived.
+	if err := e.Create(store.Card{Number: "4000008888888888", PIN: "0000"}); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := e.Credit("4000008888888888", 10); err != nil {
+		t.Fatal(err)
+	}
+	if err := e.Archive([]string{"4000008888888888"}, time.Now()); err != nil {
+		t.Fatal(err)
+	}
+	if err := e.Close(); err != nil {
+		t.Fatal(err)
+	}
+
+	if _, ok := backing.cards["4000000000000001"]; ok {
+		t.Error("the deleted card was not removed from the backing store")
+	}
+	if backing.cards["4000000000000000"].Balance != 50 {
+		t.Errorf("the credited card was saved with balance %d, want 50", backing.cards["4000000000000000"].Balance)
+	}
+	if _, ok := backing.cards["4000009999999999"]; !ok {
+		t.Error("the created card was not saved")
+	}
+	if _, ok := backing.cards["4000008888888888"]; ok {
+		t.Error("a card closed before the flush was saved as open")
+	}
+	archived := make(map[string]int)
+	for _, card := range backing.archived {
+		archived[card.Number] = card.Balance
+	}
+	if want := map[string]int{"4000000000000001": 0, "4000008888888888": 10}; !reflect.DeepEqual(archived, want) {
+		t.Errorf("archived balances = %v, want %v", archived, want)
+	}
+	if len(backing.entries) != 3 || backing.entries[2].Kind != journal.KindClose || backing.entries[2].Amount != -10 {
+		t.Errorf("saved journal entries = %+v, want two income entries and the closure of a balance of 10",
+			backing.entries)
+	}
+}
+
+func TestMarkClosedArchivesAtOnce(t *testing.T) {
+	backing := newMemoryBacking(2, 30)
+	e, err := Open(backing, Options{FlushInterval: time.Hour})
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer e.Close()
+
+	if err := e.MarkClosed("4000000000000001", time.Now()); err != nil {
+		t.Fatal(err)
+	}
+	backing.mu.Lock()
+	archived := len(backing.archived)
+	backing.mu.Unlock()
+	if archived != 1 {
+		t.Errorf("%d cards archived when MarkClosed returned, want 1", archived)
+	}
+	if err := e.MarkClosed("4000000000000001", time.Now()); !errors.Is(err, store.ErrNotFound) {
+		t.Errorf("marking a closed card returned %v, want ErrNotFound", err)
+	}
+}
+
+func TestFlusherCoalescesChanges(t *testing.T) {
+	const credits = 100
+
+	backing := newMemoryBacking(1, 0)
+	var saves atomic.Int64
+	e, err := Open(&countingBacking{Backing: backing, saves: &saves}, Options{FlushInterval: 10 * time.Millisecond})
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer e.Close()
+
+	for i := 0; i < credits; i++ {
+		if _, err := e.Credit("4000000000000000", 1); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	deadline := time.Now().Add(5 * time.Second)
+	for backing.balance("4000000000000000") != credits {
+		if time.Now().After(deadline) {
+			t.Fatalf("the flusher saved balance %d within 5s, want %d", backing.balance("4000000000000000"), credits)
+		}
+		time.Sleep(time.Millisecond)
+	}
+	if n := saves.Load(); n >= credits {
+		t.Errorf("%d credits were saved in %d flushes, want them coalesced", credits, n)
+	}
+}
+
+func TestFullQueueBlocksWriters(t *testing.T) {
+	backing := newMemoryBacking(1, 0)
+	backing.gate = make(chan struct{})
+	e, err := Open(backing, Options{FlushInterval: time.Hour, QueueSize: 2})
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	// The flusher takes the first one or two entries and then waits at the
+	// gate; the next two fill the queue, so the fifth credit has to wait.
+	credited := make(chan struct{})
+	go func() {
+		defer close(credited)
+		for i := 0; i < 5; i++ {
+			if _, err := e.Credit("4000000000000000", 1); err != nil {
+				t.Error(err)
+			}
+		}
+	}()
+
+	select {
+	case <-credited:
+		t.Fatal("writers weren't held back by a full queue")
+	case <-time.After(50 * time.Millisecond):
+	}
+	close(backing.gate)
+	<-credited
+
+	if err := e.Close(); err != nil {
+		t.Fatal(err)
+	}
+	if got := backing.balance("4000000000000000"); got != 5 {
+		t.Errorf("balance saved after the queue drained = %d, want 5", got)
+	}
+	if len(backing.entries) != 5 {
+		t.Errorf("%d journal entries saved, want 5", len(backing.entries))
+	}
+}
+
+// countingBacking counts the calls to Save.
+type countingBacking struct {
+	Backing
+	saves *atomic.Int64
+}
+
+func (b *countingBacking) Save(cards, closed []store.Card, entries []journal.Entry) error {
+	b.saves.Add(1)
+	return b.Backing.Save(cards, closed, entries)
+}
+
+func BenchmarkTransfer(b *testing.B) {
+	const cards = 1024
+
+	e, err := Open(newMemoryBacking(cards, 1<<40), DefaultOptions)
+	if err != nil {
+		b.Fatal(err)
+	}
+	numbers := make([]string, cards)
+	for i := range numbers {
+		numbers[i] = fmt.Sprintf("4000000%09d", i)
+	}
+
+	// Every goroutine starts at a different card, so they don't all contend
+	// for the same stripes.
+	var workers atomic.Int64
+	b.ReportAllocs()
+	b.RunParallel(func(pb *testing.PB) {
+		i := int(workers.Add(1)) * 97
+		for pb.Next() {
+			if _, _, err := e.Transfer(numbers[i%cards], numbers[(i+1)%cards], 1); err != nil {
+				b.Error(err)
+				return
+			}
+			i++
+		}
+	})
+}
+
+// BenchmarkTransferScaling makes transfers between random pairs of cards on
+// 1 to 4×GOMAXPROCS goroutines. With a lock per stripe, throughput should
+// grow with the goroutines up to GOMAXPROCS and then hold.
+func BenchmarkTransferScaling(b *testing.B) {
+	const cards = 1 << 16
+
+	e, err := Open(newMemoryBacking(cards, 1<<40), Options{FlushInterval: time.Second, QueueSize: 1 << 20})
+	if err != nil {
+		b.Fatal(err)
+	}
+	defer e.Close()
+	numbers := make([]string, cards)
+	for i := range numbers {
+		numbers[i] = fmt.Sprintf("4000000%09d", i)
+	}
+
+	for goroutines := 1; goroutines <= 4*runtime.GOMAXPROCS(0); goroutines *= 2 {
+		b.Run(fmt.Sprintf("goroutines=%d", goroutines), func(b *testing.B) {
+			var wg sync.WaitGroup
+			b.ResetTimer()
+			for g := 0; g < goroutines; g++ {
+				wg.Add(1)
+				go func(g int) {
+					defer wg.Done()
+					rng := rand.New(rand.NewSource(int64(g)))
+					for i := g; i < b.N; i += goroutines {
+						from, to := rng.Intn(cards), rng.Intn(cards-1)
+						if to >= from {
+							to++
+						}
+						if _, _, err := e.Transfer(numbers[from], numbers[to], 1); err != nil {
+							b.Error(err)
+							return
+						}
+					}
+				}(g)
+			}
+			wg.Wait()
+			b.StopTimer()
+			b.ReportMetric(float64(b.N)/b.Elapsed().Seconds(), "transfers/s")
+		})
+	}
+}
+
+// BenchmarkBalance reads balances on every core while nothing else runs.
+// The reads take no lock, so they shouldn't slow each other down.
+func BenchmarkBalance(b *testing.B) {
+	const cards = 1024
+
+	e, err := Open(newMemoryBacking(cards, 100), DefaultOptions)
+	if err != nil {
+		b.Fatal(err)
+	}
+	defer e.Close()
+	numbers := make([]string, cards)
+	for i := range numbers {
+		numbers[i] = fmt.Sprintf("4000000%09d", i)
+	}
+
+	var workers atomic.Int64
+	b.RunParallel(func(pb *testing.PB) {
+		i := int(workers.Add(1)) * 97
+		for pb.Next() {
+			if _, err := e.Balance(numbers[i%cards]); err != nil {
+				b.Error(err)
+				return
+			}
+			i++
+		}
+	})
+}
@@ -0,0 +1,93 @@
+// Package store defines the storage interface of the banking system, so the
+// cards can be kept by GORM, by sqlx or in memory, selected at startup.
+package store
+
+import (
+	"errors"
+	"fmt"
+	"os"
+)
+
+// Names of the storage backends.
+const (
+	GORM   = "gorm"
+	SQLX   = "sqlx"
+	Memory = "memory"
+)
+
+// DefaultBackend returns the backend named by the BANK_STORE environment
+// variable, or GORM. It lets a test suite run against every backend without
+// changing the command lines it starts the program with.
+func DefaultBackend() string {
+	if name := os.Getenv("BANK_STORE"); name != "" {
+		return name
+	}
+	return GORM
+}
+
+// ValidateBackend checks that name is a known backend.
+func ValidateBackend(name string) error {
+	switch name {
+	case GORM, SQLX, Memory:
+		return nil
+	}
+	return fmt.Errorf("unknown store %q, expected %s, %s or %s", name, GORM, SQLX, Memory)
+}
+
+var (
+	ErrNotFound = errors.New("card not found")
+	ErrWrongPIN = errors.New("wrong PIN")
+	ErrExists   = errors.New("card already exists")
+)
+
+// Card is a row of the card table.
+type Card struct {
+	ID      uint   `gorm:"primaryKey" db:"id"`
+	Number  string `gorm:"unique;not null" db:"number"`
+	PIN     string `db:"pin"`
+	Balance int    `gorm:"default:0" db:"balance"`
+}
+
+func (Card) TableName() string {
+	return "card"
+}
+
+// Store keeps the cards and records every balance change in the journal
+// together with the change itself.
+type Store interface {
+	// Create stores a new card. It fails with ErrExists if the number is
+	// taken.
+	Create(card Card) error
+	// Get returns the card with the given number, or ErrNotFound.
+	Get(number string) (Card, error)
+	// Authenticate returns the card with the given number if verify accepts
+	// its stored PIN, ErrNotFound if there is no such card and ErrWrongPIN
+	// otherwise.
+	Authenticate(number string, verify func(storedPIN string) bool) (Card, error)
+	// Credit adds amount to the balance of a card and returns the updated
+	// card, or ErrNotFound.
+	Credit(number string, amount int) (Card, error)
+	// Transfer moves amount from one card to another and returns both
+	// updated cards. It fails with transfer.ErrInsufficientFunds rather than
+	// letting the sender's balance go negative, and with
+	// transfer.ErrUnknownCard if the receiver doesn't exist.
+	Transfer(from, to string, amount int) (sender, receiver Card, err error)
+	// Delete removes the card with the given number.
+	Delete(number string) error
+	// Close releases the store; stores that buffer writes flush them first.
+	Close() error
+}
+
+// BalanceReader is implemented by stores that read a balance without taking
+// any lock.
+type BalanceReader interface {
+	// Balance returns the balance of the card with the given number, or
+	// ErrNotFound.
+	Balance(number string) (int, error)
+}
+
+// Flusher is implemented by stores that buffer writes.
+type Flusher interface {
+	// Flush makes every write buffered so far durable.
+	Flush() error
+}
@@ -1,13 +1,14 @@
 package main
 
 import (
+	"flag"
 	"fmt"
 	"gorm.io/driver/sqlite"
 	"gorm.io/gorm"
 	"log"
 	"math/rand"
-	"strconv"
-	"strings"
+	"stage4/cardnumber"
+	"stage4/profiling"
 )
 
 type Card struct {
@@ -25,30 +26,8 @@ type BankingSystem struct {
 	db *gorm.DB
 }
 
-func (b *BankingSystem) generateLuhnChecksum(cardNumber string) string {
-	digits := strings.Split(cardNumber, "")
-	var checksum int
-	for i, digit := range digits {
-		d, err := strconv.Atoi(digit)
-		if err != nil {
-			log.Fatal(err)
-		}
-		if i%2 == 0 {
-			d *= 2
-			if d > 9 {
-				d -= 9
-			}
-		}
-		checksum += d
-	}
-	checkDigit := (10 - (checksum % 10)) % 10
-	return strconv.Itoa(checkDigit)
-}
-
 func (b *BankingSystem) generateCardNumber() string {
-	cardNumber := "400000" + fmt.Sprintf("%09d", rand.Intn(1000000000))
-	cardNumber += b.generateLuhnChecksum(cardNumber)
-	return cardNumber
+	return cardnumber.Generate(400000, uint64(rand.Intn(1000000000))).String()
 }
 
 func (*BankingSystem) checkBalance(card *Card) {
@@ -75,8 +54,7 @@ func (b *BankingSystem) transfer(card *Card) {
 		return
 	}
 
-	if anotherCardNumber[len(anotherCardNumber)-1:] !=
-		b.generateLuhnChecksum(anotherCardNumber[:len(anotherCardNumber)-1]) {
+	if !cardnumber.Valid(anotherCardNumber) {
 		fmt.Println("Probably you made a mistake in the card number. Please try again!")
 		return
 	}
@@ -208,6 +186,15 @@ func (b *BankingSystem) start() {
 }
 
 func main() {
+	profile := profiling.RegisterFlags(flag.CommandLine)
+	flag.Parse()
+
+	stopProfiling, err := profile.Start()
+	if err != nil {
+		log.Fatal(err)
+	}
+	defer stopProfiling()
+
 	db, err := gorm.Open(sqlite.Open("card.s3db"), &gorm.Config{})
 	if err != nil {
 		log.Fatal(err)
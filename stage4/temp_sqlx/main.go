@@ -1,50 +1,30 @@
 package main
 
 import (
+	"errors"
+	"flag"
 	"fmt"
-	"github.com/jmoiron/sqlx"
-	_ "github.com/mattn/go-sqlite3"
 	"log"
 	"math/rand"
-	"strconv"
-	"strings"
+	"stage4/auth"
+	"stage4/cardnumber"
+	"stage4/metrics"
+	"stage4/pool"
+	"stage4/profiling"
+	"stage4/sqlxstore"
+	"stage4/store"
+	"stage4/transfer"
 )
 
-type Card struct {
-	ID      int    `db:"id"`
-	Number  string `db:"number"`
-	PIN     string `db:"pin"`
-	Balance int    `db:"balance"`
-}
+type Card = sqlxstore.Card
 
 type BankingSystem struct {
-	db *sqlx.DB
-}
-
-func (b *BankingSystem) generateLuhnChecksum(cardNumber string) string {
-	digits := strings.Split(cardNumber, "")
-	var checksum int
-	for i, digit := range digits {
-		d, err := strconv.Atoi(digit)
-		if err != nil {
-			log.Fatal(err)
-		}
-		if i%2 == 0 {
-			d *= 2
-			if d > 9 {
-				d -= 9
-			}
-		}
-		checksum += d
-	}
-	checkDigit := (10 - (checksum % 10)) % 10
-	return strconv.Itoa(checkDigit)
+	repo      *sqlxstore.Repository
+	transfers *transfer.Pipeline
 }
 
 func (b *BankingSystem) generateCardNumber() string {
-	cardNumber := "400000" + fmt.Sprintf("%09d", rand.Intn(999999999))
-	cardNumber += b.generateLuhnChecksum(cardNumber)
-	return cardNumber
+	return cardnumber.Generate(400000, uint64(rand.Intn(1000000000))).String()
 }
 
 func (*BankingSystem) checkBalance(card *Card) {
@@ -56,10 +36,11 @@ func (b *BankingSystem) addIncome(card *Card) {
 	var income int
 	fmt.Scanln(&income)
 
-	if _, err := b.db.Exec(
-		"UPDATE card SET balance = balance + ? WHERE number = ?", income, card.Number); err != nil {
+	updated, err := b.repo.Credit(card.Number, income)
+	if err != nil {
 		log.Fatal(err)
 	}
+	*card = updated
 	fmt.Println("Income was added!")
 }
 
@@ -68,21 +49,8 @@ func (b *BankingSystem) transfer(card *Card) {
 	var anotherCardNumber string
 	fmt.Scanln(&anotherCardNumber)
 
-	if card.Number == anotherCardNumber {
-		fmt.Println("You can't transfer money to the same account!")
-		return
-	}
-
-	if anotherCardNumber[len(anotherCardNumber)-1:] !=
-		b.generateLuhnChecksum(anotherCardNumber[:len(anotherCardNumber)-1]) {
-		fmt.Println("Probably you made a mistake in the card number. Please try again!")
-		return
-	}
-
-	var anotherCard Card
-	err := b.db.Get(&anotherCard, "SELECT * FROM card WHERE number = ?", anotherCardNumber)
-	if err != nil {
-		fmt.Println("Such a card does not exist.")
+	if err := b.transfers.ValidateTarget(card.Number, anotherCardNumber); err != nil {
+		printTransferError(err)
 		return
 	}
 
@@ -90,52 +58,38 @@ func (b *BankingSystem) transfer(card *Card) {
 	var amount int
 	_, _ = fmt.Scanln(&amount)
 
-	tx, err := b.db.Beginx()
-	if err != nil {
-		log.Fatal(err)
-	}
-
-	err = b.db.Get(card, "SELECT * FROM card WHERE number = ?", card.Number)
-	if err != nil {
-		err := tx.Rollback()
-		if err != nil {
-			log.Fatal(err)
-		}
-		log.Fatal(err)
-	}
-
-	if card.Balance < amount {
-		fmt.Println("Not enough money!")
-		err := tx.Rollback()
-		if err != nil {
-			log.Fatal(err)
-		}
+	if err := b.transfers.ValidateAmount(card.Balance, amount); err != nil {
+		printTransferError(err)
 		return
 	}
 
-	_, err = tx.Exec("UPDATE card SET balance = balance - ? WHERE number = ?", amount, card.Number)
-	if err != nil {
-		err := tx.Rollback()
-		if err != nil {
-			log.Fatal(err)
-		}
-		log.Fatal(err)
+	updated, _, err := b.repo.Transfer(card.Number, anotherCardNumber, amount)
+	if errors.Is(err, transfer.ErrUnknownCard) {
+		b.transfers.Closed(anotherCardNumber)
 	}
-
-	_, err = tx.Exec("UPDATE card SET balance = balance + ? WHERE number = ?", amount, anotherCardNumber)
 	if err != nil {
-		err := tx.Rollback()
-		if err != nil {
-			log.Fatal(err)
-		}
-		log.Fatal(err)
+		printTransferError(err)
+		return
 	}
+	*card = updated
+	fmt.Println("Success!")
+}
 
-	err = tx.Commit()
-	if err != nil {
+func printTransferError(err error) {
+	switch {
+	case errors.Is(err, transfer.ErrSameAccount):
+		fmt.Println("You can't transfer money to the same account!")
+	case errors.Is(err, transfer.ErrMalformedNumber):
+		fmt.Println("Probably you made a mistake in the card number. Please try again!")
+	case errors.Is(err, transfer.ErrUnknownCard):
+		fmt.Println("Such a card does not exist.")
+	case errors.Is(err, transfer.ErrInvalidAmount):
+		fmt.Println("The amount must be a positive number!")
+	case errors.Is(err, transfer.ErrInsufficientFunds):
+		fmt.Println("Not enough money!")
+	default:
 		log.Fatal(err)
 	}
-	fmt.Println("Success!")
 }
 
 func (b *BankingSystem) createAccount() {
@@ -144,13 +98,11 @@ func (b *BankingSystem) createAccount() {
 		PIN:     fmt.Sprintf("%04d", rand.Intn(10000)),
 		Balance: 0,
 	}
-	_, err := b.db.Exec("INSERT INTO card (number, pin, balance) VALUES (?, ?, ?)",
-		card.Number, card.PIN, card.Balance)
-
-	if err != nil {
+	if err := b.repo.Create(card); err != nil {
 		fmt.Println("Failed to create account!")
 		return
 	}
+	b.transfers.Created(card.Number)
 
 	fmt.Println("Your card has been created")
 	fmt.Println("Your card number:")
@@ -160,9 +112,10 @@ func (b *BankingSystem) createAccount() {
 }
 
 func (b *BankingSystem) closeAccount(card *Card) {
-	if _, err := b.db.Exec("DELETE FROM card WHERE number = ? AND pin = ?", card.Number, card.PIN); err != nil {
+	if err := b.repo.Delete(card.Number); err != nil {
 		log.Fatal(err)
 	}
+	b.transfers.Closed(card.Number)
 	fmt.Println("The account has been closed!")
 }
 
@@ -175,12 +128,16 @@ func (b *BankingSystem) login() {
 	var pin string
 	fmt.Scanln(&pin)
 
-	var card Card
-	err := b.db.Get(&card, "SELECT * FROM card WHERE number = ? AND pin = ?", number, pin)
-	if err != nil {
+	card, err := b.repo.Authenticate(number, func(storedPIN string) bool {
+		return auth.Verify(pin, storedPIN)
+	})
+	if errors.Is(err, store.ErrNotFound) || errors.Is(err, store.ErrWrongPIN) {
 		fmt.Println("Wrong card number or PIN!")
 		return
 	}
+	if err != nil {
+		log.Fatal(err)
+	}
 	fmt.Println("You have successfully logged in!")
 	b.accountOperations(&card)
 }
@@ -212,19 +169,10 @@ func (b *BankingSystem) accountOperations(card *Card) {
 	}
 }
 
-func (b *BankingSystem) createCardTable() {
-	if _, err := b.db.Exec(`CREATE TABLE IF NOT EXISTS card (
-	id INTEGER PRIMARY KEY,
-	number TEXT,
-	pin TEXT,
-	balance INTEGER DEFAULT 0
-	)`); err != nil {
+func (b *BankingSystem) start() {
+	if err := b.repo.Migrate(); err != nil {
 		log.Fatal(err)
 	}
-}
-
-func (b *BankingSystem) start() {
-	b.createCardTable()
 
 	for {
 		fmt.Println("1. Create an account\n2. Log into account\n0. Exit")
@@ -245,12 +193,42 @@ func (b *BankingSystem) start() {
 }
 
 func main() {
-	db, err := sqlx.Connect("sqlite3", "card.s3db")
+	fileName := flag.String("fileName", "card.s3db", "path of the SQLite database")
+	metricsFile := flag.String("metrics", "", "write the connection pool statistics to this file on exit")
+	poolFlags := pool.RegisterFlags(flag.CommandLine)
+	profile := profiling.RegisterFlags(flag.CommandLine)
+	flag.Parse()
+
+	poolConfig, err := poolFlags.Config()
+	if err != nil {
+		log.Fatal(err)
+	}
+
+	stopProfiling, err := profile.Start()
+	if err != nil {
+		log.Fatal(err)
+	}
+	defer stopProfiling()
+
+	repo, err := sqlxstore.Open(*fileName, poolConfig)
 	if err != nil {
 		log.Fatal(err)
 	}
-	defer db.Close()
+	defer repo.Close()
+
+	registry := metrics.NewRegistry()
+	registry.AddPool("writer", repo.Pools().Writer.Stats)
+	registry.AddPool("reader", repo.Pools().Reader.Stats)
 
-	bankingSystem := &BankingSystem{db: db}
+	bankingSystem := &BankingSystem{
+		repo:      repo,
+		transfers: transfer.NewPipeline("400000", repo.CardExists, transfer.DefaultNegativeTTL),
+	}
 	bankingSystem.start()
+
+	if *metricsFile != "" {
+		if err := registry.DumpFile(*metricsFile); err != nil {
+			log.Printf("failed to dump metrics: %v", err)
+		}
+	}
 }
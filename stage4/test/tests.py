@@ -1,23 +1,459 @@
+import atexit
+import contextlib
+import functools
+import hashlib
+import json
+import math
 import os
+import queue
 import random
 import re
 import shutil
 import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 from hstest import dynamic_test, StageTest, CheckResult, TestedProgram
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The golden-output scenarios at the root of the course are shared by every stage.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+import scenarios  # noqa: E402
+
+
+class WarmSession:
+    """A banking program kept running across dynamic tests.
+
+    hstest stops every TestedProgram at the end of its test, so tests that
+    don't check how the program starts or exits share this subprocess instead
+    and skip a build, a start and a migration each. execute() mirrors
+    TestedProgram.execute(): it sends the input and returns the output up to
+    the point where the program waits for input again. Tests isolate their
+    state by creating fresh cards rather than by deleting rows.
+    """
+
+    # Lines the program prints right before it reads input.
+    prompts = ('0. Exit', 'Enter your card number:', 'Enter your PIN:', 'Enter income:', 'Enter card number:',
+               'Enter how much money you want to transfer:')
+
+    # The operation an input starts, by the menu it is chosen from or the
+    # prompt it answers.
+    main_menu_operations = {'1': 'CreateAccount', '2': 'Login', '0': 'Exit'}
+    account_menu_operations = {'1': 'Balance', '2': 'AddIncome', '3': 'DoTransfer', '4': 'CloseAccount',
+                               '5': 'Logout', '0': 'Exit'}
+    prompt_operations = {'Enter your card number:': 'Login', 'Enter your PIN:': 'Login', 'Enter income:': 'AddIncome',
+                         'Enter card number:': 'DoTransfer', 'Enter how much money you want to transfer:': 'DoTransfer'}
+
+    def __init__(self, command, logout_option, timeout=10, recorder=None):
+        self.logout_option = logout_option
+        self.timeout = timeout
+        self.recorder = recorder
+        self.last_prompt = None
+        self.in_account_menu = False
+        # Logins refused or slowed down by the failed-login limiter.
+        self.throttled = 0
+        self.lines = queue.Queue()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, text=True, bufsize=1)
+        threading.Thread(target=self.read_output, daemon=True).start()
+        self.read_until_prompts(1)
+
+    def read_output(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def read_until_prompts(self, count):
+        output = []
+        previous = ''
+        while count > 0:
+            try:
+                line = self.lines.get(timeout=self.timeout)
+            except queue.Empty:
+                raise Exception(f"The program didn't ask for input within {self.timeout}s:\n" + ''.join(output))
+            if line is None:
+                raise Exception("The program exited in the middle of a shared session:\n" + ''.join(output))
+            output.append(line)
+            stripped = line.strip()
+            if stripped in self.prompts:
+                count -= 1
+                self.last_prompt = stripped
+                self.in_account_menu = stripped == '0. Exit' and 'log out' in previous.lower()
+            previous = stripped
+        return ''.join(output)
+
+    def execute(self, text):
+        operation = self.operation(text)
+        start = time.perf_counter()
+        self.process.stdin.write(text + '\n')
+        self.process.stdin.flush()
+        output = self.read_until_prompts(text.count('\n') + 1)
+        if 'too many failed attempts' in output.lower():
+            self.throttled += 1
+        if self.recorder is not None:
+            self.recorder.record(operation, time.perf_counter() - start)
+        return output
+
+    def operation(self, text):
+        if self.last_prompt != '0. Exit':
+            return self.prompt_operations.get(self.last_prompt, 'Other')
+        menu = self.account_menu_operations if self.in_account_menu else self.main_menu_operations
+        operation = menu.get(text.split('\n', 1)[0], 'Other')
+        # A choice that only opens a prompt is navigation; the operation is
+        # timed when the prompt is answered.
+        if '\n' not in text and operation in self.prompt_operations.values():
+            return 'Menu'
+        return operation
+
+    # Brings the program back to the main menu, logging out or answering an
+    # open prompt with an empty line.
+    def reset(self):
+        while self.in_account_menu or self.last_prompt != '0. Exit':
+            self.execute(self.logout_option if self.in_account_menu else '')
+
+    def close(self):
+        if self.process.poll() is not None:
+            return
+        try:
+            self.reset()
+            self.process.stdin.write('0\n')
+            self.process.stdin.close()
+            self.process.wait(timeout=self.timeout)
+        except Exception:
+            self.process.kill()
+
+
+class PerformanceRecorder:
+    """Collects the latency of every WarmSession execute() by operation, and
+    the wall time, executes and SQL statements of every measured test.
+
+    Unless trend_file is None, the summary of the run is appended to that
+    JSON file at exit, together with the seed the run can be replayed with
+    and the operations and tests that got slower since the previous run.
+    """
+
+    # How many times slower than in the previous run an operation or a test
+    # may get before the trend file flags it.
+    regression_tolerance = 1.25
+    # Number of runs kept in the trend file.
+    trend_length = 100
+
+    def __init__(self, trend_file, seed=None):
+        self.trend_file = trend_file
+        self.seed = seed
+        self.latencies = {}
+        self.tests = {}
+        self.current = None
+        if trend_file is not None:
+            atexit.register(self.write_trend)
+
+    def record(self, operation, seconds):
+        self.latencies.setdefault(operation, []).append(seconds)
+        if self.current is not None:
+            self.current['executes'] += 1
+            self.current['latencies'].setdefault(operation, []).append(seconds)
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        self.current = {'executes': 0, 'latencies': {}, 'statements': None}
+        start = time.perf_counter()
+        try:
+            yield self.current
+        finally:
+            self.current['wall_seconds'] = time.perf_counter() - start
+            self.tests[name] = self.current
+            self.current = None
+
+    @staticmethod
+    def quantile(samples, q):
+        ordered = sorted(samples)
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+    # Returns a message for every operation whose p99 in latencies is over
+    # its budget in milliseconds.
+    def over_budget(self, latencies, budgets):
+        messages = []
+        for operation, budget in budgets.items():
+            samples = latencies.get(operation)
+            if not samples:
+                continue
+            p99 = self.quantile(samples, 0.99) * 1000
+            if p99 > budget:
+                messages.append(f"{operation} took {p99:.2f} ms at p99 over {len(samples)} executes, "
+                                f"the budget is {budget} ms.")
+        return messages
+
+    def summary(self):
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': self.seed,
+            'operations': {operation: {'count': len(samples),
+                                       'p50_ms': self.quantile(samples, 0.5) * 1000,
+                                       'p99_ms': self.quantile(samples, 0.99) * 1000}
+                           for operation, samples in sorted(self.latencies.items())},
+            'tests': {name: {'wall_seconds': test['wall_seconds'], 'executes': test['executes'],
+                             'statements': test['statements']}
+                      for name, test in self.tests.items()},
+        }
+
+    def regressions(self, previous, run):
+        flagged = []
+        for operation, stats in run['operations'].items():
+            before = previous['operations'].get(operation)
+            if before and stats['p99_ms'] > before['p99_ms'] * self.regression_tolerance:
+                flagged.append(f"{operation} p99 went from {before['p99_ms']:.2f} ms to {stats['p99_ms']:.2f} ms")
+        for name, stats in run['tests'].items():
+            before = previous['tests'].get(name)
+            if before and stats['wall_seconds'] > before['wall_seconds'] * self.regression_tolerance:
+                flagged.append(f"{name} went from {before['wall_seconds']:.2f}s to {stats['wall_seconds']:.2f}s")
+        return flagged
+
+    def write_trend(self):
+        if not self.latencies and not self.tests:
+            return
+        runs = []
+        if os.path.exists(self.trend_file):
+            with open(self.trend_file) as file:
+                runs = json.load(file)['runs']
+
+        run = self.summary()
+        run['regressions'] = self.regressions(runs[-1], run) if runs else []
+        runs.append(run)
+        os.makedirs(os.path.dirname(self.trend_file) or '.', exist_ok=True)
+        with open(self.trend_file, 'w') as file:
+            json.dump({'runs': runs[-self.trend_length:]}, file, indent=2)
+
+
+def measured(test):
+    """Records the wall time and executes of a test in its performance recorder."""
+    @functools.wraps(test)
+    def wrapper(self):
+        with self.performance.measure(test.__name__):
+            return test(self)
+    return wrapper
+
+
+def seeded(test):
+    """Seeds the random choices of a test, and through BANK_SEED the card
+    numbers and PINs of the programs it starts, from the seed of the suite
+    and the name of the test, so the test replays the same whichever tests
+    ran before it."""
+    @functools.wraps(test)
+    def wrapper(self):
+        seed = self.test_seed(test.__name__)
+        random.seed(seed)
+        previous = os.environ.get('BANK_SEED')
+        os.environ['BANK_SEED'] = str(seed)
+        try:
+            return test(self)
+        finally:
+            if previous is None:
+                del os.environ['BANK_SEED']
+            else:
+                os.environ['BANK_SEED'] = previous
+    return wrapper
+
+
+class DatabaseFactory:
+    """Builds template card databases once and clones them for tests.
+
+    The schema is taken from a database the banking program created itself,
+    so the templates follow its migrations. Templates are cached in cache_dir
+    under a hash of that schema and outlive the test run; a clone is a reflink
+    of the template where the file system supports it and an SQLite backup
+    otherwise. Card i of every template is card(i).
+    """
+
+    populations = {'empty': 0, '1k': 10 ** 3, '10k': 10 ** 4, '100k': 10 ** 5, '1m': 10 ** 6}
+    # Bump when card() changes, so cached templates are rebuilt.
+    layout_version = 1
+    # ioctl request cloning a whole file on Linux (btrfs, XFS).
+    FICLONE = 0x40049409
+
+    # Luhn sums of every three-digit block, with the outer digits doubled and
+    # with the middle digit doubled.
+    doubled_outside = [sum((2 * d - 9 if 2 * d > 9 else 2 * d) if i != 1 else d
+                           for i, d in enumerate(map(int, f'{block:03d}'))) for block in range(1000)]
+    doubled_inside = [sum((2 * d - 9 if 2 * d > 9 else 2 * d) if i == 1 else d
+                          for i, d in enumerate(map(int, f'{block:03d}'))) for block in range(1000)]
+
+    def __init__(self, binary, cache_dir=os.path.join(tempfile.gettempdir(), 'banking-system-templates')):
+        self.binary = binary
+        self.cache_dir = cache_dir
+        self.schema_database = None
+        self.schema_hash = None
+        self.journal_mode = None
+
+    @classmethod
+    def card(cls, i):
+        """Returns the number, PIN and balance of card i of a template."""
+        account = i % 10 ** 9
+        # 400000 contributes 8 to the Luhn sum, and the digits of the account
+        # number alternate between doubled and not starting with the first.
+        total = 8 + cls.doubled_outside[account // 10 ** 6] + cls.doubled_inside[account // 1000 % 1000] + \
+            cls.doubled_outside[account % 1000]
+        return f'400000{account:09d}{-total % 10}', f'{i % 10000:04d}', 100 * (i % 1000)
+
+    def clone(self, population, destination):
+        """Replaces destination with a copy of the template of a population."""
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(destination + suffix):
+                os.remove(destination + suffix)
+        self.copy(self.template(population), destination)
+        return destination
+
+    def template(self, population):
+        self.load_schema()
+        path = os.path.join(self.cache_dir, f'{self.schema_hash}-{population}.s3db')
+        if not os.path.exists(path):
+            self.build(path, self.populations[population])
+        return path
+
+    # Lets the program create an empty database and hashes its schema.
+    def load_schema(self):
+        if self.schema_hash is not None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        directory = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        database = os.path.join(directory, 'schema.s3db')
+        subprocess.run([self.binary, '-fileName', database], input='0\n', capture_output=True, text=True,
+                       check=True, timeout=60)
+
+        connection = sqlite3.connect(database)
+        schema = connection.execute("SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL "
+                                    "ORDER BY type, name").fetchall()
+        auto_vacuum = connection.execute("PRAGMA auto_vacuum").fetchone()
+        self.journal_mode, = connection.execute("PRAGMA journal_mode").fetchone()
+        connection.close()
+
+        digest = hashlib.sha256(repr((self.layout_version, auto_vacuum, self.journal_mode, schema)).encode())
+        self.schema_database, self.schema_hash = database, digest.hexdigest()[:16]
+
+    def build(self, path, count):
+        building = f'{path}.{os.getpid()}.tmp'
+        self.copy(self.schema_database, building)
+        connection = sqlite3.connect(building)
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        with connection:
+            connection.executemany("INSERT INTO card (id, number, pin, balance) VALUES (?, ?, ?, ?)",
+                                   ((i + 1, *self.card(i)) for i in range(count)))
+        # Hand the template back in the journal mode the program chose: in WAL
+        # mode readers of a clone don't block its writer.
+        connection.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        connection.close()
+        os.replace(building, path)
+
+    @classmethod
+    def copy(cls, source, destination):
+        if fcntl is not None:
+            with open(source, 'rb') as src, open(destination, 'wb') as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), cls.FICLONE, src.fileno())
+                    return
+                except OSError:
+                    pass
+        source_connection = sqlite3.connect(source)
+        destination_connection = sqlite3.connect(destination)
+        source_connection.backup(destination_connection)
+        destination_connection.close()
+        source_connection.close()
+
 
 class SimpleBankSystemTest(StageTest):
     database_file_name = 'card.s3db'
     temp_database_file_name = 'tempDatabase.s3db'
     args = ['-fileName', database_file_name]
+    logout_option = '5'
     table_name = 'cards'
     correct_data = {}
 
     card_number_pattern = re.compile(r'^400000\d{10}$', re.MULTILINE)
     pin_pattern = re.compile(r'^\d{4}$', re.MULTILINE)
 
+    metrics_file_name = 'metrics.txt'
+    stress_database_file_name = 'stress.s3db'
+    sqlx_variant_source = os.path.join('temp_sqlx', 'main.go')
+    benchmark_results_dir = 'benchmark_results'
+    # Seed of the seeded tests, from BANK_SEED or drawn for the run. It is
+    # kept in the performance trend, so any run can be replayed exactly.
+    seed = int(os.environ.get('BANK_SEED') or random.randrange(1, 2 ** 31))
+    performance = PerformanceRecorder(os.path.join(benchmark_results_dir, 'performance_trend.json'), seed)
+    metric_line_pattern = re.compile(r'^(\w+)\{(.*)\} (\d+)$')
+    metric_label_pattern = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+    # p99 latency budgets of the banking operations, in milliseconds
+    operation_latency_budgets = {
+        'CreateAccount': 50,
+        'Login': 50,
+        'AddIncome': 50,
+        'DoTransfer': 50,
+        'CloseAccount': 50,
+    }
+    # p99 budgets of one WarmSession execute() at 10^5 cards, in milliseconds:
+    # the work of the program plus the round trip through its stdin and stdout.
+    execute_latency_budgets = {
+        'CreateAccount': 5,
+        'Login': 5,
+        'Balance': 5,
+        'AddIncome': 5,
+        'DoTransfer': 5,
+    }
+    # Budget of SQL statements per execute() at 10^5 cards, on average.
+    statements_per_execute_budget = 5
+    # Populations of the scale tier. An operation's median latency may grow
+    # logarithmically with the number of cards, times a factor for noise and
+    # plus a slack in milliseconds, before the tier fails.
+    scale_populations = ('10k', '100k', '1m')
+    # Login scenarios of a scale round. The failed logins are on fresh cards,
+    # so the limiter never refuses one per card, and the tier sizes the
+    # session budget for the failing scenarios with -sessionBurst.
+    scale_scenarios = ('log_in_and_log_out', 'log_in_with_wrong_pin', 'log_in_to_not_existing_account', 'balance')
+    scale_failing_scenarios = ('log_in_with_wrong_pin', 'log_in_to_not_existing_account')
+    scale_growth_tolerance = 2.0
+    scale_growth_slack_ms = 1.0
+    # Slowest income a session may take while a report runs over 10^6 cards.
+    report_writer_stall_budget_ms = 50
+    # Longest an import of 10^6 cards may take, and the most memory it may use.
+    import_time_budget_seconds = 60
+    import_memory_budget_mb = 128
+    # Goroutines and transfers of the concurrent run of the in-memory ledger.
+    ledger_goroutines = 8
+    ledger_transfers = 200000
+    # Exits of the shutdown test and the accounts created before each. The
+    # median start of the last exits may exceed the first ones' by a factor
+    # for noise plus a slack in milliseconds, and a shutdown must finish
+    # within the default -shutdownTimeout plus the time to flush.
+    shutdown_cycles = 40
+    shutdown_accounts_per_cycle = 20
+    startup_growth_tolerance = 1.5
+    startup_growth_slack_ms = 20
+    shutdown_budget_ms = 2500
+    # Git revision the comparison mode benchmarks this build against, from
+    # BANK_BASELINE; without one the comparison is skipped. Both builds
+    # replay the same seeded scale rounds on fresh clones, alternating which
+    # goes first, after a discarded warm-up run each. The rounds leave out
+    # the failed logins: baselines from before the limiter throttled per card
+    # would refuse valid logins after a burst of them, and the comparison
+    # would time their refusals.
+    baseline_revision = os.environ.get('BANK_BASELINE')
+    comparison_population = '100k'
+    comparison_rounds = 50
+    comparison_repetitions = 6
+    comparison_resamples = 1000
+    comparison_scenarios = ('log_in_and_log_out', 'balance')
+
     connection = None
+    session = None
+    factory = None
 
     @dynamic_test(time_limit=60000)
     def test1_check_database_file(self):
@@ -187,128 +623,51 @@ class SimpleBankSystemTest(StageTest):
         return CheckResult.correct()
 
     @dynamic_test(time_limit=60000)
+    @seeded
+    @measured
     def test6_check_log_in(self):
-        program = TestedProgram()
-        program.start(*self.args)
-
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-
-        if not card_number_matcher:
-            return CheckResult.wrong("You are printing the card number " +
-                                     "incorrectly. The card number should look like in the example:" +
-                                     " 400000DDDDDDDDDD, where D is a digit.")
-
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not pin_matcher:
-            return CheckResult.wrong("You are printing the card PIN " +
-                                     "incorrectly. The PIN should look like in the example: DDDD, where D is a digit.")
-
-        correct_pin = pin_matcher.group().strip()
-        correct_card_number = card_number_matcher.group()
+        program = self.warm_session()
 
-        program.execute("2")
-        output = program.execute(correct_card_number + "\n" + correct_pin)
-
-        if "successfully" not in output.lower():
-            return CheckResult.wrong("The user should be signed in after" +
-                                     " entering the correct card information.")
-
-        self.stop_and_check_if_user_program_was_stopped(program)
+        result = scenarios.load('log_in_and_log_out').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
         return CheckResult.correct()
 
     @dynamic_test(time_limit=60000)
+    @seeded
+    @measured
     def test7_check_log_in_with_wrong_pin(self):
-        program = TestedProgram()
-        program.start(*self.args)
-
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not card_number_matcher or not pin_matcher:
-            return CheckResult.wrong("You should output card number and PIN like in example")
-
-        correct_card_number = card_number_matcher.group()
-        correct_pin = pin_matcher.group()
-
-        incorrect_pin = correct_pin
-
-        while correct_pin == incorrect_pin:
-            incorrect_pin = str(1000 + random.randint(0, 8999))
-
-        program.execute("2")
-        output = program.execute(correct_card_number + "\n" + incorrect_pin)
+        program = self.warm_session()
 
-        if "successfully" in output.lower():
-            return CheckResult.wrong("The user should not be signed in" +
-                                     " after entering incorrect card information.")
+        result = scenarios.load('log_in_with_wrong_pin').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
-        self.stop_and_check_if_user_program_was_stopped(program)
         return CheckResult.correct()
 
     @dynamic_test(time_limit=60000)
+    @seeded
+    @measured
     def test8_check_log_in_to_not_existing_account(self):
-        program = TestedProgram()
-        program.start(*self.args)
-
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not card_number_matcher or not pin_matcher:
-            return CheckResult.wrong("You should output card number and PIN like in example")
-
-        correct_card_number = card_number_matcher.group()
-
-        random.seed()
-
-        correct_pin = pin_matcher.group().strip()
-        incorrect_card_number = correct_card_number
+        program = self.warm_session()
 
-        while correct_card_number == incorrect_card_number:
-            incorrect_card_number = '400000' + str(100000000 + random.randint(0, 800000000))
+        result = scenarios.load('log_in_to_not_existing_account').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
-        program.execute("2")
-        output = program.execute(incorrect_card_number + "\n" + correct_pin)
-
-        if "successfully" in output.lower():
-            return CheckResult.wrong("The user should not be signed in" +
-                                     " after entering incorrect card information.")
-
-        self.stop_and_check_if_user_program_was_stopped(program)
         return CheckResult.correct()
 
     @dynamic_test(time_limit=60000)
+    @seeded
+    @measured
     def test9_check_balance(self):
-        program = TestedProgram()
-        program.start(*self.args)
-
-        output = program.execute("1")
-
-        card_number_matcher = self.card_number_pattern.search(output)
-        pin_matcher = self.pin_pattern.search(output)
-
-        if not card_number_matcher or not pin_matcher:
-            return CheckResult.wrong("You should output card number and PIN like in example")
-
-        correct_pin = pin_matcher.group().strip()
-        correct_card_number = card_number_matcher.group()
-
-        program.execute("2")
-        program.execute(correct_card_number + "\n" + correct_pin)
+        program = self.warm_session()
 
-        output = program.execute("1")
-
-        if "0" not in output:
-            return CheckResult.wrong("Expected balance: 0")
+        result = scenarios.load('balance').run(program, logout=self.logout_option)
+        if result.error:
+            return CheckResult.wrong(result.error)
 
-        self.stop_and_check_if_user_program_was_stopped(program)
         return CheckResult.correct()
 
     #     @DynamicTest(timeLimit = 60000)
@@ -651,6 +1010,1425 @@ class SimpleBankSystemTest(StageTest):
         self.close_connection()
         return CheckResult.correct()
 
+    @dynamic_test(time_limit=60000)
+    def test13_check_journal_replay(self):
+        self.delete_all_rows()
+
+        program = TestedProgram()
+        program.start(*self.args, '-checkpointInterval', '3')
+
+        output = program.execute("1")
+        card_number_matcher = self.card_number_pattern.search(output)
+
+        if not card_number_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+
+        to_transfer_card_number = card_number_matcher.group()
+
+        output = program.execute("1")
+        card_number_matcher = self.card_number_pattern.search(output)
+        pin_matcher = self.pin_pattern.search(output)
+
+        if not card_number_matcher or not pin_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+
+        correct_pin = pin_matcher.group().strip()
+        correct_card_number = card_number_matcher.group()
+
+        output = program.execute("1")
+        card_number_matcher = self.card_number_pattern.search(output)
+        if not card_number_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+        untouched_card_number = card_number_matcher.group()
+
+        program.execute("2")
+        program.execute(correct_card_number + "\n" + correct_pin)
+        program.execute("2\n20000")
+        program.execute("3\n" + to_transfer_card_number + "\n5000")
+        program.execute("2\n700")
+        program.execute("3\n" + to_transfer_card_number + "\n1200")
+        program.execute("4")
+        self.stop_and_check_if_user_program_was_stopped(program)
+
+        replayed = self.replay_journal()
+        if replayed is None:
+            return CheckResult.wrong("The replay command should print one '<card number> <balance>' line per "
+                                     "account and stop afterwards.")
+
+        if correct_card_number in replayed:
+            return CheckResult.wrong("The replay shouldn't rebuild the balance of a closed account.")
+        for card_number in (to_transfer_card_number, untouched_card_number):
+            if card_number not in replayed:
+                return CheckResult.wrong(f"The replay should print every open account, card {card_number} "
+                                         f"is missing.")
+            if replayed[card_number] != self.get_balance(card_number):
+                return CheckResult.wrong(f"The balance of card {card_number} rebuilt from the journal "
+                                         f"doesn't match the balance stored in the database.")
+
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM transactions WHERE number IN (?, ?);",
+                           (correct_card_number, to_transfer_card_number))
+            entries = cursor.fetchone()[0]
+            self.close_connection()
+        except sqlite3.Error:
+            raise Exception("Can't execute a query in your database! Make sure that your database isn't broken "
+                            "and you close your connection at the end of the program!")
+
+        if entries != 7:
+            return CheckResult.wrong("Every income, both sides of every transfer and the balance taken out by "
+                                     "closing an account should be recorded in the transactions journal.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=60000)
+    def test14_check_metrics_dump(self):
+        if os.path.exists(self.metrics_file_name):
+            os.remove(self.metrics_file_name)
+
+        program = TestedProgram()
+        program.start(*self.args, '-metrics', self.metrics_file_name)
+
+        output = program.execute("1")
+        card_number_matcher = self.card_number_pattern.search(output)
+
+        if not card_number_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+
+        to_transfer_card_number = card_number_matcher.group()
+
+        output = program.execute("1")
+        card_number_matcher = self.card_number_pattern.search(output)
+        pin_matcher = self.pin_pattern.search(output)
+
+        if not card_number_matcher or not pin_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+
+        correct_pin = pin_matcher.group().strip()
+        correct_card_number = card_number_matcher.group()
+
+        program.execute("2")
+        program.execute(correct_card_number + "\n" + correct_pin)
+        program.execute("2\n10000")
+        program.execute("3\n" + to_transfer_card_number + "\n100")
+        program.execute("4")
+        self.stop_and_check_if_user_program_was_stopped(program)
+
+        if not os.path.exists(self.metrics_file_name):
+            return CheckResult.wrong("The metrics dump should be written on exit when -metrics is given.")
+
+        metrics = self.read_metrics()
+
+        for operation, budget in self.operation_latency_budgets.items():
+            count = metrics.get(('banking_operation_count', (('op', operation),)))
+            if not count:
+                return CheckResult.wrong(f"The metrics dump doesn't contain any {operation} measurement.")
+
+            p99 = metrics[('banking_operation_latency_ns', (('op', operation), ('quantile', '0.99')))]
+            if p99 > budget * 1000000:
+                return CheckResult.wrong(f"{operation} took {p99 / 1000000:.1f} ms at p99, "
+                                         f"the budget is {budget} ms.")
+
+        statements = sum(value for (name, _), value in metrics.items() if name == 'banking_statement_count')
+        if not statements:
+            return CheckResult.wrong("The metrics dump should contain per SQL statement timings.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=60000)
+    def test15_check_profiling(self):
+        profiles = self.run_profiled_scenario('create_and_transfer')
+
+        for kind, path in profiles.items():
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                return CheckResult.wrong(f"The {kind} profile wasn't written to {path}.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=60000)
+    def test16_check_hashed_pin_log_in(self):
+        program = TestedProgram()
+        program.start(*self.args, '-pinIterations', '1000')
+
+        output = program.execute("1")
+
+        card_number_matcher = self.card_number_pattern.search(output)
+        pin_matcher = self.pin_pattern.search(output)
+
+        if not card_number_matcher or not pin_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+
+        correct_pin = pin_matcher.group().strip()
+        correct_card_number = card_number_matcher.group()
+
+        incorrect_pin = correct_pin
+        while correct_pin == incorrect_pin:
+            incorrect_pin = str(1000 + random.randint(0, 8999))
+
+        program.execute("2")
+        output = program.execute(correct_card_number + "\n" + incorrect_pin)
+
+        if "successfully" in output.lower():
+            return CheckResult.wrong("The user should not be signed in after entering an incorrect PIN.")
+
+        program.execute("2")
+        output = program.execute(correct_card_number + "\n" + correct_pin)
+
+        if "successfully" not in output.lower():
+            return CheckResult.wrong("The user should be signed in after entering the correct card information.")
+
+        self.stop_and_check_if_user_program_was_stopped(program)
+
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f"SELECT pin FROM {self.table_name} WHERE number = ?", (correct_card_number,))
+            row = cursor.fetchone()
+            self.close_connection()
+        except sqlite3.Error:
+            raise Exception("Can't execute a query in your database! Make sure that your database isn't broken "
+                            "and you close your connection at the end of the program!")
+
+        if row is None or row[0] == correct_pin:
+            return CheckResult.wrong("With -pinIterations the PIN should be stored hashed, not in plaintext.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=60000)
+    def test17_check_brute_force_lockout(self):
+        few_attempts = self.count_statements_during_wrong_pin_logins(10)
+        if isinstance(few_attempts, CheckResult):
+            return few_attempts
+
+        many_attempts = self.count_statements_during_wrong_pin_logins(2000)
+        if isinstance(many_attempts, CheckResult):
+            return many_attempts
+
+        if many_attempts > few_attempts:
+            return CheckResult.wrong(f"Rejected logins should be answered without querying the database, but "
+                                     f"2000 wrong PINs ran {many_attempts} SQL statements and 10 wrong PINs ran "
+                                     f"{few_attempts}.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=120000)
+    def test18_check_malformed_transfers(self):
+        few_rounds = self.count_statements_during_malformed_transfers(10)
+        if isinstance(few_rounds, CheckResult):
+            return few_rounds
+
+        many_rounds = self.count_statements_during_malformed_transfers(500)
+        if isinstance(many_rounds, CheckResult):
+            return many_rounds
+
+        if many_rounds > few_rounds:
+            return CheckResult.wrong(f"Malformed transfer targets should be rejected without querying the "
+                                     f"database, but 500 rounds ran {many_rounds} SQL statements and 10 rounds "
+                                     f"ran {few_rounds}.")
+
+        return CheckResult.correct()
+
+    # Sends rounds batches of malformed transfer targets and returns the number of SQL statements run.
+    def count_statements_during_malformed_transfers(self, rounds):
+        if os.path.exists(self.metrics_file_name):
+            os.remove(self.metrics_file_name)
+
+        program = TestedProgram()
+        program.start(*self.args, '-metrics', self.metrics_file_name)
+
+        output = program.execute("1")
+
+        card_number_matcher = self.card_number_pattern.search(output)
+        pin_matcher = self.pin_pattern.search(output)
+
+        if not card_number_matcher or not pin_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+
+        correct_card_number = card_number_matcher.group()
+        correct_pin = pin_matcher.group()
+
+        program.execute("2")
+        program.execute(correct_card_number + "\n" + correct_pin)
+
+        targets = {
+            "": "mistake",
+            "abc": "mistake",
+            "123": "mistake",
+            "4000008449433404": "mistake",
+            "40000084494334031": "mistake",
+            "2000007269641768": "exist",
+            correct_card_number: "same account",
+        }
+
+        output = program.execute("\n".join("3\n" + target for target in targets))
+        for target, message in targets.items():
+            if message not in output.lower():
+                return CheckResult.wrong(f"The transfer to \"{target}\" should be rejected with a message "
+                                         f"containing \"{message}\".")
+
+        batch = "\n".join(["3\n" + target for target in targets] * rounds)
+        output = program.execute(batch)
+        if "success" in output.lower():
+            return CheckResult.wrong("A transfer to a malformed card number should never succeed.")
+
+        program.execute("0")
+        if not program.is_finished():
+            return CheckResult.wrong("After choosing 'Exit' item your program should stop.")
+
+        metrics = self.read_metrics()
+        transfers = metrics.get(('banking_operation_count', (('op', 'DoTransfer'),)), 0)
+        expected_transfers = len(targets) * (rounds + 1)
+        if transfers != expected_transfers:
+            return CheckResult.wrong(f"Expected {expected_transfers} transfer attempts in the metrics dump, "
+                                     f"found {transfers}.")
+
+        latency = metrics.get(('banking_operation_latency_ns', (('op', 'DoTransfer'), ('quantile', '0.99'))), 0)
+        budget = self.operation_latency_budgets['DoTransfer']
+        if latency > budget * 1000000:
+            return CheckResult.wrong(f"Rejecting a malformed transfer should take less than {budget} ms at p99, "
+                                     f"took {latency / 1000000:.2f} ms.")
+
+        return sum(value for (name, _), value in metrics.items() if name == 'banking_statement_count')
+
+    @dynamic_test(time_limit=300000)
+    def test19_check_concurrent_sqlx_transfers(self):
+        binary = self.build_binary('sqlx_variant', self.sqlx_variant_source)
+
+        # Eight sessions of the same card race to spend four times its balance.
+        cards = self.seed_stress_database({'sender': 1000, 'receiver': 0})
+        sender, receiver = cards['sender'], cards['receiver']
+        script = self.sqlx_transfer_script(sender, receiver[0], 10, 50)
+        results, _ = self.run_sqlx_sessions(binary, [script] * 8)
+
+        for returncode, output in results:
+            if returncode != 0:
+                return CheckResult.wrong(f"A concurrent session of the sqlx variant failed:\n{output[-500:]}")
+
+        balances = self.read_stress_balances()
+        transferred = 10 * sum(output.count("Success!") for _, output in results)
+        if balances[sender[0]] < 0:
+            return CheckResult.wrong(f"Concurrent transfers overdrew the sender: its balance is {balances[sender[0]]}.")
+        if balances[sender[0]] + balances[receiver[0]] != 1000:
+            return CheckResult.wrong("Concurrent transfers created or destroyed money: the balances add up to "
+                                     f"{balances[sender[0]] + balances[receiver[0]]} instead of 1000.")
+        if balances[receiver[0]] != transferred:
+            return CheckResult.wrong(f"The sessions reported {transferred} transferred, but the receiver got "
+                                     f"{balances[receiver[0]]}.")
+
+        # Independent pairs of cards: more sessions should move more money per second.
+        sessions = 4
+        transfers = 200
+        cards = self.seed_stress_database({f'{role}{i}': 10 ** 6 for i in range(sessions) for role in ('from', 'to')})
+        scripts = [self.sqlx_transfer_script(cards[f'from{i}'], cards[f'to{i}'][0], 1, transfers)
+                   for i in range(sessions)]
+        _, single_elapsed = self.run_sqlx_sessions(binary, scripts[:1])
+        results, concurrent_elapsed = self.run_sqlx_sessions(binary, scripts)
+
+        if any(output.count("Success!") != transfers for _, output in results):
+            return CheckResult.wrong("Every transfer between independent cards should succeed under concurrency.")
+
+        single_rate = transfers / single_elapsed
+        concurrent_rate = sessions * transfers / concurrent_elapsed
+        if (os.cpu_count() or 1) > 1 and concurrent_rate <= single_rate:
+            return CheckResult.wrong(f"{sessions} concurrent sessions made {concurrent_rate:.0f} transfers/s, "
+                                     f"no more than one session alone ({single_rate:.0f} transfers/s).")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=600000)
+    @seeded
+    def test20_benchmark_pool_settings(self):
+        binary = self.build_binary('sqlx_variant', self.sqlx_variant_source)
+        profiles = {
+            'default': {},
+            'one_reader': {'poolReaders': 1, 'poolIdleReaders': 0},
+            'wide': {'poolReaders': 16, 'poolIdleReaders': 16},
+            'rollback_journal': {'journalMode': 'DELETE'},
+        }
+        transfers = 100
+
+        sweep = []
+        for name, settings in profiles.items():
+            profile = os.path.join(self.benchmark_results_dir, f'pool_{name}.conf')
+            with open(profile, 'w') as file:
+                file.writelines(f'{key}={value}\n' for key, value in settings.items())
+
+            for sessions in (1, 4, 8):
+                cards = self.seed_stress_database({f'{role}{i}': 10 ** 6
+                                                   for i in range(sessions) for role in ('from', 'to')})
+                scripts = [self.sqlx_transfer_script(cards[f'from{i}'], cards[f'to{i}'][0], 1, transfers)
+                           for i in range(sessions)]
+                metrics_prefix = os.path.join(self.benchmark_results_dir, f'pool_{name}_{sessions}')
+                results, elapsed = self.run_sqlx_sessions(binary, scripts, '-poolProfile', profile,
+                                                          metrics_prefix=metrics_prefix)
+
+                for returncode, output in results:
+                    if returncode != 0 or output.count("Success!") != transfers:
+                        return CheckResult.wrong(f"A session failed with the {name} pool profile and {sessions} "
+                                                 f"concurrent sessions:\n{output[-500:]}")
+
+                pools = {}
+                for i in range(sessions):
+                    for (metric, labels), value in self.read_metrics(f'{metrics_prefix}.{i}.txt').items():
+                        if metric.startswith('banking_pool_'):
+                            key = dict(labels)['pool'] + '_' + metric[len('banking_pool_'):]
+                            pools[key] = pools.get(key, 0) + value
+
+                sweep.append({
+                    'profile': name,
+                    'settings': settings,
+                    'sessions': sessions,
+                    'transfers_per_second': sessions * transfers / elapsed,
+                    'pools': pools,
+                })
+
+        with open(os.path.join(self.benchmark_results_dir, 'pool_sweep.json'), 'w') as file:
+            json.dump(sweep, file, indent=2)
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=180000)
+    @seeded
+    def test21_benchmark_store_backends(self):
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+
+        latencies = {}
+        for backend in ('gorm', 'sqlx', 'memory'):
+            metrics_file = os.path.join(self.benchmark_results_dir, f'store_{backend}.metrics.txt')
+            program = TestedProgram()
+            program.start(*self.args, '-store', backend, '-metrics', metrics_file)
+            card_numbers = self.scenario_create_and_transfer(program)
+            self.stop_and_check_if_user_program_was_stopped(program)
+
+            for card_number, _ in card_numbers:
+                balance = self.get_balance(card_number)
+                if balance != 100:
+                    return CheckResult.wrong(f"With the {backend} store, card {card_number} should have a balance "
+                                             f"of 100 after the scenario, found {balance}.")
+
+            metrics = self.read_metrics(metrics_file)
+            latencies[backend] = {
+                operation: {quantile: metrics.get(('banking_operation_latency_ns',
+                                                   (('op', operation), ('quantile', quantile))), 0)
+                            for quantile in ('0.5', '0.99')}
+                for operation in self.operation_latency_budgets
+            }
+
+        with open(os.path.join(self.benchmark_results_dir, 'store_backends.json'), 'w') as file:
+            json.dump(latencies, file, indent=2)
+
+        ceiling = latencies['memory']['DoTransfer']['0.5']
+        for backend in ('gorm', 'sqlx'):
+            if latencies[backend]['DoTransfer']['0.5'] < ceiling:
+                return CheckResult.wrong(f"The in-memory store should be the fastest, but the {backend} store made "
+                                         f"transfers faster at the median.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=60000)
+    def test22_check_write_behind_durability(self):
+        flush_interval = 0.2
+        incomes, amount = 20, 30
+        binary = self.build_binary('banking_system', '.')
+        cards = self.seed_stress_database({'owner': 0, 'receiver': 0})
+        (number, pin), (receiver, _) = cards['owner'], cards['receiver']
+
+        process = subprocess.Popen([binary, '-fileName', self.stress_database_file_name, '-store', 'memory',
+                                    '-flushInterval', f'{int(flush_interval * 1000)}ms'],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   text=True)
+        lines = []
+
+        def read_output():
+            for line in process.stdout:
+                lines.append(line)
+
+        threading.Thread(target=read_output, daemon=True).start()
+
+        # The session never exits: the program is killed once the changes are
+        # older than the durability bound, without a chance to flush on exit.
+        process.stdin.write(f"2\n{number}\n{pin}\n" + "2\n100\n" * incomes + f"3\n{receiver}\n{amount}\n")
+        process.stdin.flush()
+        deadline = time.monotonic() + 30
+        while 'Success!\n' not in lines:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                return CheckResult.wrong("The program with the memory store didn't finish the income and transfer "
+                                         "operations.\nOutput:\n" + ''.join(lines))
+            time.sleep(0.01)
+        time.sleep(3 * flush_interval)
+        process.kill()
+        process.wait()
+
+        balances = self.read_stress_balances()
+        expected = {number: 100 * incomes - amount, receiver: amount}
+        if balances != expected:
+            return CheckResult.wrong(f"Changes older than the {flush_interval}s flush interval of the memory store "
+                                     f"should survive a crash: expected balances {expected}, found {balances}.")
+        connection = sqlite3.connect(self.stress_database_file_name)
+        entries, = connection.execute("SELECT COUNT(*) FROM transactions").fetchone()
+        connection.close()
+        if entries != incomes + 2:
+            return CheckResult.wrong(f"Expected {incomes + 2} journal entries to survive the crash, found {entries}.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=60000)
+    def test23_check_closed_accounts_archived(self):
+        self.delete_all_rows()
+
+        program = TestedProgram()
+        program.start(*self.args, '-archiveInterval', '50ms')
+
+        closed = {}
+        for income in (100, 200, 300):
+            output = program.execute("1")
+            card_number = self.card_number_pattern.search(output).group()
+            pin = self.pin_pattern.search(output).group().strip()
+            program.execute(f"2\n{card_number}\n{pin}\n2\n{income}")
+            output = program.execute("4")
+            if 'closed' not in output.lower():
+                return CheckResult.wrong("After choosing 'Close account' you should tell the user the account was "
+                                         "closed.")
+            closed[card_number] = income
+        self.stop_and_check_if_user_program_was_stopped(program)
+
+        connection = sqlite3.connect(self.database_file_name)
+        placeholders = ', '.join('?' * len(closed))
+        open_cards = connection.execute(f"SELECT number FROM card WHERE number IN ({placeholders})",
+                                        list(closed)).fetchall()
+        archived = dict(connection.execute(f"SELECT number, balance FROM card_archive WHERE number IN ({placeholders})",
+                                           list(closed)))
+        auto_vacuum, = connection.execute("PRAGMA auto_vacuum").fetchone()
+        connection.close()
+
+        if open_cards:
+            return CheckResult.wrong(f"Closed cards should be removed from the card table, found {open_cards}.")
+        if archived != closed:
+            return CheckResult.wrong(f"Closed cards should be kept in card_archive with their balances: expected "
+                                     f"{closed}, found {archived}.")
+        if auto_vacuum != 2:
+            return CheckResult.wrong(f"The database should use incremental auto-vacuum (auto_vacuum = 2), found "
+                                     f"{auto_vacuum}.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=300000)
+    @seeded
+    def test24_check_parallel_card_issuance(self):
+        count = 10 ** 6
+        binary = self.build_binary('banking_system', '.')
+        self.seed_stress_database({})
+
+        result = subprocess.run([binary, '-fileName', self.stress_database_file_name, 'issue', str(count)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return CheckResult.wrong(f"Issuing {count} cards failed:\n{result.stdout}{result.stderr}")
+
+        connection = sqlite3.connect(self.stress_database_file_name)
+        numbers, pins = [], []
+        for number, pin in connection.execute("SELECT number, pin FROM card"):
+            numbers.append(number)
+            pins.append(pin)
+        connection.close()
+
+        if len(numbers) != count:
+            return CheckResult.wrong(f"Expected {count} issued cards in the database, found {len(numbers)}.")
+        if len(set(numbers)) != count:
+            return CheckResult.wrong("Some issued card numbers are duplicates.")
+        if not all(number.startswith('400000') for number in numbers):
+            return CheckResult.wrong("Every issued card number should start with 400000.")
+        if not self.all_pass_luhn(numbers):
+            return CheckResult.wrong("Some issued card numbers don't pass the Luhn algorithm.")
+        if not all(len(pin) == 4 and pin.isdigit() for pin in pins):
+            return CheckResult.wrong("Every issued PIN should be 4 digits.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=900000)
+    @seeded
+    def test25_benchmark_balance_history(self):
+        events = 10 ** 6
+        binary = self.build_binary('banking_system', '.')
+        number, pin = self.seed_stress_database({'owner': 0})['owner']
+
+        start = time.perf_counter()
+        session = subprocess.run([binary, '-fileName', self.stress_database_file_name, '-store', 'memory'],
+                                 input=f"2\n{number}\n{pin}\n" + "2\n1\n" * events + "0\n",
+                                 capture_output=True, text=True)
+        record_seconds = time.perf_counter() - start
+        if session.returncode != 0:
+            return CheckResult.wrong(f"The session adding {events} incomes failed:\n{session.stderr}")
+
+        series, query_seconds = {}, {}
+        for resolution in ('minute', 'hour', 'day'):
+            start = time.perf_counter()
+            result = subprocess.run([binary, '-fileName', self.stress_database_file_name,
+                                     'history', number, resolution], capture_output=True, text=True)
+            query_seconds[resolution] = time.perf_counter() - start
+            if result.returncode != 0:
+                return CheckResult.wrong(f"The history command failed:\n{result.stderr}")
+            series[resolution] = [line.split() for line in result.stdout.splitlines()[1:]]
+
+        for resolution, buckets in series.items():
+            if not buckets:
+                return CheckResult.wrong(f"The {resolution} balance history of a card with {events} incomes is empty.")
+            recorded = sum(int(bucket[5]) for bucket in buckets)
+            if recorded != events:
+                return CheckResult.wrong(f"The {resolution} balance history should count {events} changes, "
+                                         f"found {recorded}.")
+            if int(buckets[0][1]) != 0 or int(buckets[-1][4]) != events:
+                return CheckResult.wrong(f"The {resolution} balance history should go from 0 to {events}, "
+                                         f"found {buckets[0][1]} to {buckets[-1][4]}.")
+        # One row per bucket: the minute series can't be longer than the
+        # session lasted, however many changes it recorded.
+        if len(series['minute']) > record_seconds / 60 + 2:
+            return CheckResult.wrong(f"The minute balance history has {len(series['minute'])} buckets for a "
+                                     f"{record_seconds:.0f}s session.")
+
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        with open(os.path.join(self.benchmark_results_dir, 'balance_history.json'), 'w') as file:
+            json.dump({
+                'events': events,
+                'record_seconds': record_seconds,
+                'events_per_second': events / record_seconds,
+                'buckets': {resolution: len(buckets) for resolution, buckets in series.items()},
+                'query_seconds': query_seconds,
+            }, file, indent=2)
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=300000)
+    def test26_check_template_databases(self):
+        factory = self.database_factory()
+        population = factory.populations['100k']
+        factory.clone('100k', self.stress_database_file_name)
+
+        connection = sqlite3.connect(self.stress_database_file_name)
+        numbers = [number for number, in connection.execute("SELECT number FROM card ORDER BY id")]
+        connection.close()
+        if len(numbers) != population or not self.all_pass_luhn(numbers):
+            return CheckResult.wrong(f"The 100k template should hold {population} Luhn-valid cards.")
+
+        number, pin, balance = factory.card(54321)
+        result = subprocess.run([factory.binary, '-fileName', self.stress_database_file_name],
+                                input=f"2\n{number}\n{pin}\n1\n5\n0\n", capture_output=True, text=True)
+        if f"Balance: {balance}" not in result.stdout:
+            return CheckResult.wrong(f"Card {number} of the template should log in with PIN {pin} and have a "
+                                     f"balance of {balance}, the program printed:\n{result.stdout}")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=300000)
+    @seeded
+    @measured
+    def test27_check_performance_budgets(self):
+        logins = 300
+        factory = self.database_factory()
+        population = factory.populations['100k']
+        factory.clone('100k', self.stress_database_file_name)
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        metrics_file = os.path.join(self.benchmark_results_dir, 'budget_metrics.txt')
+        if os.path.exists(metrics_file):
+            os.remove(metrics_file)
+
+        session = WarmSession([factory.binary, '-fileName', self.stress_database_file_name, '-metrics', metrics_file],
+                              logout_option='5', recorder=self.performance)
+        for i in random.sample(range(population), logins):
+            number, pin, _ = factory.card(i)
+            receiver, _, _ = factory.card((i + 1) % population)
+            session.execute("1")
+            session.execute("2")
+            if "successfully" not in session.execute(f"{number}\n{pin}").lower():
+                session.close()
+                return CheckResult.wrong(f"Card {number} of the 100k template should log in with PIN {pin}.")
+            session.execute("1")
+            session.execute("2\n100")
+            session.execute(f"3\n{receiver}\n1")
+            session.execute("5")
+        session.close()
+
+        if not os.path.exists(metrics_file):
+            return CheckResult.wrong("The metrics dump should be written on exit when -metrics is given.")
+        measurement = self.performance.current
+        measurement['statements'] = sum(value for (name, _), value in self.read_metrics(metrics_file).items()
+                                        if name == 'banking_statement_count')
+        budget = self.statements_per_execute_budget * measurement['executes']
+        if measurement['statements'] > budget:
+            return CheckResult.wrong(f"{measurement['executes']} executes ran {measurement['statements']} SQL "
+                                     f"statements, the budget is {budget}.")
+
+        over_budget = self.performance.over_budget(measurement['latencies'], self.execute_latency_budgets)
+        if over_budget:
+            return CheckResult.wrong("\n".join(over_budget))
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=1800000)
+    @seeded
+    @measured
+    def test28_check_scale_tier(self):
+        rounds = 100
+        factory = self.database_factory()
+        report = {}
+        for population_name in self.scale_populations:
+            population = factory.populations[population_name]
+            factory.clone(population_name, self.stress_database_file_name)
+            recorder = PerformanceRecorder(None)
+            session = WarmSession([factory.binary, '-fileName', self.stress_database_file_name,
+                                   '-sessionBurst', str(rounds * len(self.scale_failing_scenarios))],
+                                  logout_option='5', timeout=60, recorder=recorder)
+            try:
+                error, expected_balances, closed = self.run_scale_rounds(session, factory, population, rounds)
+            finally:
+                session.close()
+            if error:
+                return CheckResult.wrong(f"With {population} cards: {error}")
+
+            numbers = [*expected_balances, *closed]
+            connection = sqlite3.connect(self.stress_database_file_name)
+            balances = dict(connection.execute(
+                f"SELECT number, balance FROM card WHERE number IN ({','.join('?' * len(numbers))})", numbers))
+            connection.close()
+            for number, balance in expected_balances.items():
+                if balances.get(number) != balance:
+                    return CheckResult.wrong(f"With {population} cards, card {number} should have a balance of "
+                                             f"{balance} after receiving a transfer, found {balances.get(number)}.")
+            if any(number in balances for number in closed):
+                return CheckResult.wrong(f"With {population} cards, closed accounts should be deleted from the card "
+                                         f"table.")
+
+            report[population] = {operation: {'count': len(samples),
+                                              'p50_ms': recorder.quantile(samples, 0.5) * 1000,
+                                              'p99_ms': recorder.quantile(samples, 0.99) * 1000}
+                                  for operation, samples in sorted(recorder.latencies.items())}
+
+        growth = self.scale_growth(report)
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        with open(os.path.join(self.benchmark_results_dir, 'scale_tier.json'), 'w') as file:
+            json.dump({'rounds': rounds, 'latencies': report, 'growth': growth}, file, indent=2)
+
+        worse_than_logarithmic = [f"{operation} went from {stats['from_ms']:.2f} ms at {stats['from']} cards to "
+                                  f"{stats['to_ms']:.2f} ms at {stats['to']} cards, "
+                                  f"the logarithmic bound is {stats['bound_ms']:.2f} ms."
+                                  for operation, steps in growth.items() for stats in steps if stats['exceeded']]
+        if worse_than_logarithmic:
+            return CheckResult.wrong("Latency grows faster than logarithmically with the number of cards:\n" +
+                                     "\n".join(worse_than_logarithmic))
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=600000)
+    @seeded
+    @measured
+    def test29_check_report_does_not_stall_writers(self):
+        incomes = 200
+        factory = self.database_factory()
+        factory.clone('1m', self.stress_database_file_name)
+        expected = dict(self.read_report(self.stress_database_file_name))
+
+        # The card with the highest balance stays on top while it receives
+        # incomes, so the quantiles can't move during the report.
+        number, pin, _ = factory.card(999)
+        recorder = PerformanceRecorder(None)
+        session = WarmSession([factory.binary, '-fileName', self.stress_database_file_name],
+                              logout_option='5', recorder=recorder)
+        try:
+            session.execute("2")
+            if "successfully" not in session.execute(f"{number}\n{pin}").lower():
+                return CheckResult.wrong(f"Card {number} of the 1m template should log in with PIN {pin}.")
+            for _ in range(incomes):
+                session.execute("2\n1")
+            alone = recorder.latencies.pop('AddIncome')
+
+            start = time.perf_counter()
+            reporter = subprocess.Popen([factory.binary, '-fileName', self.stress_database_file_name, 'report'],
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            while reporter.poll() is None:
+                session.execute("2\n1")
+            report_seconds = time.perf_counter() - start
+            during = recorder.latencies.get('AddIncome', [])
+        finally:
+            session.close()
+
+        if reporter.returncode != 0:
+            return CheckResult.wrong(f"The report command failed:\n{reporter.stderr.read()}")
+        reported = {name: int(value) for name, value in (line.split() for line in reporter.stdout.read().splitlines())}
+        added_before = expected['total_balance'] + incomes
+        added_after = added_before + len(during)
+        if reported.get('accounts') != expected['accounts'] or \
+                not added_before <= reported.get('total_balance', -1) <= added_after:
+            return CheckResult.wrong(f"The report should count {expected['accounts']} accounts holding between "
+                                     f"{added_before} and {added_after}, it printed {reported}.")
+        for name, value in expected.items():
+            if name.startswith('p') and reported.get(name) != value:
+                return CheckResult.wrong(f"The report should print {name} {value}, it printed {reported}.")
+
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        with open(os.path.join(self.benchmark_results_dir, 'report_writer_stalls.json'), 'w') as file:
+            json.dump({
+                'accounts': expected['accounts'],
+                'report_seconds': report_seconds,
+                'writes_during_report': len(during),
+                'alone': {'p50_ms': recorder.quantile(alone, 0.5) * 1000,
+                          'p99_ms': recorder.quantile(alone, 0.99) * 1000,
+                          'max_ms': max(alone) * 1000},
+                'during_report': {'p50_ms': recorder.quantile(during, 0.5) * 1000 if during else None,
+                                  'p99_ms': recorder.quantile(during, 0.99) * 1000 if during else None,
+                                  'max_ms': max(during) * 1000 if during else None},
+            }, file, indent=2)
+
+        if not during:
+            return CheckResult.wrong(f"No income could be added during a {report_seconds:.2f}s report.")
+        slowest = max(during) * 1000
+        if slowest > self.report_writer_stall_budget_ms:
+            return CheckResult.wrong(f"Adding income took up to {slowest:.1f} ms while a report ran, the budget is "
+                                     f"{self.report_writer_stall_budget_ms} ms: the report stalls the writer.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=600000)
+    @seeded
+    def test30_check_bulk_import(self):
+        count = 10 ** 6
+        factory = self.database_factory()
+        factory.clone('10k', self.stress_database_file_name)
+        stored = factory.populations['10k']
+
+        # The portfolio holds the cards of the 1m template: those of the 10k
+        # one are already stored, every 1000th card is followed by a copy
+        # with a wrong check digit and the last card is repeated.
+        portfolio = os.path.join(self.benchmark_results_dir, 'portfolio.csv')
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        invalid, total, journaled = 0, 0, 0
+        with open(portfolio, 'w') as file:
+            file.write('number,pin,balance\n')
+            for i in range(count):
+                number, pin, balance = factory.card(i)
+                file.write(f'{number},{pin},{balance}\n')
+                if i % 1000 == 999:
+                    file.write(f'{number[:-1]}{(int(number[-1]) + 1) % 10},{pin},{balance}\n')
+                    invalid += 1
+                total += balance
+                if i >= stored:
+                    journaled += balance
+            file.write(f'{number},{pin},{balance}\n')
+
+        with open(portfolio) as stdin, tempfile.TemporaryFile('w+') as stdout, \
+                tempfile.TemporaryFile('w+') as stderr:
+            start = time.perf_counter()
+            importer = subprocess.Popen([factory.binary, '-fileName', self.stress_database_file_name, 'import'],
+                                        stdin=stdin, stdout=stdout, stderr=stderr, text=True)
+            # wait4 reports the peak memory of this process alone.
+            _, status, usage = os.wait4(importer.pid, 0)
+            seconds = time.perf_counter() - start
+            importer.returncode = os.waitstatus_to_exitcode(status)
+            stdout.seek(0)
+            stderr.seek(0)
+            output, log = stdout.read(), stderr.read()
+        os.remove(portfolio)
+        max_rss_mb = usage.ru_maxrss / 1024
+
+        if importer.returncode != 0:
+            return CheckResult.wrong(f"Importing {count} cards failed:\n{output}{log[-2000:]}")
+        summary = f"Imported {count - stored} cards"
+        skipped = f"skipped {invalid} invalid and {stored + 1} duplicate records"
+        if summary not in output or skipped not in output:
+            return CheckResult.wrong(f"The import should report \"{summary}\" and \"{skipped}\", it printed:\n"
+                                     f"{output}")
+        if sum('cards imported' in line for line in log.splitlines()) < 2:
+            return CheckResult.wrong("The import should report its progress after every transaction.")
+
+        connection = sqlite3.connect(self.stress_database_file_name)
+        numbers = [number for number, in connection.execute("SELECT number FROM card")]
+        balance, = connection.execute("SELECT SUM(balance) FROM card").fetchone()
+        entries, amount = connection.execute("SELECT COUNT(*), SUM(amount) FROM transactions "
+                                             "WHERE kind = 'import'").fetchone()
+        connection.close()
+        if len(numbers) != count or balance != total or not self.all_pass_luhn(numbers):
+            return CheckResult.wrong(f"After the import the database should hold {count} Luhn-valid cards with "
+                                     f"{total} in total, it holds {len(numbers)} cards with {balance}.")
+        if amount != journaled:
+            return CheckResult.wrong(f"The opening balances of the imported cards should be journaled, "
+                                     f"{entries} entries add up to {amount} instead of {journaled}.")
+
+        number, pin, balance = factory.card(count - 1)
+        result = subprocess.run([factory.binary, '-fileName', self.stress_database_file_name],
+                                input=f"2\n{number}\n{pin}\n1\n5\n0\n", capture_output=True, text=True)
+        if f"Balance: {balance}" not in result.stdout:
+            return CheckResult.wrong(f"Imported card {number} should log in with PIN {pin} and have a balance of "
+                                     f"{balance}, the program printed:\n{result.stdout}")
+
+        with open(os.path.join(self.benchmark_results_dir, 'bulk_import.json'), 'w') as file:
+            json.dump({'records': count + invalid + 1, 'seconds': seconds,
+                       'records_per_second': (count + invalid + 1) / seconds, 'max_rss_mb': max_rss_mb}, file, indent=2)
+
+        if seconds > self.import_time_budget_seconds:
+            return CheckResult.wrong(f"Importing {count} cards took {seconds:.1f}s, the budget is "
+                                     f"{self.import_time_budget_seconds}s.")
+        if max_rss_mb > self.import_memory_budget_mb:
+            return CheckResult.wrong(f"Importing {count} cards used {max_rss_mb:.0f} MiB of memory, the budget is "
+                                     f"{self.import_memory_budget_mb} MiB: the portfolio should be streamed.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=3600000)
+    def test31_compare_builds(self):
+        if not self.baseline_revision:
+            return CheckResult.correct()
+        factory = self.database_factory()
+        builds = {'baseline': self.build_revision(self.baseline_revision), 'candidate': factory.binary}
+        seed = self.test_seed('test31_compare_builds')
+
+        runs = {name: [] for name in builds}
+        for repetition in range(-1, self.comparison_repetitions):
+            order = list(builds) if repetition % 2 == 0 else list(reversed(builds))
+            for name in order:
+                error, medians = self.comparison_run(builds[name], seed)
+                if error:
+                    return CheckResult.wrong(f"The {name} build failed the comparison rounds: {error}")
+                if repetition >= 0:
+                    runs[name].append(medians)
+
+        deltas = self.paired_deltas(runs['baseline'], runs['candidate'], seed)
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        with open(os.path.join(self.benchmark_results_dir, 'build_comparison.json'), 'w') as file:
+            json.dump({'baseline': self.baseline_revision, 'seed': seed, 'population': self.comparison_population,
+                       'rounds': self.comparison_rounds, 'repetitions': self.comparison_repetitions,
+                       'operations': deltas}, file, indent=2)
+
+        tolerance = PerformanceRecorder.regression_tolerance
+        regressions = [f"{operation} is {delta['ratio']:.2f} times as slow as in {self.baseline_revision} "
+                       f"(95% interval {delta['low']:.2f}-{delta['high']:.2f})"
+                       for operation, delta in deltas.items() if delta['low'] > tolerance]
+        if regressions:
+            return CheckResult.wrong("\n".join(regressions))
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=300000)
+    @seeded
+    def test32_check_ledger_conservation(self):
+        factory = self.database_factory()
+        factory.clone('10k', self.stress_database_file_name)
+        connection = sqlite3.connect(self.stress_database_file_name)
+        before = dict(connection.execute("SELECT number, balance FROM card"))
+        last_entry, = connection.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()
+        connection.close()
+
+        result = subprocess.run([factory.binary, '-fileName', self.stress_database_file_name, '-store', 'memory',
+                                 'simulate', str(self.ledger_goroutines), str(self.ledger_transfers)],
+                                capture_output=True, text=True, timeout=240)
+        if result.returncode != 0:
+            return CheckResult.wrong(f"The simulated transfers failed:\n{result.stdout}{result.stderr}")
+        match = re.search(r'Made (\d+) transfers and refused (\d+)', result.stdout)
+        if not match or int(match[1]) + int(match[2]) != self.ledger_transfers:
+            return CheckResult.wrong(f"The simulation should report how many of its {self.ledger_transfers} "
+                                     f"transfers were made and refused, it printed:\n{result.stdout}")
+        made = int(match[1])
+
+        connection = sqlite3.connect(self.stress_database_file_name)
+        after = dict(connection.execute("SELECT number, balance FROM card"))
+        changes = dict(connection.execute("SELECT number, SUM(amount) FROM transactions WHERE id > ? "
+                                          "GROUP BY number", (last_entry,)))
+        entries, = connection.execute("SELECT COUNT(*) FROM transactions WHERE id > ?", (last_entry,)).fetchone()
+        connection.close()
+
+        if after.keys() != before.keys():
+            return CheckResult.wrong("Simulated transfers should neither create nor close cards.")
+        if sum(after.values()) != sum(before.values()):
+            return CheckResult.wrong(f"The cards held {sum(before.values())} in total before {made} concurrent "
+                                     f"transfers and {sum(after.values())} after: money was created or lost.")
+        overdrawn = [number for number, balance in after.items() if balance < 0]
+        if overdrawn:
+            return CheckResult.wrong(f"{len(overdrawn)} cards were overdrawn by concurrent transfers, "
+                                     f"e.g. {overdrawn[0]}.")
+        if entries != 2 * made:
+            return CheckResult.wrong(f"{made} transfers should be journaled as {2 * made} entries, "
+                                     f"found {entries}.")
+        drifted = [number for number in after if after[number] - before[number] != changes.get(number, 0)]
+        if drifted:
+            return CheckResult.wrong(f"The balances of {len(drifted)} cards don't match their journal entries, "
+                                     f"e.g. {drifted[0]}.")
+
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        with open(os.path.join(self.benchmark_results_dir, 'ledger_simulation.json'), 'w') as file:
+            json.dump({'goroutines': self.ledger_goroutines, 'transfers': self.ledger_transfers, 'made': made,
+                       'output': result.stdout.strip()}, file, indent=2)
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=300000)
+    @seeded
+    def test33_check_shutdown_checkpoint(self):
+        factory = self.database_factory()
+        factory.clone('100k', self.stress_database_file_name)
+        wal_file_name = self.stress_database_file_name + '-wal'
+        metrics_file = os.path.join(self.benchmark_results_dir, 'shutdown_metrics.txt')
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+
+        cycles = []
+        for cycle in range(1, self.shutdown_cycles + 1):
+            start = time.perf_counter()
+            session = WarmSession([factory.binary, '-fileName', self.stress_database_file_name,
+                                   '-metrics', metrics_file], logout_option='5')
+            started = time.perf_counter()
+            try:
+                for _ in range(self.shutdown_accounts_per_cycle):
+                    session.execute("1")
+                exiting = time.perf_counter()
+            finally:
+                session.close()
+            exited = time.perf_counter()
+
+            if session.process.returncode != 0:
+                return CheckResult.wrong(f"The program should exit cleanly, exit {cycle} returned "
+                                         f"{session.process.returncode}.")
+            wal_bytes = os.path.getsize(wal_file_name) if os.path.exists(wal_file_name) else 0
+            if wal_bytes:
+                return CheckResult.wrong(f"The WAL still held {wal_bytes} bytes after exit {cycle}: the program "
+                                         f"should checkpoint it before it exits.")
+            metrics = self.read_metrics(metrics_file)
+            shutdown = metrics.get(('banking_operation_latency_ns_max', (('op', 'Shutdown'),)))
+            if shutdown is None:
+                return CheckResult.wrong("The metrics dump should report the latency of the Shutdown operation.")
+            checkpoint = metrics.get(('banking_operation_latency_ns_max', (('op', 'Checkpoint'),)), 0)
+            cycles.append({
+                'startup_ms': (started - start) * 1000,
+                'exit_ms': (exited - exiting) * 1000,
+                'shutdown_ms': shutdown / 10 ** 6,
+                'checkpoint_ms': checkpoint / 10 ** 6,
+            })
+
+        start = time.perf_counter()
+        connection = sqlite3.connect(self.stress_database_file_name)
+        cards, = connection.execute("SELECT COUNT(*) FROM card").fetchone()
+        connection.close()
+        connect_ms = (time.perf_counter() - start) * 1000
+
+        first = statistics.median(c['startup_ms'] for c in cycles[:5])
+        last = statistics.median(c['startup_ms'] for c in cycles[-5:])
+        slowest = max(c['shutdown_ms'] for c in cycles)
+        with open(os.path.join(self.benchmark_results_dir, 'shutdown_cycles.json'), 'w') as file:
+            json.dump({'first_startup_ms': first, 'last_startup_ms': last, 'slowest_shutdown_ms': slowest,
+                       'connect_ms': connect_ms, 'cycles': cycles}, file, indent=2)
+
+        expected = factory.populations['100k'] + self.shutdown_cycles * self.shutdown_accounts_per_cycle
+        if cards != expected:
+            return CheckResult.wrong(f"Expected {expected} cards after {self.shutdown_cycles} sessions, "
+                                     f"found {cards}: accounts were lost on exit.")
+        if last > first * self.startup_growth_tolerance + self.startup_growth_slack_ms:
+            return CheckResult.wrong(f"The program started in {first:.1f} ms at first and in {last:.1f} ms after "
+                                     f"{self.shutdown_cycles} exits: each exit leaves more work for the next start.")
+        if slowest > self.shutdown_budget_ms:
+            return CheckResult.wrong(f"A shutdown took {slowest:.0f} ms, the budget is {self.shutdown_budget_ms} ms.")
+
+        return CheckResult.correct()
+
+    @dynamic_test(time_limit=60000)
+    def test34_check_closed_account_survives_crash(self):
+        binary = self.build_binary('banking_system', '.')
+        cards = self.seed_stress_database({'owner': 500, 'other': 0})
+        number, pin = cards['owner']
+
+        # The archiver never runs before the kill, so only the mark Delete
+        # wrote can keep the account closed.
+        process = subprocess.Popen([binary, '-fileName', self.stress_database_file_name, '-archiveInterval', '1h'],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   text=True)
+        lines = []
+
+        def read_output():
+            for line in process.stdout:
+                lines.append(line)
+
+        threading.Thread(target=read_output, daemon=True).start()
+        process.stdin.write(f"2\n{number}\n{pin}\n4\n")
+        process.stdin.flush()
+        deadline = time.monotonic() + 30
+        while not any('closed' in line.lower() for line in lines):
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                return CheckResult.wrong("The program didn't close the account.\nOutput:\n" + ''.join(lines))
+            time.sleep(0.01)
+        process.kill()
+        process.wait()
+
+        restarted = subprocess.run([binary, '-fileName', self.stress_database_file_name], input="0\n",
+                                   capture_output=True, text=True, timeout=30)
+        if restarted.returncode != 0:
+            return CheckResult.wrong(f"The program failed to start after a crash:\n{restarted.stderr}")
+        connection = sqlite3.connect(self.stress_database_file_name)
+        open_cards = connection.execute("SELECT COUNT(*) FROM card WHERE number = ?", (number,)).fetchone()[0]
+        archived = connection.execute("SELECT balance FROM card_archive WHERE number = ?", (number,)).fetchall()
+        connection.close()
+        if open_cards:
+            return CheckResult.wrong("An account closed right before a crash was open again after a restart: closing "
+                                     "an account should be durable once the program says so.")
+        if archived != [(500,)]:
+            return CheckResult.wrong(f"The account closed before a crash should be archived with its balance of 500 "
+                                     f"after a restart, found {archived}.")
+
+        return CheckResult.correct()
+
+    # Checks the Luhn algorithm for many 16-digit card numbers at once. Each
+    # column of digits becomes one big integer holding a byte per number, so
+    # adding the 16 columns sums the digits of every number in parallel; a sum
+    # is at most 144, so one number's byte never carries into the next.
+    @staticmethod
+    def all_pass_luhn(numbers):
+        digits = ''.join(numbers).encode()
+        if len(digits) != 16 * len(numbers) or (digits and not digits.isdigit()):
+            return False
+
+        plain = bytes.maketrans(b'0123456789', bytes(range(10)))
+        doubled = bytes.maketrans(b'0123456789', bytes([0, 2, 4, 6, 8, 1, 3, 5, 7, 9]))
+        total = 0
+        for i in range(16):
+            total += int.from_bytes(digits[i::16].translate(doubled if i % 2 == 0 else plain), 'big')
+
+        not_divisible = bytes(0 if value % 10 == 0 else 1 for value in range(256))
+        return 1 not in total.to_bytes(len(numbers), 'big').translate(not_divisible)
+
+    def database_factory(self):
+        if SimpleBankSystemTest.factory is None:
+            SimpleBankSystemTest.factory = DatabaseFactory(self.build_binary('banking_system', '.'))
+        return SimpleBankSystemTest.factory
+
+    # Returns the shared program, back at the main menu.
+    def warm_session(self):
+        if SimpleBankSystemTest.session is None:
+            binary = self.build_binary('banking_system', '.')
+            SimpleBankSystemTest.session = WarmSession([binary, *self.args], logout_option='5',
+                                                       recorder=self.performance)
+            atexit.register(SimpleBankSystemTest.session.close)
+        SimpleBankSystemTest.session.reset()
+        return SimpleBankSystemTest.session
+
+    # Plays the logic of tests 6-12 on a session over a template database:
+    # the login scenarios on new cards, then income, rejected and accepted
+    # transfers and closing the account for template cards. Returns an error
+    # message or None, the balances the receivers should end with and the
+    # numbers of the closed accounts. Any login the failed-login limiter
+    # refuses or slows down is an error: the rounds never fail twice on the
+    # same card, and the callers size the session budget for their failures.
+    def run_scale_rounds(self, session, factory, population, rounds, scenario_names=None):
+        indexes = random.sample(range(population), 2 * rounds)
+        expected_balances, closed = {}, []
+        for round_number, (sender, receiver) in enumerate(zip(indexes[:rounds], indexes[rounds:])):
+            for scenario in scenario_names or self.scale_scenarios:
+                session.reset()
+                result = scenarios.load(scenario).run(session, logout='5')
+                if session.throttled:
+                    return f"the failed-login limiter refused or slowed down a login in round {round_number + 1}, " \
+                           f"though no card failed twice and the session budget covers every failure.", \
+                        expected_balances, closed
+                if result.error:
+                    return result.error, expected_balances, closed
+            session.reset()
+
+            number, pin, balance = factory.card(sender)
+            receiver_number, _, receiver_balance = factory.card(receiver)
+            not_existing_number, _, _ = factory.card(population + round_number)
+            wrong_check_digit = number[:-1] + str((int(number[-1]) + 1) % 10)
+
+            session.execute("2")
+            if "successfully" not in session.execute(f"{number}\n{pin}").lower():
+                return f"card {number} should log in with PIN {pin}.", expected_balances, closed
+            if "income was added" not in session.execute("2\n20000").lower():
+                return "adding income should print 'Income was added!'.", expected_balances, closed
+            if "mistake" not in session.execute("3\n" + wrong_check_digit).lower():
+                return "a transfer to a card number failing the Luhn algorithm should be refused.", \
+                    expected_balances, closed
+            if "exist" not in session.execute("3\n" + not_existing_number).lower():
+                return "a transfer to a card that does not exist should be refused.", expected_balances, closed
+            output = session.execute(f"3\n{receiver_number}\n{balance + 20001}")
+            if "not enough money" not in output.lower():
+                return "a transfer over the balance should be refused.", expected_balances, closed
+            if "success" not in session.execute(f"3\n{receiver_number}\n10000").lower():
+                return "a transfer within the balance should succeed.", expected_balances, closed
+            session.execute("4")
+
+            expected_balances[receiver_number] = receiver_balance + 10000
+            closed.append(number)
+        return None, expected_balances, closed
+
+    # Compares the median latency of every operation at each population with
+    # the smallest one, against logarithmic growth.
+    def scale_growth(self, report):
+        populations = sorted(report)
+        smallest = populations[0]
+        growth = {}
+        for operation, stats in report[smallest].items():
+            steps = []
+            for population in populations[1:]:
+                if operation not in report[population]:
+                    continue
+                bound = stats['p50_ms'] * math.log(population) / math.log(smallest) * self.scale_growth_tolerance + \
+                    self.scale_growth_slack_ms
+                latency = report[population][operation]['p50_ms']
+                steps.append({'from': smallest, 'to': population, 'from_ms': stats['p50_ms'], 'to_ms': latency,
+                              'bound_ms': bound, 'exceeded': latency > bound})
+            growth[operation] = steps
+        return growth
+
+    # Library version of the report command for the checks: yields the same
+    # (name, value) aggregates, reading a snapshot of the database on a
+    # read-only connection and streaming the balances in order.
+    @staticmethod
+    def read_report(path, quantiles=(0.5, 0.9, 0.99)):
+        connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, isolation_level=None)
+        try:
+            connection.execute("BEGIN")
+            accounts, total = connection.execute("SELECT COUNT(*), SUM(balance) FROM card").fetchone()
+            yield 'accounts', accounts
+            yield 'total_balance', total or 0
+            if not accounts:
+                return
+            ranks = sorted((max(0, math.ceil(q * accounts) - 1), f'p{round(q * 1e6) / 1e4:g}') for q in quantiles)
+            for rank, (balance,) in enumerate(connection.execute("SELECT balance FROM card ORDER BY balance")):
+                while ranks and ranks[0][0] == rank:
+                    yield ranks.pop(0)[1], balance
+                if not ranks:
+                    break
+        finally:
+            connection.close()
+
+    # The seed of one seeded test, derived from the seed of the suite.
+    def test_seed(self, name):
+        digest = hashlib.sha256(f'{self.seed}:{name}'.encode()).digest()
+        return int.from_bytes(digest[:7], 'big') + 1
+
+    # Builds the banking program of this stage as of a git revision, in a
+    # temporary worktree.
+    def build_revision(self, revision):
+        prefix = subprocess.run(['git', 'rev-parse', '--show-prefix'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        worktree = tempfile.mkdtemp()
+        subprocess.run(['git', 'worktree', 'add', '--detach', worktree, revision], capture_output=True, check=True)
+        try:
+            os.makedirs(self.benchmark_results_dir, exist_ok=True)
+            binary = os.path.abspath(os.path.join(self.benchmark_results_dir, 'banking_system_baseline'))
+            subprocess.run(['go', 'build', '-o', binary, '.'], cwd=os.path.join(worktree, prefix), check=True)
+            return binary
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', worktree], capture_output=True)
+
+    # Plays the seeded scale rounds with binary on a fresh clone. Returns an
+    # error message or None, and the median latency of every operation.
+    def comparison_run(self, binary, seed):
+        factory = self.database_factory()
+        factory.clone(self.comparison_population, self.stress_database_file_name)
+        random.seed(seed)
+        recorder = PerformanceRecorder(None)
+        session = WarmSession([binary, '-fileName', self.stress_database_file_name, '-seed', str(seed)],
+                              logout_option='5', timeout=60, recorder=recorder)
+        try:
+            error, _, _ = self.run_scale_rounds(session, factory, factory.populations[self.comparison_population],
+                                                self.comparison_rounds, self.comparison_scenarios)
+        finally:
+            session.close()
+        return error, {operation: statistics.median(samples) for operation, samples in recorder.latencies.items()}
+
+    # Compares two builds operation by operation. Each repetition pairs runs
+    # made one right after the other, so the ratio of their medians cancels
+    # most of the drift of the machine; the delta is the median of these
+    # ratios, with a 95% bootstrap interval.
+    def paired_deltas(self, baseline, candidate, seed):
+        rng = random.Random(seed)
+        deltas = {}
+        for operation in sorted(set(baseline[0]) & set(candidate[0])):
+            ratios = [after[operation] / before[operation] for before, after in zip(baseline, candidate)]
+            medians = sorted(statistics.median(rng.choices(ratios, k=len(ratios)))
+                             for _ in range(self.comparison_resamples))
+            deltas[operation] = {
+                'baseline_p50_ms': statistics.median(run[operation] for run in baseline) * 1000,
+                'candidate_p50_ms': statistics.median(run[operation] for run in candidate) * 1000,
+                'ratio': statistics.median(ratios),
+                'low': medians[int(0.025 * len(medians))],
+                'high': medians[int(0.975 * len(medians)) - 1],
+            }
+        return deltas
+
+    def build_binary(self, name, source):
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        binary = os.path.abspath(os.path.join(self.benchmark_results_dir, name))
+        subprocess.run(['go', 'build', '-o', binary, source], check=True)
+        return binary
+
+    # Creates a fresh stress database from the empty template with one card per name and returns
+    # {name: (number, pin)}.
+    def seed_stress_database(self, balances):
+        self.database_factory().clone('empty', self.stress_database_file_name)
+
+        cards = {}
+        connection = sqlite3.connect(self.stress_database_file_name)
+        with connection:
+            for i, (name, balance) in enumerate(balances.items()):
+                base = 400000 * 10 ** 9 + i
+                number = str(base * 10 + self.luhn_check_digit(base))
+                cards[name] = (number, f'{i % 10000:04d}')
+                connection.execute("INSERT INTO card (number, pin, balance) VALUES (?, ?, ?)",
+                                   (number, cards[name][1], balance))
+        connection.close()
+        return cards
+
+    def read_stress_balances(self):
+        connection = sqlite3.connect(self.stress_database_file_name)
+        balances = dict(connection.execute("SELECT number, balance FROM card"))
+        connection.close()
+        return balances
+
+    @staticmethod
+    def sqlx_transfer_script(card, to_card_number, amount, transfers):
+        number, pin = card
+        return f"2\n{number}\n{pin}\n" + f"3\n{to_card_number}\n{amount}\n" * transfers + "0\n0\n"
+
+    # Runs one sqlx variant process per script at the same time and returns
+    # ([(returncode, output)], elapsed seconds). Session i dumps its metrics to
+    # metrics_prefix + '.<i>.txt' when a prefix is given.
+    def run_sqlx_sessions(self, binary, scripts, *args, metrics_prefix=None):
+        results = [None] * len(scripts)
+        barrier = threading.Barrier(len(scripts) + 1)
+
+        def session(i, script):
+            command = [binary, '-fileName', self.stress_database_file_name, *args]
+            if metrics_prefix:
+                command += ['-metrics', f'{metrics_prefix}.{i}.txt']
+            process = subprocess.Popen(command,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       text=True)
+            barrier.wait()
+            output, _ = process.communicate(script)
+            results[i] = (process.returncode, output)
+
+        threads = [threading.Thread(target=session, args=(i, script)) for i, script in enumerate(scripts)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return results, time.perf_counter() - start
+
+    def count_statements_during_wrong_pin_logins(self, attempts):
+        if os.path.exists(self.metrics_file_name):
+            os.remove(self.metrics_file_name)
+
+        program = TestedProgram()
+        program.start(*self.args, '-metrics', self.metrics_file_name)
+
+        output = program.execute("1")
+
+        card_number_matcher = self.card_number_pattern.search(output)
+        pin_matcher = self.pin_pattern.search(output)
+
+        if not card_number_matcher or not pin_matcher:
+            return CheckResult.wrong("You should output card number and PIN like in example")
+
+        correct_card_number = card_number_matcher.group()
+        correct_pin = pin_matcher.group()
+
+        incorrect_pin = correct_pin
+        while correct_pin == incorrect_pin:
+            incorrect_pin = str(1000 + random.randint(0, 8999))
+
+        output = program.execute("\n".join(["2", correct_card_number, incorrect_pin] * attempts))
+
+        if "successfully" in output.lower():
+            return CheckResult.wrong("The user should not be signed in" +
+                                     " after entering incorrect card information.")
+
+        program.execute("2")
+        output = program.execute(correct_card_number + "\n" + correct_pin)
+
+        if "successfully" in output.lower():
+            return CheckResult.wrong("A card should stay locked after too many failed logins, "
+                                     "even if the correct PIN is entered afterwards.")
+
+        self.stop_and_check_if_user_program_was_stopped(program)
+
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute("SELECT COUNT(*) FROM login_lockouts WHERE number = ?", (correct_card_number,))
+            lockouts = cursor.fetchone()[0]
+            self.close_connection()
+        except sqlite3.Error:
+            raise Exception("Can't execute a query in your database! Make sure that your database isn't broken "
+                            "and you close your connection at the end of the program!")
+
+        if lockouts != 1:
+            return CheckResult.wrong("The lockout of the card should be saved in the login_lockouts table on exit.")
+
+        metrics = self.read_metrics()
+        return sum(value for (name, _), value in metrics.items() if name == 'banking_statement_count')
+
+    def replay_journal(self):
+        program = TestedProgram()
+        output = program.start(*self.args, 'replay')
+
+        if not program.is_finished():
+            return None
+
+        balances = {}
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and self.card_number_pattern.match(parts[0]) and parts[1].lstrip('-').isdigit():
+                balances[parts[0]] = int(parts[1])
+        return balances
+
+    # Runs the scenario_<name> method against a program started with CPU and heap profiling,
+    # and keeps the profiles and the metrics dump in the benchmark results directory.
+    def run_profiled_scenario(self, name):
+        scenario = getattr(self, 'scenario_' + name)
+
+        os.makedirs(self.benchmark_results_dir, exist_ok=True)
+        prefix = os.path.join(self.benchmark_results_dir, name)
+        profiles = {
+            'cpu': prefix + '.cpu.pprof',
+            'heap': prefix + '.heap.pprof',
+            'metrics': prefix + '.metrics.txt',
+        }
+
+        program = TestedProgram()
+        program.start(*self.args,
+                      '-cpuprofile', profiles['cpu'],
+                      '-memprofile', profiles['heap'],
+                      '-metrics', profiles['metrics'])
+        scenario(program)
+        self.stop_and_check_if_user_program_was_stopped(program)
+
+        return profiles
+
+    def scenario_create_and_transfer(self, program, accounts=50):
+        card_numbers = []
+        for _ in range(accounts):
+            output = program.execute("1")
+            card_numbers.append((self.card_number_pattern.search(output).group(),
+                                 self.pin_pattern.search(output).group()))
+
+        card_number, pin = card_numbers[0]
+        program.execute("2")
+        program.execute(card_number + "\n" + pin)
+        program.execute("2\n" + str(accounts * 100))
+        for to_transfer_card_number, _ in card_numbers[1:]:
+            program.execute("3\n" + to_transfer_card_number + "\n100")
+        program.execute("5")
+        return card_numbers
+
+    def read_metrics(self, path=None):
+        metrics = {}
+        with open(path or self.metrics_file_name) as file:
+            for line in file:
+                matcher = self.metric_line_pattern.match(line.strip())
+                if not matcher:
+                    continue
+                name, labels, value = matcher.groups()
+                labels = tuple(sorted((key, json.loads('"' + raw + '"'))
+                                      for key, raw in self.metric_label_pattern.findall(labels)))
+                metrics[(name, labels)] = int(value)
+        return metrics
+
     @staticmethod
     def get_connection():
         if SimpleBankSystemTest.connection is None:
@@ -698,6 +2476,11 @@ class SimpleBankSystemTest(StageTest):
 
         return True
 
+    def luhn_check_digit(self, base):
+        for digit in range(10):
+            if self.check_luhn_algorithm(str(base * 10 + digit)):
+                return digit
+
     @staticmethod
     def check_luhn_algorithm(card_number):
         result = 0
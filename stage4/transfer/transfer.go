@@ -0,0 +1,145 @@
+// Package transfer validates transfer requests before any money moves. The
+// checks run from the cheapest to the most expensive (syntax, Luhn, issuer
+// prefix, then a cached existence lookup), so malformed requests are rejected
+// without touching the database.
+package transfer
+
+import (
+	"errors"
+	"strings"
+	"sync"
+	"time"
+
+	"stage4/cardnumber"
+)
+
+var (
+	ErrSameAccount       = errors.New("transfer to the same account")
+	ErrMalformedNumber   = errors.New("malformed card number")
+	ErrUnknownCard       = errors.New("no such card")
+	ErrInvalidAmount     = errors.New("transfer amount must be positive")
+	ErrInsufficientFunds = errors.New("not enough money")
+)
+
+// DefaultNegativeTTL is how long a failed existence lookup is remembered.
+const DefaultNegativeTTL = 5 * time.Second
+
+// maxCachedNumbers bounds the existence cache; it is cleared once it is full.
+const maxCachedNumbers = 1 << 16
+
+// Pipeline validates the target and the amount of transfers.
+type Pipeline struct {
+	iin         string
+	lookup      func(number string) (bool, error)
+	negativeTTL time.Duration
+
+	mu      sync.Mutex
+	exists  map[string]struct{}
+	missing map[string]time.Time
+}
+
+// NewPipeline returns a Pipeline that accepts card numbers starting with iin
+// and checks their existence with lookup. Cards known to exist are cached
+// until Closed is called; unknown cards are cached for negativeTTL.
+func NewPipeline(iin string, lookup func(number string) (bool, error), negativeTTL time.Duration) *Pipeline {
+	return &Pipeline{
+		iin:         iin,
+		lookup:      lookup,
+		negativeTTL: negativeTTL,
+		exists:      make(map[string]struct{}),
+		missing:     make(map[string]time.Time),
+	}
+}
+
+// ValidateTarget checks that money may be sent from card number from to card
+// number to. Only the last step, and only on a cache miss, queries the
+// database.
+func (p *Pipeline) ValidateTarget(from, to string) error {
+	if _, ok := cardnumber.Parse(to); !ok {
+		return ErrMalformedNumber
+	}
+	if from == to {
+		return ErrSameAccount
+	}
+	if !cardnumber.Valid(to) {
+		return ErrMalformedNumber
+	}
+	if !strings.HasPrefix(to, p.iin) {
+		return ErrUnknownCard
+	}
+
+	exists, err := p.cardExists(to)
+	if err != nil {
+		return err
+	}
+	if !exists {
+		return ErrUnknownCard
+	}
+	return nil
+}
+
+// ValidateAmount checks amount against the balance known to the caller. The
+// debit itself must still be guarded in SQL, since the balance may be stale.
+func (p *Pipeline) ValidateAmount(balance, amount int) error {
+	if amount <= 0 {
+		return ErrInvalidAmount
+	}
+	if balance < amount {
+		return ErrInsufficientFunds
+	}
+	return nil
+}
+
+func (p *Pipeline) cardExists(number string) (bool, error) {
+	now := time.Now()
+
+	p.mu.Lock()
+	if _, ok := p.exists[number]; ok {
+		p.mu.Unlock()
+		return true, nil
+	}
+	if expires, ok := p.missing[number]; ok && now.Before(expires) {
+		p.mu.Unlock()
+		return false, nil
+	}
+	p.mu.Unlock()
+
+	exists, err := p.lookup(number)
+	if err != nil {
+		return false, err
+	}
+
+	p.mu.Lock()
+	defer p.mu.Unlock()
+
+	if len(p.exists)+len(p.missing) >= maxCachedNumbers {
+		p.exists = make(map[string]struct{})
+		p.missing = make(map[string]time.Time)
+	}
+	if exists {
+		p.exists[number] = struct{}{}
+	} else if p.negativeTTL > 0 {
+		p.missing[number] = now.Add(p.negativeTTL)
+	}
+	return exists, nil
+}
+
+// Created tells the pipeline that card number now exists.
+func (p *Pipeline) Created(number string) {
+	p.mu.Lock()
+	defer p.mu.Unlock()
+
+	delete(p.missing, number)
+	if len(p.exists) < maxCachedNumbers {
+		p.exists[number] = struct{}{}
+	}
+}
+
+// Closed tells the pipeline that card number no longer exists.
+func (p *Pipeline) Closed(number string) {
+	p.mu.Lock()
+	defer p.mu.Unlock()
+
+	delete(p.exists, number)
+	delete(p.missing, number)
+}